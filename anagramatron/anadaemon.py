@@ -5,9 +5,7 @@ import time
 import sys
 import random
 
-import requests
-
-from . import hitmanager, anagramfunctions, common
+from . import hitmanager, anagramfunctions, common, clients
 
 
 class Daemon(object):
@@ -48,10 +46,8 @@ class Daemon(object):
     def entertain_the_huddled_masses(self):
 
         # ah, experience, my old master
-        try:
-            requests.head('http://www.twitter.com')
-        except Exception as err:
-            print('server appears offline', err, sep='\n')
+        if clients.check_health() is None:
+            print('server appears offline')
             return
 
         # get most recent hit:
@@ -6,11 +6,13 @@ import time
 import multiprocessing
 from datetime import datetime
 
-from . import twitterhandler, stream, anagramfinder, hit_server, hitmanager
+from . import (twitterhandler, stream, anagramfinder, hit_server, hitmanager,
+               shardedfinder, runtime, enrichment, ingest, nearindex)
 from .anagramstats import StatTracker
 
 
-def run(server_only=False, **kwargs):
+def run(server_only=False, shards=0, use_asyncio=False, ingest_address=None,
+        cache_mb=None, near_anagrams=False, languages='en', **kwargs):
     try:
         import setproctitle
         setproctitle.setproctitle('anagramatron')
@@ -26,33 +28,65 @@ def run(server_only=False, **kwargs):
         hitserver.daemon = True
         hitserver.start()
 
-        hit_manager = hitmanager.HitDBManager(dbpath)
+        cache_budget = cache_mb * 1024 * 1024 if cache_mb else None
+        languages = languages.split(',')
+        kwargs['languages'] = languages
+
+        def make_finder(hit_callback):
+            if len(languages) > 1:
+                return shardedfinder.LanguageFinder(
+                    languages, storage='mdbm', hit_callback=hit_callback,
+                    cache_budget=cache_budget)
+            if shards:
+                return shardedfinder.ShardedAnagramFinder(
+                    shard_count=shards, storage='mdbm', hit_callback=hit_callback,
+                    cache_budget=cache_budget)
+            return anagramfinder.AnagramFinder(
+                languages=languages, storage='mdbm', hit_callback=hit_callback,
+                cache_budget=cache_budget,
+                near_hit_callback=nearindex.NearHitLog() if near_anagrams else None)
+
+        def make_stream_handler(**extra):
+            if ingest_address:
+                # the stream lives in a separate ingest process
+                return ingest.IngestClient(ingest_address, auto_ack=not use_asyncio)
+            return stream.StreamHandler(**dict(kwargs, **extra))
+
+        if use_asyncio:
+            stream_handler = make_stream_handler(poll_directs=False)
+            try:
+                return runtime.AsyncRuntime(stream_handler, make_finder, dbpath).run()
+            except KeyboardInterrupt:
+                return 0
+
+        hit_manager = hitmanager.HitDBManager(
+            dbpath, enrichment_workers=enrichment.ENRICHMENT_WORKERS)
 
         def handle_hit(p1, p2):
             hit_manager.new_hit(p1, p2)
 
-        anagram_finder = anagramfinder.AnagramFinder(storage='mdbm', hit_callback=handle_hit)
+        anagram_finder = make_finder(handle_hit)
+        anagram_finder.load.enrichment = hit_manager.enrichment
         stats = StatTracker()
+        stream_handler = None
         while 1:
             try:
-                print('starting stream handler', file=sys.stderr)
-                stream_handler = stream.StreamHandler(**kwargs)
-                stream_handler.start()
-                for processed_tweet in stream_handler:
-                    anagram_finder.handle_input(processed_tweet)
+                if stream_handler is None:
+                    print('starting stream handler', file=sys.stderr)
+                    stream_handler = make_stream_handler()
+                    stream_handler.start()
+                for batch in stream_handler.batches():
+                    anagram_finder.handle_batch(batch)
                     stats.print_stats()
 
-            except anagramfinder.NeedsMaintenance:
-                print('performing maintenance', file=sys.stderr)
-                stream_handler.close()
-                anagram_finder.perform_maintenance()
-
             except KeyboardInterrupt:
                 stream_handler.close()
                 anagram_finder.close()
+                hit_manager.close()
                 return 0
             except Exception as err:
                 stream_handler.close()
+                stream_handler = None
                 anagram_finder.close()
                 if hasattr(err, 'code') and err.code == 503:
                     time.sleep(60*5)
@@ -73,7 +107,22 @@ def main():
         action="store_true")
     parser.add_argument('--host', help="hostname for stream connection")
     parser.add_argument('--port', help="port for stream connection", type=int, default=8069)
+    parser.add_argument('--shards', type=int, default=0,
+                        help="split the finder across this many processes")
+    parser.add_argument('--asyncio', dest='use_asyncio', action="store_true",
+                        help="run stream, finder and hit handling as asyncio tasks")
+    parser.add_argument('--ingest', dest='ingest_address', metavar='ADDRESS',
+                        help="take tweets from an ingest service (python -m anagramatron.ingest)")
+    parser.add_argument('--cache-mb', type=int,
+                        help="memory for the candidate cache, split between shards")
+    parser.add_argument('--near', dest='near_anagrams', action="store_true",
+                        help="also log near anagrams, one letter off (not with --shards)")
+    parser.add_argument('--languages', default='en',
+                        help="comma separated languages; each gets its own finder process "
+                             "(not with --shards)")
     args = parser.parse_args()
+    if ',' in args.languages and args.shards:
+        parser.error('--languages and --shards cannot be combined')
 
     return run(**vars(args))
 
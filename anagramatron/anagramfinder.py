@@ -1,25 +1,27 @@
 # coding: utf-8
 
 from __future__ import print_function
+import itertools
 import os
 # import logging
 import multiprocessing
+import threading
+import time
 
-from . import multidbm, anagramfunctions, common, simpledatastore
+from . import (multidbm, anagramfunctions, common, simpledatastore, maintenance,
+               loadcontrol, nearindex, subsetindex)
 from .anagramstats import StatTracker
+from .languages import get_language
 
 
 DATA_PATH_COMPONENT = 'anagrammdbm'
 CACHE_PATH_COMPONENT = 'cachedump'
 
-
-class NeedsMaintenance(Exception):
-
-    """
-    hacky exception raised when AnagramFinder is no longer able to keep up.
-    use this to signal that we should shutdown and perform maintenance.
-    """
-    pass
+# with a cache budget, the size of every nth new cache entry is measured
+ENTRY_SAMPLE_INTERVAL = 100
+ENTRY_SIZE_SMOOTHING = 0.05
+MIN_CACHE_SIZE = 1000
+MAX_SHRINK_PER_TRIM = 50000  # bounds the pause when the cache target drops
 
 
 class AnagramFinder(object):
@@ -30,26 +32,49 @@ class AnagramFinder(object):
     It caches newly returned or requested candidates to memory,
     and maintains & manages a persistent database of older candidates.
 
-    :languages: a list of language identifiers. In future, multiple languages
-    might be supported. NOT IMPLEMENTED.
+    :languages: a list holding the code of the language we find anagrams in,
+    configured in common.ANAGRAM_LANGUAGES. each language needs its own
+    finder, with its own store; see shardedfinder.LanguageFinder.
     :storage: type of backing store. currently accepts None or 'mdbm'.
+    :path: location of the backing store.
+    :cachepath: where the cache is saved between runs, if storage is used.
     :hit_callback: a function to be called when an anagram is found.
     :test_func: a function called when an anagram is found.
     Should implement some heuristic and return True if the passed anagram is 'interesting'.
+    :load_control: if True, a LoadController (self.load) sheds work when
+    we fall behind. it is updated after each batch.
+    :max_candidates: the number of tweets kept for each key. a new tweet
+    is tested against all of them.
+    :near_hit_callback: if given, we also look for near anagrams, differing
+    by a single letter, and call this when one is found. exact hits are
+    preferred: an input that makes an exact hit is never reported as a near one.
+    :subset_index: if True, self.subsets indexes every candidate by the
+    letters it uses, for find_hidden_in() and find_containing(). stored
+    candidates are added in the background.
+    :cache_budget: memory, in bytes, for the cache. the number of entries
+    kept is adjusted as we measure how big entries are. without a budget,
+    we keep common.ANAGRAM_CACHE_SIZE entries.
     """
 
     def __init__(self, languages=['en'],
                  storage=None,
                  path=None,
+                 cachepath=None,
                  hit_callback=print,
-                 test_func=anagramfunctions.test_anagram):
-        """
-        language selection is not currently implemented
-        """
-        if languages != ['en']:
+                 test_func=anagramfunctions.test_anagram,
+                 load_control=True,
+                 cache_budget=common.ANAGRAM_CACHE_BUDGET,
+                 max_candidates=common.ANAGRAM_CANDIDATES_PER_KEY,
+                 near_hit_callback=None,
+                 subset_index=False):
+        if len(languages) != 1:
             raise NotImplementedError(
-                'languages other then \'en\' are not currently expected')
+                'a finder handles a single language; use a LanguageFinder for more')
         self.languages = languages
+        self.language = get_language(languages[0])
+        if self.language.code != common.ANAGRAM_DEFAULT_LANGUAGE and (
+                near_hit_callback or subset_index):
+            raise NotImplementedError('near anagrams and subset queries are english only')
         self._should_trim_cache = False
         self._write_process = None
         self._lock = multiprocessing.Lock()
@@ -57,14 +82,42 @@ class AnagramFinder(object):
         self.store_path = path or os.path.join(
             common.ANAGRAM_DATA_DIR,
             '%s_%s.db' % (DATA_PATH_COMPONENT, '_'.join(languages)))
-        self.cachepath = os.path.join(
+        self.cachepath = cachepath or os.path.join(
             common.ANAGRAM_DATA_DIR,
             '%s_%s.cache' % (CACHE_PATH_COMPONENT, '_'.join(languages)))
 
         self.hit_callback = hit_callback
         self.test_func = test_func
         self.cache, self.datastore = self.setup_storage(storage)
+        self.maintenance = None
+        if self.datastore is not None:
+            self.maintenance = maintenance.MaintenanceWorker(self.datastore)
         self.stats = StatTracker()
+        self.min_interest = 0
+        self.load = loadcontrol.LoadController(self) if load_control else None
+        self.max_candidates = max(1, max_candidates)
+        self.near_hit_callback = near_hit_callback
+        self.near = None
+        if near_hit_callback is not None:
+            self.near = nearindex.NearAnagramIndex(
+                self.cache, self.datastore, self.store_path if storage else None)
+        self.subsets = None
+        if subset_index:
+            self.subsets = subsetindex.SubsetIndex()
+            self.subsets.load_cache(self.cache)
+            if self.datastore is not None:
+                loader = threading.Thread(target=self.subsets.load_store,
+                                          args=(self.store_path,), name='subset-index')
+                loader.daemon = True
+                loader.start()
+        self.cache_budget = cache_budget
+        self.cache_size = common.ANAGRAM_CACHE_SIZE
+        self.entry_bytes = None
+        self._added = 0
+        if cache_budget:
+            for key in itertools.islice(self.cache.datastore, ENTRY_SAMPLE_INTERVAL):
+                self._sample_entry_size(key)
+        self.stats['cache_capacity'] = self.cache_size
 
     def setup_storage(self, storage_name):
         cache = simpledatastore.AnagramSimpleStore(self.cachepath if storage_name else None)
@@ -82,43 +135,177 @@ class AnagramFinder(object):
         and then self.hit_callback if test passes.
         """
         text = self._text_from_input(inp, text_key)
-        key = anagramfunctions.improved_hash(text)
+        key = anagramfunctions.improved_hash(text, language=self.language)
+        near = self._find_near([(inp, text, key)], text_key)
+        exact = self._handle(inp, text, key, text_key, self._fetch_stored)
+        self._report_near([inp], near, [0] if exact else [])
+        if self._should_trim_cache:
+            self._trim_cache()
+
+    def handle_batch(self, inputs, text_key="text"):
+        """
+        handles a list of inputs, like calling handle_input on each of them
+        in order, except that the cache is only trimmed once the whole batch
+        is done. inputs are hashed together, and every datastore lookup the
+        batch needs is made in a single pass over the datastore.
+        callbacks are made in input order.
+        """
+        start = time.time()
+        texts = [self._text_from_input(inp, text_key) for inp in inputs]
+        keys = [anagramfunctions.improved_hash(text, language=self.language) for text in texts]
+        fetch_stored = self._fetch_stored
+        if self.datastore is not None:
+            # the datastore doesn't change until the cache is trimmed,
+            # which we put off until the batch is done.
+            to_fetch = [k for k in keys if k not in self.cache]
+            lookup_start = time.time()
+            stored = self.datastore.get_many(to_fetch)
+            if to_fetch:
+                self.stats['lookup_latency'] = (time.time() - lookup_start) / len(to_fetch)
+            fetched = set(to_fetch)
+
+            def fetch_stored(key):
+                # a key that was cached when we prefetched can leave the
+                # cache, after a hit, before a later input looks for it
+                if key in fetched:
+                    return stored.get(key)
+                return self._fetch_stored(key)
+        near = self._find_near(list(zip(inputs, texts, keys)), text_key)
+        exact = set()
+        for idx, (inp, text, key) in enumerate(zip(inputs, texts, keys)):
+            if self._handle(inp, text, key, text_key, fetch_stored):
+                exact.add(idx)
+        self._report_near(inputs, near, exact)
+        self.stats['batches'] += 1
+        if self._should_trim_cache:
+            self._trim_cache()
+        if self.load is not None:
+            self.load.observe(len(inputs), time.time() - start)
+
+    def _handle(self, inp, text, key, text_key, fetch_stored):
+        """returns True if inp made a hit."""
         if key in self.cache:
 
             self.stats['cache_hits'] += 1
-            match = self.cache[key]
-            match_text = self._text_from_input(match, text_key)
-            if self.test_func(text, match_text):
-                del self.cache[key]
+            candidates = self.cache[key]
+            idx = self._find_match(text, candidates, text_key)
+            if idx is not None:
+                match = candidates.pop(idx)
+                if not candidates:
+                    del self.cache[key]
                 self.hit_callback(inp, match)
+                return True
             else:
                 # anagram, but fails tests (too similar)
-                self.cache[key] = inp
+                self.cache[key] = self._with_candidate(candidates, inp, text_key)
         else:
             # not in cache. in datastore?
-            if self.datastore and key in self.datastore:
-                self._process_hit(inp, key, text_key)
+            hit = fetch_stored(key)
+            if hit is not None:
+                return self._process_hit(inp, key, hit, text, text_key)
+            elif self.min_interest and anagramfunctions.interest_score(
+                    *anagramfunctions.hash_letter_stats(key)) < self.min_interest:
+                # we're behind, and this one is unlikely to be worth storing
+                self.stats['shed'] += 1
             else:
                 # not in datastore. add to cache
-                self.cache[key] = inp
+                self.cache[key] = [inp]
+                self._added += 1
+                if self.subsets is not None:
+                    self.subsets.add(key)
+                if self.cache_budget and self._added % ENTRY_SAMPLE_INTERVAL == 1:
+                    self._sample_entry_size(key)
                 self.stats['cache_size'] = len(self.cache)
-                if self.datastore and len(self.cache) > common.ANAGRAM_CACHE_SIZE:
-                    self._trim_cache()
+                if self.datastore is not None and len(self.cache) > self.cache_size:
+                    self._should_trim_cache = True
+        return False
+
+    def _sample_entry_size(self, key):
+        """updates our estimate of entry size, and the cache size to match."""
+        size = self.cache.entry_size(key)
+        if self.entry_bytes is None:
+            self.entry_bytes = size
+        else:
+            self.entry_bytes += ENTRY_SIZE_SMOOTHING * (size - self.entry_bytes)
+        self.cache_size = max(MIN_CACHE_SIZE, int(self.cache_budget / self.entry_bytes))
+        self.stats['cache_capacity'] = self.cache_size
+        self.stats['cache_entry_bytes'] = int(self.entry_bytes)
 
-    def _process_hit(self, inp, key, text_key):
+    def _find_near(self, items, text_key):
+        """
+        looks for near anagrams of items, before they are cached.
+        returns a dict of item index: match.
+        """
+        if self.near is None:
+            return dict()
+        return dict(self.near.find(items, lambda c: self._text_from_input(c, text_key)))
+
+    def _report_near(self, inputs, near, exact):
+        """reports near matches, except for inputs (by index) in exact, which made hits."""
+        for idx in sorted(near):
+            if idx in exact:
+                self.stats['near_superseded'] += 1
+            else:
+                self.near_hit_callback(inputs[idx], near[idx])
+
+    def find_hidden_in(self, text):
+        """returns a dict of hash: candidates, for candidates made from some of text's letters."""
+        key = anagramfunctions.improved_hash(text, language=self.language)
+        return self.subsets.candidates(self.subsets.hidden_in(key), self.cache, self.datastore)
+
+    def find_containing(self, text):
+        """returns a dict of hash: candidates, for candidates using all of text's letters."""
+        key = anagramfunctions.improved_hash(text, language=self.language)
+        return self.subsets.candidates(self.subsets.containing(key), self.cache, self.datastore)
+
+    def _fetch_stored(self, key):
+        if self.datastore is None:
+            return None
         try:
-            hit = self.datastore[key]
-            hit_text = self._text_from_input(hit, text_key)
-            text = self._text_from_input(inp, text_key)
+            return self.datastore[key]
+        except KeyError:
+            return None
         except (UnicodeDecodeError, ValueError):
             print('error decoding hit for key %s' % key)
-            self.cache[key] = inp
-            return
+            return None
+
+    def _process_hit(self, inp, key, hit, text, text_key):
+        candidates = anagramfunctions.decode_candidates(hit, key)
+        try:
+            idx = self._find_match(text, candidates, text_key)
+        except (UnicodeDecodeError, ValueError):
+            print('error decoding hit for key %s' % key)
+            self.cache[key] = [inp]
+            return False
         self.stats['possible_hits'] += 1
-        if self.test_func(text, hit_text):
-            self.hit_callback(inp, hit)
-        else:
-            self.cache[key] = inp
+        if idx is not None:
+            self.hit_callback(inp, candidates[idx])
+            return True
+        self.cache[key] = self._with_candidate(candidates, inp, text_key)
+        return False
+
+    def _find_match(self, text, candidates, text_key):
+        """returns the index of the first candidate that makes a hit with text, or None."""
+        for idx, candidate in enumerate(candidates):
+            if self.test_func(text, self._text_from_input(candidate, text_key)):
+                return idx
+        return None
+
+    def _with_candidate(self, candidates, inp, text_key):
+        """
+        adds inp to candidates, oldest first. if there are then too many,
+        drops the older of the two most similar, so that what we keep is
+        as varied as possible.
+        """
+        candidates = candidates + [inp]
+        while len(candidates) > self.max_candidates:
+            texts = [self._text_from_input(c, text_key) for c in candidates]
+            pairs = itertools.combinations(range(len(candidates)), 2)
+            older, newer = max(pairs, key=lambda p: anagramfunctions.candidate_similarity(
+                texts[p[0]], texts[p[1]]))
+            del candidates[older]
+            self.stats['candidates_evicted'] += 1
+        return candidates
 
     def _text_from_input(self, inp, key=None):
         LEGACY_KEY = 'tweet_text'
@@ -137,37 +324,58 @@ class AnagramFinder(object):
         self._should_trim_cache = False
 
         if not to_trim:
-            to_trim = min(10000, (common.ANAGRAM_CACHE_SIZE / 10))
+            to_trim = min(10000, (self.cache_size // 10))
+            # if our target shrank, catch up a step at a time
+            to_trim += min(MAX_SHRINK_PER_TRIM, max(0, len(self.cache) - self.cache_size))
 
         to_store = self.cache.least_used(to_trim)
         # write those caches to disk, delete from cache, add to hashes
         for x in to_store:
             self.datastore[x] = self.cache[x]
             del self.cache[x]
+        if self.near is not None:
+            self.near.add_stored(to_store)
+        # let readers in other processes see what we just wrote
+        self.datastore.sync()
+        self.stats['cache_trims'] += 1
 
-        buffer_size = self.stats['buffer']
-        if buffer_size > common.ANAGRAM_STREAM_BUFFER_SIZE:
-            print('raised needs maintenance')
-            raise NeedsMaintenance
+    def apply_load_level(self, level):
+        """
+        called by the LoadController. above LEVEL_SHALLOW, archived chunks
+        aren't searched; above LEVEL_SHED, low-interest new candidates
+        aren't stored.
+        """
+        if self.datastore is not None:
+            self.datastore.set_cold_lookups(level < loadcontrol.LEVEL_SHALLOW)
+        if level >= loadcontrol.LEVEL_SHED:
+            self.min_interest = common.ANAGRAM_SHED_INTEREST
+        else:
+            self.min_interest = 0
 
     def perform_maintenance(self):
         """
         called when we're not keeping up with input.
-        moves current database elsewhere and starts again with new db
+        schedules archiving of the oldest database chunk, which happens
+        in the background while we keep handling input.
         """
-        print("perform maintenance called")
-        # save our current cache to be restored after we run _setup (hacky)
-        moveddb = self.datastore.archive()
-        print('moved mdbm chunk: %s' % moveddb)
-        print('mdbm contains %s chunks' % self.datastore.section_count())
+        if self.maintenance is None:
+            return
+        if self.maintenance.schedule(maintenance.JOB_ARCHIVE):
+            print("perform maintenance called")
+            print('mdbm contains %s chunks' % self.datastore.section_count())
 
     def close(self):
         if self._write_process and self._write_process.is_alive():
             print('write process active. waiting.')
             self._write_process.join()
 
+        if self.near is not None:
+            self.near.close()
+        if self.maintenance:
+            print('waiting for maintenance to finish')
+            self.maintenance.close()
         self.cache.save()
-        if self.datastore:
+        if self.datastore is not None:
             self.datastore.close()
 
 
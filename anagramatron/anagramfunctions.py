@@ -1,9 +1,10 @@
 import re
-import unicodedata
 import json
 
 from .common import (ANAGRAM_LOW_CHAR_CUTOFF, ANAGRAM_LOW_UNIQUE_CHAR_CUTOFF,
-    ANAGRAM_ALPHA_RATIO_CUTOFF, ENGLISH_LETTER_FREQUENCIES)
+    ANAGRAM_ALPHA_RATIO_CUTOFF, ENGLISH_LETTER_FREQUENCIES,
+    ANAGRAM_INTEREST_FULL_LENGTH, ANAGRAM_INTEREST_FULL_UNIQUE, ANAGRAM_DEFAULT_LANGUAGE)
+from .languages import get_language
 
 ENGLISH_LETTER_LIST = sorted(ENGLISH_LETTER_FREQUENCIES.keys(),
                              key=lambda t: ENGLISH_LETTER_FREQUENCIES[t])
@@ -25,27 +26,31 @@ def simple_hash(text, debug=False):
     return t_hash
 
 
-def improved_hash(text, debug=False):
+def improved_hash(text, debug=False, language=None):
     """
     only very *minorly* improved. sorts based on letter frequencies.
+    language is a languages.Language; by default, english.
     """
     CHR_COUNT_START = 64  # we convert to chars; char 65 is A
-    t_text = stripped_string(text)
-    t_hash = ''.join(sorted(t_text, key=lambda t: freqsort[t]))
+    letters, ranks = ENGLISH_LETTER_LIST, freqsort
+    if language is not None:
+        letters, ranks = language.letters, language.ranks
+    t_text = stripped_string(text, language=language)
+    t_hash = ''.join(sorted(t_text, key=lambda t: ranks[t]))
     letset = set(t_hash)
     break_letter = t_hash[-1:]
-    if break_letter not in ENGLISH_LETTER_LIST:
-        break_letter = ENGLISH_LETTER_LIST[-1]
+    if break_letter not in ranks:
+        break_letter = letters[-1]
     compressed_hash = ''
-    for letter in ENGLISH_LETTER_LIST:
+    for letter in letters:
         if letter in letset:
-            count = len(re.findall(letter, t_hash))
+            count = t_hash.count(letter)
             count = (count if count < 48 else 48)
             # this is a hacky way of sanity checking our values.
             # if this shows up as a match we'll ignore it
             compressed_hash += chr(count + CHR_COUNT_START)
         else:
-            if freqsort[letter] > freqsort[break_letter]:
+            if ranks[letter] > ranks[break_letter]:
                 if len(compressed_hash) % 2:
                     # an uneven number of bytes will cause unicode errors?
                     compressed_hash += chr(64)
@@ -70,6 +75,11 @@ def length_from_hash(in_hash):
     return length
 
 
+def hash_letter_stats(in_hash):
+    """like letter_stats, but from an improved hash."""
+    return length_from_hash(in_hash), sum(1 for c in in_hash if c != '@')
+
+
 def correct_encodings(text):
     """
     twitter auto converts &, <, > to &amp; &lt; &gt;
@@ -80,27 +90,9 @@ def correct_encodings(text):
     return text
 
 
-def _strip_accents(s):
-    return ''.join(c for c in unicodedata.normalize('NFD', s)
-                   if unicodedata.category(c) != 'Mn')
-
-
-def _text_contains_tricky_chars(text):
-    if re.search(r'[\u0080-\u024F]', text):
-        return True
-    return False
-
-
-def _text_decodes_to_ascii(text):
-    try:
-        text.encode('ascii')
-    except UnicodeEncodeError:
-        return False
-    return True
-
-
-def _basic_filters(tweet):
-    if tweet.get('lang') != 'en':
+def _basic_filters(tweet, language=None):
+    language = language or get_language()
+    if tweet.get('lang') != language.code:
         return False
     if len(tweet.get('entities').get('user_mentions')) is not 0:
         return False
@@ -112,7 +104,7 @@ def _basic_filters(tweet):
         return False
     if re.search(r'[0-9]', tweet['text']):
         return False
-    t = stripped_string(tweet['text'])
+    t = stripped_string(tweet['text'], language=language)
     if len(t) <= ANAGRAM_LOW_CHAR_CUTOFF:
         return False
     # ignore tweets with few characters
@@ -122,34 +114,30 @@ def _basic_filters(tweet):
     return True
 
 
-def _low_letter_ratio(text, cutoff=0.8):
-    t = re.sub(r'[^a-zA-Z .,!?"\']', '', text)
-    if (float(len(t)) / len(text)) < cutoff:
-        return True
-    return False
-
-
-def filter_tweet(tweet):
+def filter_tweet(tweet, language=None):
     """
-    filters out anagram-inappropriate tweets.
+    filters out anagram-inappropriate tweets in language, a
+    languages.Language (by default, english).
     Returns the original tweet object and cleaned tweet text on success.
+    candidates in languages other than the default are tagged with 'lang'.
     """
-    if not _basic_filters(tweet):
+    language = language or get_language()
+    if not _basic_filters(tweet, language):
         return False
 
-    tweet_text = correct_encodings(tweet.get('text'))
-    if not _text_decodes_to_ascii(tweet_text):
-        # check for latin chars:
-        if _text_contains_tricky_chars(tweet_text):
-            tweet_text = _strip_accents(tweet_text)
+    # strip accents from letters that aren't in the alphabet
+    tweet_text = language.normalize(correct_encodings(tweet.get('text')))
 
-    if _low_letter_ratio(tweet_text, ANAGRAM_ALPHA_RATIO_CUTOFF):
+    if language.letter_ratio(tweet_text) < ANAGRAM_ALPHA_RATIO_CUTOFF:
         return False
 
-    return {'anagram_hash': improved_hash(tweet_text),
-            'tweet_id': int(tweet['id_str']),
-            'text': tweet_text
-            }
+    candidate = {'anagram_hash': improved_hash(tweet_text, language=language),
+                 'tweet_id': int(tweet['id_str']),
+                 'text': tweet_text
+                 }
+    if language.code != ANAGRAM_DEFAULT_LANGUAGE:
+        candidate['lang'] = language.code
+    return candidate
 
 
 def test_anagram(one, two):
@@ -167,17 +155,34 @@ def test_anagram(one, two):
     return True
 
 
-def _char_diff_test(one, two, cutoff=0.3):
+def test_near_anagram(one, two):
+    """
+    like test_anagram, for texts whose letters differ by one added or removed.
+    """
+    if abs(len(stripped_string(one)) - len(stripped_string(two))) != 1:
+        return False
+    if not _char_diff_test(one, two, same_length=False):
+        return False
+    if not _word_diff_test(one, two):
+        return False
+    if not _combined_words_test(one, two):
+        return False
+    if not one_test_to_rule_them(one, two):
+        return False
+    return True
+
+
+def _char_diff_test(one, two, cutoff=0.3, same_length=True):
     """
     basic test, looks for similarity on a char by char basis
     """
     stripped_one = stripped_string(one)
     stripped_two = stripped_string(two)
 
-    total_chars = len(stripped_two)
+    total_chars = min(len(stripped_one), len(stripped_two))
     same_chars = 0
 
-    if not total_chars or len(stripped_one) != len(stripped_two):
+    if not total_chars or (same_length and len(stripped_one) != len(stripped_two)):
         return False
 
     for i in range(total_chars):
@@ -269,12 +274,26 @@ def grade_anagram(hit):
     an attempt to come up with a numerical value that expresses an anagrams
     potential 'interestingness'.
     """
-    t1 = hit['tweet_one']['text']
+    return letter_stats(hit['tweet_one']['text'])
+
+
+def letter_stats(text):
+    """returns the number of letters, and of unique letters, in text."""
+    stripped = stripped_string(text)
+    return len(stripped), len(set(stripped))
 
-    letter_count = len(stripped_string(t1))
-    unique_letters = len(set(stripped_string(t1)))
 
-    return letter_count, unique_letters
+def interest_score(letter_count, unique_letters):
+    """
+    a cheap guess, from 0 to 1, at how likely a candidate is to be part
+    of a postable anagram. short texts, and texts with few different
+    letters, score lowest. takes the values from letter_stats.
+    """
+    length = ((letter_count - ANAGRAM_LOW_CHAR_CUTOFF) /
+              float(ANAGRAM_INTEREST_FULL_LENGTH - ANAGRAM_LOW_CHAR_CUTOFF))
+    diversity = ((unique_letters - ANAGRAM_LOW_UNIQUE_CHAR_CUTOFF) /
+                 float(ANAGRAM_INTEREST_FULL_UNIQUE - ANAGRAM_LOW_UNIQUE_CHAR_CUTOFF))
+    return (min(1, max(0, length)) + min(1, max(0, diversity))) / 2
 
 
 def format_seconds(seconds):
@@ -292,10 +311,12 @@ def format_seconds(seconds):
     return time_string
 
 
-def stripped_string(text, spaces=False):
+def stripped_string(text, spaces=False, language=None):
     """
     returns lower case string with all non alpha chars removed
     """
+    if language is not None:
+        return language.stripped(text, spaces)
     if spaces:
         text = re.sub(r'[_-]', ' ', text)  # replace dashes and underbars
         return re.sub(r'[^a-zA-Z ]', '', text).lower()
@@ -311,5 +332,39 @@ def decode_tweet(tweet_str):
     assert isinstance(tweet_str, str), "%s %s" % (type(tweet_str), tweet_str)
     return json.loads(tweet_str)
 
+
+def encode_candidates(candidates):
+    """
+    encodes a list of tweets (or strings) that share an anagram hash.
+    a single tweet is encoded as encode_tweet would, as stores always have;
+    for more, the shared anagram_hash is left out.
+    """
+    if len(candidates) == 1:
+        candidate = candidates[0]
+        return encode_tweet(candidate) if isinstance(candidate, dict) else candidate
+    compact = [dict((k, v) for k, v in c.items() if k != 'anagram_hash')
+               if isinstance(c, dict) else c for c in candidates]
+    return json.dumps(compact, separators=(',', ':'))
+
+
+def decode_candidates(value, anagram_hash):
+    """takes a decoded stored value and returns its list of candidates."""
+    if not isinstance(value, list):
+        return [value]
+    return [dict(c, anagram_hash=anagram_hash) if isinstance(c, dict) else c
+            for c in value]
+
+
+def candidate_similarity(one, two):
+    """
+    the overlap, from 0 to 1, between the sets of words in two texts.
+    cheap; used to spot candidates that are near copies of each other.
+    """
+    words_one = set(stripped_string(one, spaces=True).split())
+    words_two = set(stripped_string(two, spaces=True).split())
+    if not words_one or not words_two:
+        return 1.0 if words_one == words_two else 0.0
+    return len(words_one & words_two) / float(len(words_one | words_two))
+
 if __name__ == "__main__":
     pass
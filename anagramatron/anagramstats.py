@@ -8,14 +8,20 @@ from . import anagramfunctions
 
 
 class StatTracker(object):
+    """
+    process-wide counters. every StatTracker() is the same instance, and
+    only the first starts the counters: anything can take a handle to them
+    without resetting a running process's stats.
+    """
     __instance = None
 
     def __new__(cls):
         if StatTracker.__instance is None:
             StatTracker.__instance = object.__new__(cls)
+            StatTracker.__instance.reset()
         return StatTracker.__instance
 
-    def __init__(self):
+    def reset(self):
         self.start_time = time.time()
         self.stats = defaultdict(int)
 
@@ -34,10 +40,11 @@ class StatTracker(object):
             ((self['possible_hits'] + self['fetch_pool_size'] + self['cache_hits']) or 1)
             ) * 100
         status = "seen %s, used (%0.1f%%), hits %s, cache hits (%0.1f%%), \
-agrams %d, cachesize %s, buffer %d, runtime %s" % (
+agrams %d, cachesize %s, buffer %d, load %d, runtime %s" % (
             format_number(self['tweets_seen']), seen_perc,
             format_number(self['possible_hits'] + self['fetch_pool_size']),
             cache_hit_perc, self['hits'], format_number(self['cache_size']), self['buffer'],
+            self['load_level'],
             anagramfunctions.format_seconds(runtime)
             )
         return status
@@ -52,6 +59,7 @@ agrams %d, cachesize %s, buffer %d, runtime %s" % (
             'passed_filter': self['passed_filter'],
             'possible_hits': self['possible_hits'],
             'hits': self['hits'],
+            'load_level': self['load_level'],
             'start_time': self.start_time
         }
 
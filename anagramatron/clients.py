@@ -0,0 +1,113 @@
+# coding: utf-8
+"""
+process-wide clients for the services we talk to.
+
+building a client for every request means a new TCP connection and TLS
+handshake each time. clients here are built once per process and
+reused; requests-based clients keep their connections alive in a pool.
+"""
+from __future__ import print_function
+
+import logging
+import os
+import threading
+import time
+
+import requests
+import tumblpy
+from requests.adapters import HTTPAdapter
+from twitter.api import Twitter
+from twitter.oauth import OAuth
+from twitter.stream import TwitterStream
+
+from .twittercreds import (CONSUMER_KEY, CONSUMER_SECRET,
+                           ACCESS_KEY, ACCESS_SECRET)
+from .tumblrcreds import (TUMBLR_KEY, TUMBLR_SECRET,
+                          TOKEN_KEY, TOKEN_SECRET)
+
+HEALTH_CHECK_URL = 'http://www.twitter.com'
+HEALTH_CHECK_TIMEOUT = 10  # seconds
+POOL_SIZE = 8  # connections kept alive per host
+
+_lock = threading.Lock()
+_clients = dict()
+_pid = None
+
+
+def _get(name, factory):
+    global _pid
+    with _lock:
+        # connections can't be shared with a forked process
+        if _pid != os.getpid():
+            _clients.clear()
+            _pid = os.getpid()
+        client = _clients.get(name)
+        if client is None:
+            client = factory()
+            _clients[name] = client
+        return client
+
+
+def _pooled(session):
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _oauth():
+    return OAuth(ACCESS_KEY, ACCESS_SECRET, CONSUMER_KEY, CONSUMER_SECRET)
+
+
+def http_session():
+    """a requests.Session for plain http calls."""
+    return _get('http', lambda: _pooled(requests.Session()))
+
+
+def twitter():
+    """the Twitter REST client."""
+    return _get('twitter', lambda: Twitter(auth=_oauth(), api_version='1.1'))
+
+
+def twitter_stream():
+    return _get('twitter_stream', lambda: TwitterStream(auth=_oauth(), api_version='1.1'))
+
+
+def tumblr():
+    """the Tumblpy client. its requests session keeps connections alive."""
+    def make():
+        client = tumblpy.Tumblpy(app_key=TUMBLR_KEY,
+                                 app_secret=TUMBLR_SECRET,
+                                 oauth_token=TOKEN_KEY,
+                                 oauth_token_secret=TOKEN_SECRET)
+        _pooled(client.client)
+        return client
+    return _get('tumblr', make)
+
+
+def reset(name=None):
+    """
+    drops the named client, or all of them, so that the next call
+    builds a fresh one. use after a client gets into a bad state.
+    """
+    with _lock:
+        names = [name] if name else list(_clients)
+        for n in names:
+            client = _clients.pop(n, None)
+            session = client if isinstance(client, requests.Session) else getattr(client, 'client', None)
+            if isinstance(session, requests.Session):
+                session.close()
+
+
+def check_health(url=HEALTH_CHECK_URL, timeout=HEALTH_CHECK_TIMEOUT):
+    """
+    makes a HEAD request on a pooled connection.
+    returns the request's latency in seconds, or None if it failed.
+    """
+    start = time.time()
+    try:
+        http_session().head(url, timeout=timeout, allow_redirects=False)
+    except requests.RequestException as err:
+        logging.warning('health check of %s failed: %s' % (url, err))
+        return None
+    return time.time() - start
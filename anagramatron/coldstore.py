@@ -0,0 +1,275 @@
+from __future__ import print_function
+import dbm.gnu as gdbm
+import hashlib
+import logging
+import math
+import os
+import pickle
+import time
+import zlib
+
+from .anagramstats import StatTracker
+from .common import ANAGRAM_COLD_LOOKUP_BUDGET, ANAGRAM_COLD_FILTER_ERROR_RATE
+
+COLD_EXTENSION = '.cold'
+FILTER_EXTENSION = '.bloom'
+
+
+class BloomFilter(object):
+    """
+    a compact probabilistic set. answers 'definitely not' or 'maybe'.
+    used to skip disk lookups in cold chunks for keys they don't contain.
+    """
+
+    def __init__(self, capacity, error_rate=ANAGRAM_COLD_FILTER_ERROR_RATE):
+        capacity = max(1, capacity)
+        self.size = int(-capacity * math.log(error_rate) / (math.log(2) ** 2)) + 1
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def __contains__(self, key):
+        for idx in self._indexes(key):
+            if not self.bits[idx >> 3] & (1 << (idx & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+    def add(self, key):
+        for idx in self._indexes(key):
+            self.bits[idx >> 3] |= 1 << (idx & 7)
+        self.count += 1
+
+    def _indexes(self, key):
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump({'size': self.size,
+                         'hashes': self.hashes,
+                         'count': self.count,
+                         'bits': bytes(self.bits)}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            saved = pickle.load(f)
+        bloom = cls.__new__(cls)
+        bloom.size = saved['size']
+        bloom.hashes = saved['hashes']
+        bloom.count = saved['count']
+        bloom.bits = bytearray(saved['bits'])
+        return bloom
+
+
+class ColdChunk(object):
+    """
+    a read-only, compressed archived chunk, with an in-memory
+    membership filter so that most misses never touch the disk.
+    """
+
+    def __init__(self, path, flag='r'):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.bloom = BloomFilter.load(path + FILTER_EXTENSION)
+        self._db = gdbm.open(path, flag)
+
+    def __contains__(self, key):
+        return key in self.bloom and key in self._db
+
+    def might_contain(self, key):
+        return key in self.bloom
+
+    def iterkeys(self):
+        k = self._db.firstkey()
+        while k is not None:
+            yield k
+            k = self._db.nextkey(k)
+
+    def get_raw(self, key):
+        """returns the compressed value for key, or None."""
+        try:
+            return self._db[key]
+        except KeyError:
+            return None
+
+    def get(self, key):
+        """returns the decompressed value for key, or None."""
+        try:
+            raw = self._db[key]
+        except KeyError:
+            return None
+        return zlib.decompress(raw).decode('utf-8')
+
+    def close(self):
+        self._db.close()
+
+
+def convert_chunk(src_path, skip_keys=(), checkpoint=None):
+    """
+    converts an archived hot chunk at src_path into a cold chunk.
+    returns the path of the new chunk; the source file is left in place.
+    checkpoint, if given, is called every few thousand keys with (done, total).
+    """
+    src = gdbm.open(src_path, 'r')
+    dest_path = os.path.splitext(src_path)[0] + COLD_EXTENSION
+    skip = set(k.encode('utf-8') if isinstance(k, str) else k for k in skip_keys)
+    total = len(src)
+
+    def entries():
+        done = 0
+        k = src.firstkey()
+        while k is not None:
+            if k not in skip:
+                yield k, zlib.compress(src[k])
+            done += 1
+            if checkpoint and not done % 5000:
+                checkpoint(done, total)
+            k = src.nextkey(k)
+
+    try:
+        write_chunk(dest_path, entries(), total)
+    finally:
+        src.close()
+    return dest_path
+
+
+def write_chunk(dest_path, entries, capacity):
+    """
+    writes (key, compressed value) pairs to a new cold chunk at dest_path,
+    with a filter sized for capacity keys. the chunk only appears at
+    dest_path once it is complete. returns the number of keys written.
+    """
+    tmp_path = dest_path + '.tmp'
+    bloom = BloomFilter(capacity)
+    dest = gdbm.open(tmp_path, 'n')
+    try:
+        for k, compressed in entries:
+            dest[k] = compressed
+            bloom.add(k)
+        dest.reorganize()
+    finally:
+        dest.close()
+
+    bloom.save(dest_path + FILTER_EXTENSION)
+    os.rename(tmp_path, dest_path)
+    logging.debug('wrote cold chunk %s with %i keys' % (dest_path, len(bloom)))
+    return len(bloom)
+
+
+class ColdStore(object):
+    """
+    the collection of cold chunks in an mdbm archive directory.
+    lookups go newest-first and give up once the latency budget is spent.
+    a budget of 0 turns lookups off.
+    """
+
+    def __init__(self, path, budget=ANAGRAM_COLD_LOOKUP_BUDGET, names=None, flag='r'):
+        self.path = path
+        self.budget = budget
+        self.flag = flag
+        self.chunks = []
+        self.stats = StatTracker()
+        self._last = (None, None)
+        self._load(names)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def _load(self, names=None):
+        """
+        opens the named chunks, which should be ordered oldest first.
+        without names, opens every cold chunk in our path.
+        """
+        if not os.path.exists(self.path):
+            return
+        if names is None:
+            names = [n for n in os.listdir(self.path) if n.endswith(COLD_EXTENSION)]
+            names = sorted(names, key=lambda n: os.path.getmtime(os.path.join(self.path, n)))
+        # _open_chunk inserts at the front, leaving the newest chunk first
+        for name in names:
+            self._open_chunk(os.path.join(self.path, name))
+
+    def _open_chunk(self, path):
+        try:
+            self.chunks.insert(0, ColdChunk(path, self.flag))
+        except Exception as err:
+            print('error loading cold chunk: %s' % path, err)
+
+    def add_oldest(self, path):
+        """opens a cold chunk that is older than every other."""
+        try:
+            self.chunks.append(ColdChunk(path, self.flag))
+        except Exception as err:
+            print('error loading cold chunk: %s' % path, err)
+        self._last = (None, None)
+
+    def add_archived(self, src_path, skip_keys=()):
+        """converts a newly archived chunk and makes it queryable."""
+        try:
+            cold_path = convert_chunk(src_path, skip_keys)
+        except Exception as err:
+            print('failed to convert %s to cold chunk: %s' % (src_path, err))
+            return None
+        self.add_converted(src_path, cold_path)
+        return cold_path
+
+    def add_converted(self, src_path, cold_path):
+        """replaces the archived chunk at src_path with its converted version."""
+        os.remove(src_path)
+        self._open_chunk(cold_path)
+        self._last = (None, None)
+
+    def drop(self, name):
+        """closes the named chunk and deletes its files."""
+        for chunk in self.chunks:
+            if chunk.name == name:
+                chunk.close()
+                self.chunks.remove(chunk)
+                break
+        self._last = (None, None)
+        path = os.path.join(self.path, name)
+        os.remove(path)
+        os.remove(path + FILTER_EXTENSION)
+
+    def lookup(self, key, chunk_filter=None):
+        """
+        returns the stored value for key, or None.
+        chunks whose filter rejects the key are skipped without I/O,
+        as are chunks for which chunk_filter(chunk) is False.
+        """
+        if self.budget <= 0:
+            return None
+        if chunk_filter is None and self._last[0] == key:
+            return self._last[1]
+        start = time.time()
+        value = None
+        for chunk in self.chunks:
+            if chunk_filter is not None and not chunk_filter(chunk):
+                continue
+            if not chunk.might_contain(key):
+                continue
+            if time.time() - start > self.budget:
+                self.stats['cold_budget_exceeded'] += 1
+                break
+            self.stats['cold_probes'] += 1
+            value = chunk.get(key)
+            if value is not None:
+                self.stats['cold_hits'] += 1
+                break
+            self.stats['cold_false_positives'] += 1
+        if chunk_filter is None:
+            self._last = (key, value)
+        return value
+
+    def close(self):
+        for chunk in self.chunks:
+            chunk.close()
+        self.chunks = []
@@ -21,13 +21,36 @@ if not os.path.exists(ANAGRAM_DATA_DIR):
 ANAGRAM_BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 ANAGRAM_SEC_DIR = os.path.join(ANAGRAM_BASE_DIR, 'sec')
 
-ANAGRAM_CACHE_SIZE = 200000
+ANAGRAM_CACHE_SIZE = 200000  # entries, used when there's no cache budget
+ANAGRAM_CACHE_BUDGET = None  # bytes; the cache is sized to fit, if set
+ANAGRAM_CANDIDATES_PER_KEY = 4  # tweets kept for each anagram hash
+ANAGRAM_NEAR_FILTER_CAPACITY = 10000000  # stored keys the near anagram filter is sized for
 ANAGRAM_STREAM_BUFFER_SIZE = 20000
+ANAGRAM_BATCH_SIZE = 500  # max tweets handed to the finder at once
+
+# archived chunks are only searched when hot chunks miss
+ANAGRAM_COLD_LOOKUP_BUDGET = 0.005  # seconds
+ANAGRAM_COLD_FILTER_ERROR_RATE = 0.01
+
+# mdbm generations are dropped whole once older than this, or while the
+# store is bigger than this. None disables either limit.
+ANAGRAM_GENERATION_MAX_AGE = None  # seconds
+ANAGRAM_STORE_MAX_BYTES = None
 
 ANAGRAM_LOW_CHAR_CUTOFF = 16
 ANAGRAM_LOW_UNIQUE_CHAR_CUTOFF = 11
 ANAGRAM_ALPHA_RATIO_CUTOFF = 0.85
 
+# candidates this long, with this many different letters, are as
+# interesting as candidates get; see anagramfunctions.interest_score.
+ANAGRAM_INTEREST_FULL_LENGTH = 40
+ANAGRAM_INTEREST_FULL_UNIQUE = 20
+# as the stream backlog grows, tweets scoring below a floor are dropped at
+# the filter; the floor rises to this. 0 never drops tweets.
+ANAGRAM_INTEREST_FLOOR_MAX = 0.5
+# under load, the finder doesn't store new candidates scoring below this
+ANAGRAM_SHED_INTEREST = 0.25
+
 ANAGRAM_POST_INTERVAL = 150  # minutes
 
 # STORAGE_DIRECTORY_PATH = 'data/'
@@ -61,3 +84,15 @@ ENGLISH_LETTER_FREQUENCIES = {
     'z': 26
 }
 
+
+# per-language pipelines. letters are listed most frequent first, which
+# is the order they appear in anagram hashes. accents are stripped from
+# any other letter; replacements are made before that.
+ANAGRAM_LANGUAGES = {
+    'en': {'letters': ''.join(sorted(ENGLISH_LETTER_FREQUENCIES,
+                                     key=ENGLISH_LETTER_FREQUENCIES.get))},
+    'es': {'letters': 'eaosrnidlctumpbgvyqhfzjñxwk'},
+    'fr': {'letters': 'esaitnrulodcpmvqfbghjxyzwk',
+           'replacements': {'œ': 'oe', 'æ': 'ae'}},
+}
+ANAGRAM_DEFAULT_LANGUAGE = 'en'
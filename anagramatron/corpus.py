@@ -0,0 +1,289 @@
+# coding: utf-8
+"""
+finds anagrams in a large, fixed corpus, without an AnagramFinder.
+
+lines are read from jsonl, plain text or gzipped files, and hashed in
+worker processes. (key, record) lines are sorted in memory in runs of
+a bounded size and written to disk; the runs are then merged, and
+records sharing a key are tested against each other. memory use is
+bounded by the run size, whatever the size of the corpus.
+
+    python -m anagramatron.corpus tweets-*.jsonl.gz --out hits.jsonl
+"""
+from __future__ import print_function
+
+import gzip
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from collections import deque
+
+from . import anagramfunctions
+from .common import ANAGRAM_LOW_CHAR_CUTOFF, ANAGRAM_LOW_UNIQUE_CHAR_CUTOFF
+from .languages import get_language
+
+CHUNK_LINES = 5000  # lines hashed per worker task
+RUN_SIZE = 1000000  # records sorted in memory at once
+MERGE_FAN_IN = 128  # runs merged at once; more are merged in passes
+MAX_GROUP = 50  # distinct texts compared for a single key
+REPORT_INTERVAL = 10  # seconds
+
+
+class CorpusStats(object):
+
+    def __init__(self):
+        self.start = time.time()
+        self.phase_start = self.start
+        self.phases = []
+        self.counts = dict()
+        self._last_report = self.start
+
+    def count(self, key, value=1):
+        self.counts[key] = self.counts.get(key, 0) + value
+
+    def end_phase(self, name):
+        now = time.time()
+        self.phases.append((name, now - self.phase_start))
+        self.phase_start = now
+
+    def report(self, force=False):
+        """prints throughput to stderr, at most every REPORT_INTERVAL."""
+        now = time.time()
+        if not force and now - self._last_report < REPORT_INTERVAL:
+            return
+        self._last_report = now
+        elapsed = max(now - self.start, 0.001)
+        print('%s, %i lines/s' % (', '.join('%s %i' % (k, v) for k, v in
+                                            sorted(self.counts.items())),
+                                  self.counts.get('lines', 0) / elapsed), file=sys.stderr)
+
+    def summary(self):
+        lines = ['%-8s %s' % (name, anagramfunctions.format_seconds(seconds))
+                 for name, seconds in self.phases]
+        total = time.time() - self.start
+        lines.append('total    %s, %i lines/s' % (
+            anagramfunctions.format_seconds(total),
+            self.counts.get('lines', 0) / max(total, 0.001)))
+        return '\n'.join(lines)
+
+
+def open_corpus(path):
+    """opens a corpus file for reading as text, or stdin for '-'."""
+    if path == '-':
+        return sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, encoding='utf-8', errors='replace')
+
+
+def read_lines(paths):
+    for path in paths:
+        f = open_corpus(path)
+        try:
+            for line in f:
+                yield line
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def hash_chunk(lines, fmt='auto', text_key='text', language_code=None):
+    """
+    returns a list of 'key<tab>record' lines for the lines that are worth
+    comparing. the record is the json line as given, or a json string for
+    plain text. runs in a worker process.
+    """
+    language = get_language(language_code)
+    found = []
+    for line in lines:
+        line = line.rstrip('\n')
+        if not line.strip():
+            continue
+        if fmt == 'jsonl' or (fmt == 'auto' and line.startswith('{')):
+            try:
+                text = json.loads(line).get(text_key)
+            except (ValueError, AttributeError):
+                continue
+            record = line
+        else:
+            text, record = line, json.dumps(line)
+        if not text:
+            continue
+        text = language.normalize(anagramfunctions.correct_encodings(text))
+        stripped = anagramfunctions.stripped_string(text, language=language)
+        if (len(stripped) <= ANAGRAM_LOW_CHAR_CUTOFF or
+                len(set(stripped)) <= ANAGRAM_LOW_UNIQUE_CHAR_CUTOFF):
+            continue
+        key = anagramfunctions.improved_hash(text, language=language)
+        found.append('%s\t%s\n' % (key, record))
+    return found
+
+
+def hashed_lines(lines, pool, jobs, **options):
+    """
+    yields hashed lines from the worker pool, in order. at most a couple
+    of chunks per worker are in flight, so we don't read ahead of them.
+    """
+    pending = deque()
+    for chunk in _chunks(lines, CHUNK_LINES):
+        pending.append(pool.apply_async(hash_chunk, (chunk,), options))
+        if len(pending) >= jobs * 2:
+            for hashed in pending.popleft().get():
+                yield hashed
+    while pending:
+        for hashed in pending.popleft().get():
+            yield hashed
+
+
+def write_runs(hashed, run_dir, stats, run_size=RUN_SIZE):
+    """sorts hashed lines in runs of run_size, returning the paths of the runs."""
+    paths = []
+    for run in _chunks(hashed, run_size):
+        run.sort()
+        path = os.path.join(run_dir, 'run%06d' % len(paths))
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(run)
+        paths.append(path)
+        stats.count('runs')
+        stats.count('candidates', len(run))
+        stats.report()
+    return paths
+
+
+def merged(paths, run_dir, fan_in=MERGE_FAN_IN):
+    """
+    yields the lines of sorted runs in order. if there are more than
+    fan_in runs, they're merged into fewer, larger runs first.
+    """
+    generation = 0
+    while len(paths) > fan_in:
+        generation += 1
+        merged_paths = []
+        for i in range(0, len(paths), fan_in):
+            path = os.path.join(run_dir, 'merge%02d-%06d' % (generation, len(merged_paths)))
+            with open(path, 'w', encoding='utf-8') as out:
+                out.writelines(_merge(paths[i:i + fan_in]))
+            for old in paths[i:i + fan_in]:
+                os.remove(old)
+            merged_paths.append(path)
+        paths = merged_paths
+    for line in _merge(paths):
+        yield line
+
+
+def _merge(paths):
+    # keys never contain tabs, and sort after them, so lines sort by key
+    files = [open(path, encoding='utf-8') for path in paths]
+    try:
+        for line in heapq.merge(*files):
+            yield line
+    finally:
+        for f in files:
+            f.close()
+
+
+def find_pairs(lines, stats, test_func=anagramfunctions.test_anagram, text_key='text'):
+    """
+    takes sorted hashed lines, and yields (record, record) for each pair
+    sharing a key that passes test_func. identical texts are compared once,
+    and at most MAX_GROUP distinct texts are compared for a key.
+    """
+    for key, group in itertools.groupby(lines, key=lambda line: line.split('\t', 1)[0]):
+        seen = []  # (text, record)
+        texts = set()
+        for line in group:
+            record = json.loads(line.split('\t', 1)[1])
+            text = record.get(text_key) if isinstance(record, dict) else record
+            if text in texts:
+                continue
+            if len(seen) >= MAX_GROUP:
+                stats.count('group_overflow')
+                break
+            texts.add(text)
+            for other_text, other in seen:
+                stats.count('pairs_tested')
+                if test_func(text, other_text):
+                    stats.count('hits')
+                    yield other, record
+            seen.append((text, record))
+        if len(seen) > 1:
+            stats.count('groups')
+        stats.report()
+
+
+def run(paths, out, fmt='auto', text_key='text', language=None, jobs=None,
+        run_size=RUN_SIZE, tmp_dir=None):
+    """finds anagram pairs in the corpus at paths, writing them to out as jsonl."""
+    jobs = jobs or multiprocessing.cpu_count()
+    stats = CorpusStats()
+    run_dir = tempfile.mkdtemp(prefix='anagram-runs-', dir=tmp_dir)
+    pool = multiprocessing.Pool(jobs)
+    try:
+        lines = _counted(read_lines(paths), stats)
+        hashed = hashed_lines(lines, pool, jobs, fmt=fmt, text_key=text_key,
+                              language_code=language)
+        runs = write_runs(hashed, run_dir, stats, run_size)
+        stats.end_phase('hashing')
+        pool.close()
+        for one, two in find_pairs(merged(runs, run_dir), stats, text_key=text_key):
+            out.write(json.dumps({'tweet_one': one, 'tweet_two': two}) + '\n')
+        stats.end_phase('merging')
+    finally:
+        pool.terminate()
+        shutil.rmtree(run_dir, ignore_errors=True)
+    stats.report(force=True)
+    print(stats.summary(), file=sys.stderr)
+    return stats
+
+
+def _counted(lines, stats):
+    for line in lines:
+        stats.count('lines')
+        yield line
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="finds anagrams in jsonl, plain text or gzipped corpora")
+    parser.add_argument('paths', nargs='+', help="corpus files; '-' for stdin")
+    parser.add_argument('-o', '--out', help="file to write hits to (default: stdout)")
+    parser.add_argument('--format', dest='fmt', choices=('auto', 'jsonl', 'text'),
+                        default='auto')
+    parser.add_argument('--text-key', default='text', help="json key holding the text")
+    parser.add_argument('--language', default=None, help="language code (default: en)")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of hashing processes (default: cpu count)')
+    parser.add_argument('--run-size', type=int, default=RUN_SIZE,
+                        help="lines sorted in memory at once; bounds memory use")
+    parser.add_argument('--tmp', dest='tmp_dir', help="directory for sorted runs")
+    args = parser.parse_args()
+
+    out = open(args.out, 'w') if args.out else sys.stdout
+    try:
+        run(args.paths, out, fmt=args.fmt, text_key=args.text_key, language=args.language,
+            jobs=args.jobs, run_size=args.run_size, tmp_dir=args.tmp_dir)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    main()
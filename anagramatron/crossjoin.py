@@ -0,0 +1,263 @@
+# coding: utf-8
+"""
+recovers anagrams between tweets stored in different chunks of an mdbm
+store, which the live finder never compared: a tweet is only tested
+against what's stored under its key in the newest chunk that has it.
+
+every chunk (hot, archived and cold) is read without locks, so this can
+run while the store is in use. the key space is split into ranges, by
+sampling keys. each chunk's keys are then read once, by a worker that
+sorts them into a spill file for each range; a worker for each range
+merges its files, and only reads values for keys held by more than one
+chunk. new pairs are passed to HitDBManager.new_hit, newer tweet first.
+"""
+from __future__ import print_function
+
+import bisect
+import dbm.gnu as gdbm
+import heapq
+import itertools
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+
+from . import anagramfunctions, multidbm
+from .verify import _iter_entries, _iteration_limit
+
+SAMPLE_SIZE = 100000  # keys sampled to pick partition boundaries
+PARTITIONS_PER_JOB = 4
+SPILL_SIZE = 1000000  # keys a worker sorts in memory before writing them out
+
+
+def store_generations(mdbm_path):
+    """every generation in the store with a file we can read, oldest first."""
+    gens = multidbm.load_manifest(mdbm_path)['generations']
+    return [gen for gen in gens
+            if os.path.exists(multidbm.generation_path(mdbm_path, gen))]
+
+
+class _Chunk(object):
+
+    def __init__(self, mdbm_path, gen):
+        self.gen = gen
+        self.cold = gen['tier'] == 'cold'
+        self._db = gdbm.open(multidbm.generation_path(mdbm_path, gen), 'ru')
+
+    def keys(self):
+        for k in _iter_entries(self._db, _iteration_limit(self.gen)):
+            yield k.decode('utf-8')
+
+    def candidates(self, key):
+        try:
+            value = self._db[key]
+            if self.cold:
+                value = zlib.decompress(value)
+            value = multidbm._decoded(value.decode('utf-8'))
+        except (KeyError, zlib.error, UnicodeDecodeError):
+            return []
+        return [dict(c, anagram_hash=key) for c in
+                anagramfunctions.decode_candidates(value, key) if isinstance(c, dict)]
+
+    def close(self):
+        self._db.close()
+
+
+def partition_bounds(mdbm_path, gens, partitions, sample_size=SAMPLE_SIZE):
+    """
+    returns partitions + 1 boundaries splitting the key space into ranges
+    holding roughly equal numbers of keys. the first and last are None.
+    gdbm iterates in hash order, so the first keys of a chunk are a fair sample.
+    """
+    sample = []
+    per_chunk = max(1, sample_size // max(1, len(gens)))
+    for gen in gens:
+        chunk = _Chunk(mdbm_path, gen)
+        try:
+            sample.extend(itertools.islice(chunk.keys(), per_chunk))
+        finally:
+            chunk.close()
+    sample.sort()
+    bounds = [None]
+    for i in range(1, partitions):
+        bound = sample[len(sample) * i // partitions] if sample else None
+        if bound is not None and bound != bounds[-1]:
+            bounds.append(bound)
+    bounds.append(None)
+    return bounds
+
+
+def spill_chunk(task):
+    """
+    reads the keys of one chunk, writing them to sorted spill files in
+    spill_dir, by range. runs in a worker process. returns a list of
+    (range index, chunk index, path); a range may have more than one file
+    for a chunk, or none.
+    """
+    mdbm_path, chunk_idx, gen, bounds, spill_dir, spill_size = task
+    inner = bounds[1:-1]
+    chunk = _Chunk(mdbm_path, gen)
+    spilled = []
+    try:
+        keys = chunk.keys()
+        while True:
+            batch = list(itertools.islice(keys, spill_size))
+            if not batch:
+                return spilled
+            by_range = {}
+            for key in batch:
+                by_range.setdefault(bisect.bisect_right(inner, key), []).append(key)
+            for range_idx, in_range in sorted(by_range.items()):
+                in_range.sort()
+                path = os.path.join(spill_dir, 'range%04d-chunk%04d-%04d' % (
+                    range_idx, chunk_idx, len(spilled)))
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.writelines(key + '\n' for key in in_range)
+                spilled.append((range_idx, chunk_idx, path))
+    finally:
+        chunk.close()
+
+
+def join_range(task):
+    """
+    finds pairs between chunks for the keys of one range, merging the
+    spill files written for it: files is a list of (chunk index, path).
+    runs in a worker process. returns (pairs, counts); pairs are (newer,
+    older), at most one for each key, and none for keys in skip.
+    """
+    mdbm_path, gens, files, skip = task
+    counts = dict(keys=0, shared_keys=0, pairs_tested=0)
+    chunks = {}
+    opened = [open(path, encoding='utf-8') for chunk_idx, path in files]
+    try:
+        streams = [zip((line.rstrip('\n') for line in f), itertools.repeat(chunk_idx))
+                   for (chunk_idx, path), f in zip(files, opened)]
+        pairs = []
+        for key, group in itertools.groupby(heapq.merge(*streams), key=lambda item: item[0]):
+            holders = sorted(set(i for k, i in group))
+            counts['keys'] += len(holders)
+            if len(holders) < 2 or key in skip:
+                continue
+            counts['shared_keys'] += 1
+            for i in holders:
+                if i not in chunks:
+                    chunks[i] = _Chunk(mdbm_path, gens[i])
+            pair = _first_pair([chunks[i].candidates(key) for i in holders], counts)
+            if pair is not None:
+                pairs.append(pair)
+        return pairs, counts
+    finally:
+        for f in opened:
+            f.close()
+        for chunk in chunks.values():
+            chunk.close()
+
+
+def _first_pair(held, counts, test_func=anagramfunctions.test_anagram):
+    """
+    held is a list of candidate lists, one per chunk, oldest chunk first.
+    candidates in one chunk were compared when they were stored, so only
+    candidates in different chunks are compared here.
+    """
+    for newer_idx in range(len(held) - 1, 0, -1):
+        for newer in held[newer_idx]:
+            for older_idx in range(newer_idx):
+                for older in held[older_idx]:
+                    if newer.get('tweet_id') == older.get('tweet_id'):
+                        continue
+                    counts['pairs_tested'] += 1
+                    if test_func(_text(newer), _text(older)):
+                        return newer, older
+    return None
+
+
+def _text(candidate):
+    return candidate.get('text') or candidate.get('tweet_text')
+
+
+def cross_join(mdbm_path, hit_callback, jobs=None, skip=frozenset(), tmp_dir=None,
+               spill_size=SPILL_SIZE):
+    """
+    finds pairs across the chunks of the store at mdbm_path, calling
+    hit_callback(newer, older) for each. keys in skip are ignored.
+    spill files are written to a temporary directory in tmp_dir.
+    returns the summed counts.
+    """
+    jobs = jobs or multiprocessing.cpu_count()
+    start = time.time()
+    gens = store_generations(mdbm_path)
+    bounds = partition_bounds(mdbm_path, gens, jobs * PARTITIONS_PER_JOB)
+    print('joining %i chunks in %i key ranges' % (len(gens), len(bounds) - 1), file=sys.stderr)
+
+    totals = dict(pairs=0)
+    spill_dir = tempfile.mkdtemp(prefix='anagram-crossjoin-', dir=tmp_dir)
+    pool = multiprocessing.Pool(jobs)
+    try:
+        files = [[] for i in range(len(bounds) - 1)]
+        spills = [(mdbm_path, i, gen, bounds, spill_dir, spill_size) for i, gen in enumerate(gens)]
+        for done, spilled in enumerate(pool.imap_unordered(spill_chunk, spills), 1):
+            for range_idx, chunk_idx, path in spilled:
+                files[range_idx].append((chunk_idx, path))
+            print('%i/%i chunks read, %0.1fs' % (done, len(gens), time.time() - start),
+                  file=sys.stderr)
+
+        tasks = [(mdbm_path, gens, sorted(range_files), skip)
+                 for range_files in files if range_files]
+        for done, (pairs, counts) in enumerate(pool.imap_unordered(join_range, tasks), 1):
+            for key, value in counts.items():
+                totals[key] = totals.get(key, 0) + value
+            for newer, older in pairs:
+                totals['pairs'] += 1
+                hit_callback(newer, older)
+            print('%i/%i ranges, %i shared keys, %i pairs, %0.1fs' % (
+                done, len(tasks), totals.get('shared_keys', 0), totals['pairs'],
+                time.time() - start), file=sys.stderr)
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    return totals
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="finds anagrams between tweets stored in different chunks of an mdbm store")
+    parser.add_argument('db', type=str, help="mdbm directory")
+    parser.add_argument('--hits', type=str, default='hitdata3en.db',
+                        help="hit database to add hits to, in the data directory")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: cpu count)')
+    parser.add_argument('-n', '--dry-run', action="store_true",
+                        help="print pairs instead of adding hits")
+    parser.add_argument('--tmp', dest='tmp_dir', help="directory for spill files")
+    args = parser.parse_args()
+
+    if args.dry_run:
+        def show(newer, older):
+            print('%s\n%s\n' % (_text(newer), _text(older)))
+        cross_join(args.db, show, args.jobs, tmp_dir=args.tmp_dir)
+        return 0
+
+    from . import enrichment, hitmanager
+    hit_manager = hitmanager.HitDBManager(
+        args.hits, enrichment_workers=enrichment.ENRICHMENT_WORKERS)
+    # there's only ever one hit for a key
+    cursor = hit_manager.hitsdb.cursor()
+    cursor.execute("SELECT hit_hash FROM hits")
+    known = frozenset(row[0] for row in cursor.fetchall())
+    before = hit_manager.stats['hits']
+    try:
+        totals = cross_join(args.db, hit_manager.new_hit, args.jobs, skip=known,
+                            tmp_dir=args.tmp_dir)
+    finally:
+        hit_manager.close()
+    print('%i pairs found, %i new hits' % (totals['pairs'], hit_manager.stats['hits'] - before))
+    return 0
+
+
+if __name__ == "__main__":
+    main()
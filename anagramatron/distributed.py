@@ -0,0 +1,359 @@
+# coding: utf-8
+"""
+runs anagramatron across several processes or hosts, connected by zmq.
+
+ingest nodes read the stream, filter tweets, and push candidates to the
+finder node that owns their key. finder nodes each run an AnagramFinder
+over one shard of the key space, and push hits to a single hit sink.
+every node sends heartbeats with its throughput stats to the sink.
+
+    ingest ──PUSH──▶ finder[shard_for_key(key)] ──PUSH──▶ sink
+      └──────────────── heartbeats ──────────────────────▶ sink
+"""
+from __future__ import print_function
+
+import logging
+import os
+import socket
+import sys
+import time
+
+import zmq
+
+from . import anagramfinder, anagramfunctions, common, shardedfinder
+
+HEARTBEAT_INTERVAL = 5  # seconds
+NODE_TIMEOUT = HEARTBEAT_INTERVAL * 3
+FLUSH_INTERVAL = 0.25  # max seconds a candidate waits before being pushed
+SEND_HIGH_WATER_MARK = 100  # batches queued per finder before we drop
+_LINGER = 1000  # ms
+
+ROLE_INGEST = 'ingest'
+ROLE_FINDER = 'finder'
+
+MSG_BATCH = 'batch'
+MSG_HIT = 'hit'
+MSG_HEARTBEAT = 'heartbeat'
+MSG_BYE = 'bye'
+
+
+def _node_name(role, suffix=None):
+    name = '%s-%s-%i' % (role, socket.gethostname(), os.getpid())
+    if suffix is not None:
+        name = '%s-%s' % (name, suffix)
+    return name
+
+
+class _Node(object):
+
+    """heartbeats and counters shared by ingest and finder nodes."""
+
+    role = None
+
+    def __init__(self, sink_address, name=None, context=None):
+        self.name = name or _node_name(self.role)
+        self.context = context or zmq.Context.instance()
+        self.counters = dict()
+        self._sink = self.context.socket(zmq.PUSH)
+        self._sink.setsockopt(zmq.LINGER, _LINGER)
+        self._sink.connect(sink_address)
+        self._last_heartbeat = 0
+        self._stopped = False
+
+    def count(self, key, value=1):
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def stop(self):
+        """asks the node's run loop to return."""
+        self._stopped = True
+
+    def heartbeat(self, force=False):
+        now = time.time()
+        if not force and now - self._last_heartbeat < HEARTBEAT_INTERVAL:
+            return
+        self._last_heartbeat = now
+        self._send_sink({'type': MSG_HEARTBEAT, 'node': self.name, 'role': self.role,
+                         'time': now, 'stats': dict(self.counters)})
+
+    def _send_sink(self, message):
+        try:
+            self._sink.send_json(message, zmq.NOBLOCK)
+        except zmq.Again:
+            logging.error('%s: hit sink not keeping up, dropped %s' %
+                          (self.name, message['type']))
+
+    def _close_sockets(self):
+        self._send_sink({'type': MSG_BYE, 'node': self.name, 'role': self.role,
+                         'time': time.time(), 'stats': dict(self.counters)})
+        self._sink.close()
+
+
+class IngestNode(_Node):
+
+    """
+    filters tweets from source and routes candidates to finder nodes.
+    finder_addresses is ordered by shard index: the finder at position i
+    must own shard i of len(finder_addresses).
+    source defaults to the zmq stream at host:port.
+    """
+
+    role = ROLE_INGEST
+
+    def __init__(self, finder_addresses, sink_address, source=None,
+                 host="127.0.0.1", port="8069",
+                 batch_size=common.ANAGRAM_BATCH_SIZE, name=None, context=None):
+        super(IngestNode, self).__init__(sink_address, name, context)
+        if source is None:
+            from zmqstream.consumer import zmq_iter
+            source = zmq_iter(host=host, port=port)
+        self.source = source
+        self.batch_size = batch_size
+        self._finders = []
+        for address in finder_addresses:
+            sock = self.context.socket(zmq.PUSH)
+            sock.setsockopt(zmq.SNDHWM, SEND_HIGH_WATER_MARK)
+            sock.setsockopt(zmq.LINGER, _LINGER)
+            sock.connect(address)
+            self._finders.append(sock)
+        self._pending = [[] for _ in self._finders]
+        self._last_flush = time.time()
+
+    def run(self):
+        """runs until the source is exhausted or stop() is called."""
+        print('%s routing to %i finders' % (self.name, len(self._finders)))
+        try:
+            for tweet in self.source:
+                self.handle_tweet(tweet)
+                if time.time() - self._last_flush > FLUSH_INTERVAL:
+                    self.flush()
+                self.heartbeat()
+                if self._stopped:
+                    break
+        finally:
+            self.close()
+
+    def handle_tweet(self, tweet):
+        if not isinstance(tweet, dict) or not tweet.get('text'):
+            return
+        self.count('tweets_seen')
+        candidate = anagramfunctions.filter_tweet(tweet)
+        if not candidate:
+            return
+        self.count('passed_filter')
+        shard = shardedfinder.shard_for_key(candidate['anagram_hash'], len(self._finders))
+        self._pending[shard].append(candidate)
+        if len(self._pending[shard]) >= self.batch_size:
+            self._push(shard)
+
+    def flush(self):
+        for shard in range(len(self._finders)):
+            if self._pending[shard]:
+                self._push(shard)
+        self._last_flush = time.time()
+
+    def _push(self, shard):
+        batch, self._pending[shard] = self._pending[shard], []
+        try:
+            self._finders[shard].send_json(
+                {'type': MSG_BATCH, 'node': self.name, 'tweets': batch}, zmq.NOBLOCK)
+            self.count('sent', len(batch))
+        except zmq.Again:
+            # like the stream queue, we drop tweets rather than fall behind
+            self.count('dropped', len(batch))
+
+    def close(self):
+        self.flush()
+        for sock in self._finders:
+            sock.close()
+        self._close_sockets()
+        print('%s closed: %s' % (self.name, self.counters))
+
+
+class FinderNode(_Node):
+
+    """
+    runs an AnagramFinder over one shard of the key space, taking batches
+    from any number of ingest nodes on bind_address. the shard's store
+    uses the same layout as ShardedAnagramFinder's.
+    """
+
+    role = ROLE_FINDER
+
+    def __init__(self, index, shard_count, bind_address, sink_address,
+                 storage='mdbm', path=None, name=None, context=None):
+        super(FinderNode, self).__init__(
+            sink_address, name or _node_name(self.role, index), context)
+        self.index = index
+        self.shard_count = shard_count
+        base_path = path or os.path.join(
+            common.ANAGRAM_DATA_DIR,
+            '%s_en_sharded.db' % anagramfinder.DATA_PATH_COMPONENT)
+        store_path, cache_path = shardedfinder.shard_paths(base_path, index, shard_count)
+        if storage and not os.path.exists(os.path.dirname(store_path)):
+            os.makedirs(os.path.dirname(store_path))
+        self.finder = anagramfinder.AnagramFinder(
+            storage=storage, path=store_path, cachepath=cache_path,
+            hit_callback=self.handle_hit)
+        self._inbox = self.context.socket(zmq.PULL)
+        self._inbox.bind(bind_address)
+
+    def handle_hit(self, first, second):
+        self.count('hits')
+        self._send_sink({'type': MSG_HIT, 'node': self.name, 'tweets': [first, second]})
+
+    def run(self):
+        """runs until stop() is called."""
+        print('%s handling shard %i of %i' % (self.name, self.index, self.shard_count))
+        poller = zmq.Poller()
+        poller.register(self._inbox, zmq.POLLIN)
+        try:
+            while not self._stopped:
+                if poller.poll(FLUSH_INTERVAL * 1000):
+                    message = self._inbox.recv_json()
+                    if message.get('type') == MSG_BATCH:
+                        self.handle_batch(message['tweets'])
+                self.heartbeat()
+        finally:
+            self.close()
+
+    def handle_batch(self, tweets):
+        self.count('batches')
+        self.count('received', len(tweets))
+        self.finder.handle_batch(tweets)
+        for key in ('cache_size', 'cache_hits', 'possible_hits'):
+            self.counters[key] = self.finder.stats[key]
+
+    def close(self):
+        self._inbox.close()
+        self.finder.close()
+        self._close_sockets()
+
+
+class HitSink(object):
+
+    """
+    receives hits and heartbeats from every node on bind_address.
+    hits are passed to hit_callback; heartbeats are kept so that status()
+    can report per-node throughput and nodes that have gone quiet.
+    """
+
+    def __init__(self, bind_address, hit_callback=print, context=None):
+        self.hit_callback = hit_callback
+        self.context = context or zmq.Context.instance()
+        self.nodes = dict()
+        self.hits = 0
+        self._socket = self.context.socket(zmq.PULL)
+        self._socket.bind(bind_address)
+        self._stopped = False
+
+    def stop(self):
+        self._stopped = True
+
+    def run(self, report_interval=None):
+        """runs until stop() is called, printing status every report_interval."""
+        poller = zmq.Poller()
+        poller.register(self._socket, zmq.POLLIN)
+        last_report = time.time()
+        try:
+            while not self._stopped:
+                if poller.poll(FLUSH_INTERVAL * 1000):
+                    self.handle_message(self._socket.recv_json())
+                if report_interval and time.time() - last_report > report_interval:
+                    last_report = time.time()
+                    self.print_status()
+        finally:
+            self._socket.close()
+
+    def handle_message(self, message):
+        kind = message.get('type')
+        if kind == MSG_HIT:
+            self.hits += 1
+            self.hit_callback(*message['tweets'])
+        elif kind in (MSG_HEARTBEAT, MSG_BYE):
+            self._record_heartbeat(message)
+
+    def _record_heartbeat(self, message):
+        now = time.time()
+        node = self.nodes.setdefault(message['node'], {'role': message['role'],
+                                                       'rates': dict()})
+        previous, previous_time = node.get('stats'), node.get('time')
+        if previous is not None and message['time'] > previous_time:
+            elapsed = message['time'] - previous_time
+            node['rates'] = dict(
+                (key, (value - previous.get(key, 0)) / elapsed)
+                for key, value in message['stats'].items())
+        node['stats'] = message['stats']
+        node['time'] = message['time']
+        node['last_seen'] = now
+        node['closed'] = message['type'] == MSG_BYE
+
+    def status(self):
+        """returns a dict of node name to that node's state."""
+        now = time.time()
+        status = dict()
+        for name, node in self.nodes.items():
+            status[name] = dict(node,
+                                alive=(not node['closed'] and
+                                       now - node['last_seen'] < NODE_TIMEOUT))
+        return status
+
+    def print_status(self):
+        print('%i hits' % self.hits)
+        for name, node in sorted(self.status().items()):
+            state = 'up' if node['alive'] else ('closed' if node['closed'] else 'LOST')
+            rates = ', '.join('%s %0.1f/s' % (k, v) for k, v in sorted(node['rates'].items())
+                              if k in ('tweets_seen', 'passed_filter', 'received', 'hits'))
+            print('  %s (%s): %s %s' % (name, node['role'], state, rates))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="runs one node of a distributed anagramatron")
+    subparsers = parser.add_subparsers(dest='role')
+
+    ingest = subparsers.add_parser(ROLE_INGEST, help="filter the stream and route tweets")
+    ingest.add_argument('--finders', required=True,
+                        help="comma-separated finder addresses, in shard order")
+    ingest.add_argument('--sink', required=True, help="hit sink address")
+    ingest.add_argument('--host', default="127.0.0.1", help="stream host")
+    ingest.add_argument('--port', default="8069", help="stream port")
+
+    finder = subparsers.add_parser(ROLE_FINDER, help="find anagrams in one shard")
+    finder.add_argument('--index', type=int, required=True, help="this finder's shard")
+    finder.add_argument('--count', type=int, required=True, help="total number of shards")
+    finder.add_argument('--bind', required=True, help="address to receive tweets on")
+    finder.add_argument('--sink', required=True, help="hit sink address")
+
+    sink = subparsers.add_parser('sink', help="collect hits and heartbeats")
+    sink.add_argument('--bind', required=True, help="address to receive hits on")
+    sink.add_argument('--db', default='hitdata3en.db', help="hit database")
+    args = parser.parse_args()
+
+    if args.role == ROLE_INGEST:
+        node = IngestNode(args.finders.split(','), args.sink, host=args.host, port=args.port)
+    elif args.role == ROLE_FINDER:
+        node = FinderNode(args.index, args.count, args.bind, args.sink)
+    elif args.role == 'sink':
+        from . import enrichment, hitmanager
+        hit_manager = hitmanager.HitDBManager(
+            args.db, enrichment_workers=enrichment.ENRICHMENT_WORKERS)
+        node = HitSink(args.bind, hit_callback=hit_manager.new_hit)
+    else:
+        parser.print_help()
+        return 1
+
+    try:
+        if args.role == 'sink':
+            node.run(report_interval=HEARTBEAT_INTERVAL * 2)
+        else:
+            node.run()
+    except KeyboardInterrupt:
+        print('stopping %s' % args.role, file=sys.stderr)
+    if args.role == 'sink':
+        hit_manager.close()
+    return 0
+
+
+if __name__ == "__main__":
+    main()
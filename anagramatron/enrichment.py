@@ -0,0 +1,190 @@
+# coding: utf-8
+from __future__ import print_function
+
+import heapq
+import logging
+import random
+import threading
+import time
+
+from . import hitmanager
+from .anagramstats import StatTracker
+
+ENRICHMENT_WORKERS = 4
+MAX_ATTEMPTS = 5
+BASE_RETRY_DELAY = 2.0  # seconds, doubled on each attempt
+MAX_RETRY_DELAY = 5 * 60
+RATE_LIMIT_WAIT = 15 * 60  # if twitter doesn't tell us when the limit resets
+
+_MISSING_CODES = (403, 404)
+_RATE_LIMIT_CODES = (420, 429)
+
+
+class EnrichmentPool(object):
+
+    """
+    fetches the full tweets for stored hits in background threads, so that
+    matching never waits on the REST api. hits are stored with pending
+    status and moved to review once enriched.
+
+    errors are retried with exponential backoff. a missing tweet removes
+    its hit, as it can never be posted. when we are rate limited, every
+    worker waits for the limit to reset. each worker has its own
+    HitDBManager, and so its own sqlite connection; they share twitter_handler.
+    """
+
+    def __init__(self, dbpath, twitter_handler,
+                 workers=ENRICHMENT_WORKERS,
+                 max_attempts=MAX_ATTEMPTS,
+                 base_delay=BASE_RETRY_DELAY):
+        self.dbpath = dbpath
+        self.twitter_handler = twitter_handler
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.stats = StatTracker()
+        self._jobs = []  # heap of (ready time, hit id, attempt)
+        self._active = 0
+        self._paused_until = 0
+        self._held = False
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name='hit-enrichment-%i' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, hit_id, attempt=0, delay=0):
+        with self._cond:
+            heapq.heappush(self._jobs, (time.time() + delay, hit_id, attempt))
+            self.stats['enrich_pending'] = len(self._jobs) + self._active
+            self._cond.notify()
+
+    def pending(self):
+        """returns the number of hits waiting for, or undergoing, enrichment."""
+        with self._cond:
+            return len(self._jobs) + self._active
+
+    def wait(self, timeout=None):
+        """blocks until no hits are pending. returns False on timeout."""
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while self._jobs or self._active:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def pause(self):
+        """workers finish the hits they have, then wait for resume()."""
+        with self._cond:
+            self._held = True
+
+    def resume(self):
+        with self._cond:
+            self._held = False
+            self._cond.notify_all()
+
+    def close(self, timeout=None):
+        """
+        stops the workers. hits that haven't been enriched stay pending
+        in the database, and are resubmitted the next time we start.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _next(self):
+        """waits for a job that is ready to run. returns None when stopped."""
+        with self._cond:
+            while not self._stopped:
+                if self._held:
+                    self._cond.wait()
+                    continue
+                now = time.time()
+                ready_at = max(self._paused_until, self._jobs[0][0] if self._jobs else now)
+                if self._jobs and ready_at <= now:
+                    self._active += 1
+                    return heapq.heappop(self._jobs)
+                self._cond.wait(ready_at - now if self._jobs else None)
+            return None
+
+    def _done(self):
+        with self._cond:
+            self._active -= 1
+            self.stats['enrich_pending'] = len(self._jobs) + self._active
+            self._cond.notify_all()
+
+    def _run(self):
+        manager = hitmanager.HitDBManager(self.dbpath, twitter_handler=self.twitter_handler)
+        while True:
+            job = self._next()
+            if job is None:
+                break
+            ready, hit_id, attempt = job
+            try:
+                self._enrich(manager, hit_id, attempt)
+            except Exception as err:
+                logging.error('enrichment of hit %s failed: %s' % (hit_id, err))
+            finally:
+                self._done()
+        manager.hitsdb.close()
+
+    def _enrich(self, manager, hit_id, attempt):
+        try:
+            hit = manager.get_hit(hit_id)
+        except TypeError:
+            # hit was removed
+            return
+        if hit['status'] != hitmanager.HIT_STATUS_PENDING:
+            return
+        try:
+            hit = manager.enrich_hit(hit, strict=True)
+        except Exception as err:
+            code = _error_code(err)
+            if isinstance(err, hitmanager.TweetMissing) or code in _MISSING_CODES:
+                print('tweet missing, will pass')
+                manager.remove_hit(hit_id)
+                self.stats['enrich_missing'] += 1
+            elif code in _RATE_LIMIT_CODES:
+                self._rate_limited(err)
+                self.submit(hit_id, attempt)
+            elif attempt + 1 < self.max_attempts:
+                self.stats['enrich_retries'] += 1
+                self.submit(hit_id, attempt + 1, self._retry_delay(attempt))
+            else:
+                # we'd rather review a hit without its tweets than lose it
+                logging.error('giving up on enriching hit %s: %s' % (hit_id, err))
+                manager.update_hit(hit, hitmanager.HIT_STATUS_REVIEW)
+                self.stats['enrich_failed'] += 1
+            return
+        manager.update_hit(hit, hitmanager.HIT_STATUS_REVIEW)
+        self.stats['enriched'] += 1
+
+    def _retry_delay(self, attempt):
+        delay = min(MAX_RETRY_DELAY, self.base_delay * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _rate_limited(self, err):
+        try:
+            reset = float(err.e.headers.get('x-rate-limit-reset'))
+        except (AttributeError, TypeError, ValueError):
+            reset = time.time() + RATE_LIMIT_WAIT
+        with self._cond:
+            if reset > self._paused_until:
+                self._paused_until = reset
+                logging.info('rate limited, pausing enrichment for %0.0fs' %
+                             (reset - time.time()))
+        self.stats['rate_limited'] += 1
+
+
+def _error_code(err):
+    """returns the HTTP status of a twitter error, or None."""
+    try:
+        return err.e.code
+    except AttributeError:
+        return None
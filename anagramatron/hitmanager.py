@@ -2,6 +2,7 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import logging
 import sqlite3 as lite
 import os
 import time
@@ -10,7 +11,7 @@ from .anagramstats import StatTracker
 
 from twitter.api import TwitterError
 
-from . import anagramfunctions, twitterhandler, common
+from . import anagramfunctions, twitterhandler, common, enrichment
 
 HIT_STATUS_REVIEW = 'review'
 HIT_STATUS_SEEN = 'seen'
@@ -18,6 +19,13 @@ HIT_STATUS_REJECTED = 'rejected'
 HIT_STATUS_POSTED = 'posted'
 HIT_STATUS_APPROVED = 'approved'
 HIT_STATUS_FAILED = 'failed'
+# stored, but waiting for its tweets to be fetched
+HIT_STATUS_PENDING = 'pending'
+
+
+class TweetMissing(Exception):
+    """raised when a tweet in a hit has been deleted or made unavailable."""
+    pass
 
 
 class HitDBManager(object):
@@ -28,14 +36,25 @@ class HitDBManager(object):
     # we make ids from unix time so this is in 2255 somewhere
     MAX_HIT_ID = 9000000000000
 
-    def __init__(self, dbpath, _testing=False):
+    def __init__(self, dbpath, _testing=False, twitter_handler=None, enrichment_workers=0):
+        """
+        if enrichment_workers is set, new hits are stored straight away,
+        and their tweets are fetched in the background.
+        """
         super(HitDBManager, self).__init__()
         self.dbpath = os.path.join(common.ANAGRAM_DATA_DIR, dbpath)
         self.hitsdb = self._setup()
-        self.twitter_handler = twitterhandler.TwitterHandler()
+        self.twitter_handler = twitter_handler or twitterhandler.TwitterHandler()
         self.hits_counter = 0
+        self._last_hit_id = 0
         self._testing = _testing
         self.stats = StatTracker()
+        self.enrichment = None
+        if enrichment_workers:
+            self.enrichment = enrichment.EnrichmentPool(
+                self.dbpath, self.twitter_handler, workers=enrichment_workers)
+            for hit in self.all_hits(HIT_STATUS_PENDING):
+                self.enrichment.submit(hit['id'])
 
     def _setup(self):
         if os.path.exists(self.dbpath):
@@ -49,9 +68,30 @@ class HitDBManager(object):
 
     # public API
     def new_hit(self, first, second):
+        hit = self.prepare_hit(first, second)
+        if hit is None:
+            return
+        if self.enrichment is not None and not self._testing:
+            hit['status'] = HIT_STATUS_PENDING
+            if self.store_hit(hit):
+                self.enrichment.submit(hit['id'])
+            return
+        try:
+            if not self._testing:
+                hit = self.enrich_hit(hit)
+            self.store_hit(hit)
+        except (TwitterError, TweetMissing):
+            print('tweet missing, will pass')
 
+    def prepare_hit(self, first, second):
+        """
+        returns a new hit for a pair of tweets,
+        or None if we already have a hit with the same hash.
+        """
+        # hit ids are timestamps; keep them unique if hits come in quickly
+        self._last_hit_id = max(int(time.time()*1000), self._last_hit_id + 1)
         hit = {
-            "id": int(time.time()*1000),
+            "id": self._last_hit_id,
             "status": HIT_STATUS_REVIEW,
             "hash": first['anagram_hash'],
             "tweet_one": first,
@@ -59,15 +99,43 @@ class HitDBManager(object):
         }
 
         if self._hit_collides_with_previous_hit(hit):
-            return
+            return None
         self.stats['hits'] += 1
-        try:
-            if not self._testing:
-                hit = self._fetch_hit_tweets(hit)
-            self.hits_counter += 1
-            self._add_hit(hit)
-        except TwitterError:
-            print('tweet missing, will pass')
+        return hit
+
+    def enrich_hit(self, hit, strict=False):
+        """
+        fetches the full tweets in a prepared hit.
+        this makes network requests, but doesn't touch the database,
+        so it can be run from another thread.
+        if strict, errors fetching either tweet are raised.
+        """
+        return self._fetch_hit_tweets(hit, strict)
+
+    def store_hit(self, hit):
+        """
+        saves a prepared hit. returns False if a hit with the same
+        hash was stored since it was prepared.
+        """
+        if self._hit_collides_with_previous_hit(hit):
+            return False
+        self.hits_counter += 1
+        self._add_hit(hit)
+        return True
+
+    def update_hit(self, hit, status):
+        """saves the tweets in a stored hit, and sets its status."""
+        cursor = self.hitsdb.cursor()
+        cursor.execute("UPDATE hits SET hit_status = ?, tweet_one = ?, tweet_two = ? "
+                       "WHERE hit_id = ?",
+                       (status, repr(hit['tweet_one']), repr(hit['tweet_two']), str(hit['id'])))
+        self.hitsdb.commit()
+
+    def close(self):
+        """stops background enrichment. pending hits resume on the next start."""
+        if self.enrichment is not None:
+            self.enrichment.close()
+            self.enrichment = None
 
     def all_hits(self, with_status=None, max_id=MAX_HIT_ID, result_count=None):
         query = "SELECT * FROM hits WHERE hit_id < :hit_id"
@@ -227,19 +295,35 @@ class HitDBManager(object):
 
     # twitter stuff:
 
-    def _fetch_hit_tweets(self, hit):
+    def _fetch_hit_tweets(self, hit, strict=False):
         """
-        attempts to fetch tweets in hit.
-        if successful builds up more detailed hit object.
-        returns the input hit unchaged on failure
+        attempts to fetch tweets in hit, in a single request, along with
+        their oembed markup. if successful builds up more detailed hit
+        object, which is all posting needs; the poster runs in another
+        process, and would otherwise fetch them again.
+        raises TweetMissing if either tweet is gone. on other failures
+        returns the input hit unchaged, or raises if strict.
         """
-
-        t1 = self.twitter_handler.fetch_tweet(hit['tweet_one']['tweet_id'])
-        t2 = self.twitter_handler.fetch_tweet(hit['tweet_two']['tweet_id'])
-        if t1 and t2:
-            hit['tweet_one']['fetched'] = self._cleaned_tweet(t1)
-            hit['tweet_two']['fetched'] = self._cleaned_tweet(t2)
-
+        id1 = int(hit['tweet_one']['tweet_id'])
+        id2 = int(hit['tweet_two']['tweet_id'])
+        try:
+            tweets = self.twitter_handler.fetch_tweets([id1, id2])
+        except Exception as err:
+            if strict:
+                raise
+            logging.debug('error fetching tweets for hit %s: %s' % (hit['id'], err))
+            return hit
+        if id1 not in tweets or id2 not in tweets:
+            raise TweetMissing(hit['id'])
+        hit['tweet_one']['fetched'] = self._cleaned_tweet(tweets[id1])
+        hit['tweet_two']['fetched'] = self._cleaned_tweet(tweets[id2])
+        for tweet_id, fetched in ((id1, hit['tweet_one']['fetched']),
+                                  (id2, hit['tweet_two']['fetched'])):
+            try:
+                fetched['oembed_html'] = self.twitter_handler.oembed_for_tweet(tweet_id)['html']
+            except Exception as err:
+                # the poster fetches it instead
+                logging.debug('error fetching oembed for tweet %s: %s' % (tweet_id, err))
         return hit
 
     def dump_json(self, filename='hit_export.json'):
@@ -258,6 +342,7 @@ class HitDBManager(object):
         returns a dict of desirable twitter info
         """
         twict = dict()
+        twict['id_str'] = tweet.get('id_str')
         twict['text'] = anagramfunctions.correct_encodings(tweet.get('text'))
         twict['user'] = {
             'name': tweet.get('user').get('name'),
@@ -0,0 +1,251 @@
+# coding: utf-8
+"""
+runs the stream connection and filtering in a long-lived process of its
+own, so that restarting the finder doesn't drop the stream.
+
+the IngestService buffers filtered tweets (spilling to disk as needed)
+and hands them out in batches to an IngestClient over zmq. a batch stays
+in flight until the client acknowledges it; if the client goes away
+first, the batch is delivered again to the next client. to a finder,
+a crash or maintenance pause is a delay rather than a gap.
+"""
+from __future__ import print_function
+
+import json
+import logging
+import os
+import sys
+import threading
+import uuid
+
+from collections import OrderedDict, deque
+
+import zmq
+
+from .anagramstats import StatTracker
+from .common import ANAGRAM_BATCH_SIZE, ANAGRAM_DATA_DIR
+
+DEFAULT_ADDRESS = 'tcp://127.0.0.1:8070'
+LONG_POLL = 1.0  # seconds the service waits for tweets before replying empty
+REQUEST_TIMEOUT = LONG_POLL + 10  # seconds before the client gives up on a reply
+INFLIGHT_FILE = 'inflight.json'
+_STATS = ('tweets_seen', 'passed_filter', 'buffer', 'buffer_on_disk')
+
+
+class IngestService(object):
+
+    """
+    serves batches from source, a StreamHandler by default, on address.
+    serves a single client at a time: a request from a new client
+    session means the previous client is gone, and its unacknowledged
+    batches are queued for redelivery.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, source=None, state_path=None,
+                 context=None, **stream_kwargs):
+        if source is None:
+            from . import stream
+            source = stream.StreamHandler(poll_directs=False, **stream_kwargs)
+        self.source = source
+        self.state_path = state_path or os.path.join(ANAGRAM_DATA_DIR, 'ingest')
+        self.stats = StatTracker()
+        self.context = context or zmq.Context.instance()
+        self._socket = self.context.socket(zmq.REP)
+        self._socket.bind(address)
+        self._inflight = OrderedDict()  # batch id: tweets
+        self._redeliver = deque()
+        # ids stay unique across restarts, so stale acks can't match new batches
+        self._instance = uuid.uuid4().hex[:8]
+        self._count = 0
+        self._session = None
+        self._last_reply = (None, None, None)  # session, seq, reply
+        self._stopped = False
+        self._load_inflight()
+
+    def stop(self):
+        self._stopped = True
+
+    def run(self):
+        """serves requests until stop() is called."""
+        self.source.start()
+        poller = zmq.Poller()
+        poller.register(self._socket, zmq.POLLIN)
+        try:
+            while not self._stopped:
+                if poller.poll(LONG_POLL * 1000):
+                    self._socket.send_json(self.handle_request(self._socket.recv_json()))
+                elif hasattr(self.source, 'check_directs'):
+                    self.source.check_directs()
+        finally:
+            self.close()
+
+    def handle_request(self, request):
+        session, seq = request['session'], request['seq']
+        if (session, seq) == self._last_reply[:2]:
+            # the client didn't get our reply, and is asking again
+            return self._last_reply[2]
+
+        for batch_id in request.get('acks', []):
+            self._inflight.pop(batch_id, None)
+        if session != self._session:
+            if self._session is not None and self._inflight:
+                print('finder reconnected, redelivering %i batches' % len(self._inflight))
+            self._session = session
+            self._redeliver = deque(self._inflight)
+
+        reply = {'id': None, 'tweets': []}
+        while self._redeliver and self._redeliver[0] not in self._inflight:
+            self._redeliver.popleft()
+        if self._redeliver:
+            batch_id = self._redeliver.popleft()
+            reply = {'id': batch_id, 'tweets': self._inflight[batch_id]}
+            self.stats['redelivered'] += 1
+        else:
+            tweets = self.source.get_batch(request.get('size', ANAGRAM_BATCH_SIZE),
+                                           request.get('wait', LONG_POLL))
+            if tweets:
+                batch_id = self._new_id()
+                reply = {'id': batch_id, 'tweets': tweets}
+                self._inflight[batch_id] = tweets
+        reply['stats'] = dict((key, self.stats[key]) for key in _STATS)
+        reply['stats']['inflight'] = len(self._inflight)
+        self._last_reply = (session, seq, reply)
+        return reply
+
+    def _new_id(self):
+        self._count += 1
+        return '%s-%i' % (self._instance, self._count)
+
+    def close(self):
+        self._socket.close()
+        self.source.close()
+        self._save_inflight()
+
+    def _inflight_path(self):
+        return os.path.join(self.state_path, INFLIGHT_FILE)
+
+    def _save_inflight(self):
+        if not os.path.exists(self.state_path):
+            os.makedirs(self.state_path)
+        with open(self._inflight_path(), 'w') as f:
+            json.dump(list(self._inflight.values()), f)
+        if self._inflight:
+            print('saved %i unacknowledged batches' % len(self._inflight))
+
+    def _load_inflight(self):
+        if not os.path.exists(self._inflight_path()):
+            return
+        with open(self._inflight_path()) as f:
+            for tweets in json.load(f):
+                self._inflight[self._new_id()] = tweets
+        os.remove(self._inflight_path())
+        self._redeliver = deque(self._inflight)
+
+
+class IngestClient(object):
+
+    """
+    receives batches from an IngestService. can be used in place of a
+    StreamHandler. with auto_ack, a batch is acknowledged when the next
+    one is requested; otherwise call ack() once each batch is handled.
+    closing the client leaves the service, and the stream, running.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, auto_ack=True, context=None):
+        self.address = address
+        self.auto_ack = auto_ack
+        self.stats = StatTracker()
+        self.context = context or zmq.Context.instance()
+        self._session = uuid.uuid4().hex
+        self._seq = 0
+        self._socket = None
+        self._delivered = deque()
+        self._acks = []
+        # ack() may be called from another thread than get_batch()
+        self._ack_lock = threading.Lock()
+
+    def start(self):
+        self._connect()
+
+    def _connect(self):
+        if self._socket is not None:
+            self._socket.close(linger=0)
+        self._socket = self.context.socket(zmq.REQ)
+        self._socket.setsockopt(zmq.LINGER, 0)
+        self._socket.connect(self.address)
+
+    def ack(self):
+        """acknowledges the oldest batch that hasn't been acknowledged."""
+        with self._ack_lock:
+            if self._delivered:
+                self._acks.append(self._delivered.popleft())
+
+    def get_batch(self, size=ANAGRAM_BATCH_SIZE, timeout=None):
+        """
+        returns a list of up to size tweets, or an empty list if none
+        arrived within about timeout seconds.
+        """
+        if self._socket is None:
+            self._connect()
+        if self.auto_ack:
+            while self._delivered:
+                self.ack()
+        self._seq += 1
+        with self._ack_lock:
+            acks, self._acks = self._acks, []
+        request = {'session': self._session, 'seq': self._seq, 'acks': acks,
+                   'size': size, 'wait': min(timeout or LONG_POLL, LONG_POLL)}
+        while True:
+            self._socket.send_json(request)
+            if self._socket.poll(REQUEST_TIMEOUT * 1000):
+                break
+            # lazy pirate: a REQ socket can't send again until it gets a
+            # reply, so we start over with a new one.
+            logging.warning('no reply from ingest service, reconnecting')
+            print('waiting for ingest service at %s' % self.address, file=sys.stderr)
+            self._connect()
+        reply = self._socket.recv_json()
+        for key, value in reply['stats'].items():
+            self.stats[key] = value
+        if reply['id'] is not None:
+            with self._ack_lock:
+                self._delivered.append(reply['id'])
+        return reply['tweets']
+
+    def batches(self, size=ANAGRAM_BATCH_SIZE):
+        while True:
+            batch = self.get_batch(size)
+            if batch:
+                yield batch
+
+    def bufferlength(self):
+        return self.stats['buffer']
+
+    def close(self):
+        """disconnects. unacknowledged batches will be delivered to the next client."""
+        if self._socket is not None:
+            self._socket.close(linger=0)
+            self._socket = None
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="runs the stream connection, serving filtered tweets to a finder")
+    parser.add_argument('--bind', default=DEFAULT_ADDRESS, help="address to serve tweets on")
+    parser.add_argument('--host', default="127.0.0.1", help="stream host")
+    parser.add_argument('--port', default="8069", help="stream port")
+    parser.add_argument('--languages', default='en', help="comma separated languages to pass")
+    args = parser.parse_args()
+
+    service = IngestService(args.bind, host=args.host, port=args.port,
+                            languages=args.languages.split(','))
+    try:
+        service.run()
+    except KeyboardInterrupt:
+        print('stopping ingest service', file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    main()
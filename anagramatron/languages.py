@@ -0,0 +1,86 @@
+# coding: utf-8
+"""
+per-language settings: the letters anagrams are made of, the order they
+appear in anagram hashes, and how text is normalized to them.
+languages are configured in common.ANAGRAM_LANGUAGES.
+"""
+import re
+import unicodedata
+
+from .common import ANAGRAM_LANGUAGES, ANAGRAM_DEFAULT_LANGUAGE
+
+_languages = dict()
+
+
+class Language(object):
+
+    """
+    letters are lower case, most frequent first. replacements map letters
+    we don't use to ones we do, like 'œ' to 'oe'; they're applied before
+    accents are stripped from anything that isn't one of our letters.
+    """
+
+    def __init__(self, code, letters, replacements=None):
+        self.code = code
+        self.letters = letters
+        self.ranks = dict((letter, i) for i, letter in enumerate(letters))
+        self.replacements = dict(replacements or {})
+        for old, new in list(self.replacements.items()):
+            self.replacements.setdefault(old.upper(), new.upper())
+        both_cases = re.escape(letters + letters.upper())
+        self._not_letters = re.compile('[^%s]' % both_cases)
+        self._not_letters_or_spaces = re.compile('[^%s ]' % both_cases)
+        self._not_text = re.compile('[^%s .,!?"\']' % both_cases)
+        self._kept = set(letters + letters.upper())
+
+    def __repr__(self):
+        return 'Language(%r)' % self.code
+
+    def stripped(self, text, spaces=False):
+        """returns lower case text with everything but our letters (and spaces) removed."""
+        if spaces:
+            text = re.sub(r'[_-]', ' ', text)  # replace dashes and underbars
+            return self._not_letters_or_spaces.sub('', text).lower()
+        return self._not_letters.sub('', text).lower()
+
+    def normalize(self, text):
+        """strips accents from any letters that aren't ours, leaving case alone."""
+        if _is_ascii(text):
+            return text
+        for old, new in self.replacements.items():
+            text = text.replace(old, new)
+        return ''.join(c if c in self._kept else _strip_accents(c)
+                       for c in unicodedata.normalize('NFC', text))
+
+    def letter_ratio(self, text):
+        """the fraction of text that is letters or ordinary punctuation."""
+        if not text:
+            return 0.0
+        return len(self._not_text.sub('', text)) / float(len(text))
+
+
+def get_language(code=None):
+    """returns the Language for code, or the default language."""
+    code = code or ANAGRAM_DEFAULT_LANGUAGE
+    if code not in _languages:
+        if code not in ANAGRAM_LANGUAGES:
+            raise ValueError('no configuration for language %r' % code)
+        _languages[code] = Language(code, **ANAGRAM_LANGUAGES[code])
+    return _languages[code]
+
+
+def language_codes():
+    return sorted(ANAGRAM_LANGUAGES)
+
+
+def _is_ascii(text):
+    try:
+        text.encode('ascii')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def _strip_accents(s):
+    return ''.join(c for c in unicodedata.normalize('NFD', s)
+                   if unicodedata.category(c) != 'Mn')
@@ -0,0 +1,174 @@
+# coding: utf-8
+"""
+decides how much work to skip when the finder can't keep up.
+
+the controller watches the backlog of unhandled tweets, the rate they
+arrive at, the rate the finder can handle them, and datastore lookup
+latency. as load rises it steps through increasingly costly levels:
+
+    normal   everything runs
+    shallow  archived chunks aren't searched
+    shed     low-interest candidates aren't stored
+    rotate   the oldest hot chunk is archived, at most every ROTATE_INTERVAL
+    pause    hit enrichment waits, leaving its cpu to the finder
+
+each level includes the ones before it. levels go up one step at a time,
+and come down only after the backlog has fallen well below where they
+started, and has stayed there a while; so we degrade gradually, and don't
+flap between levels.
+"""
+from __future__ import print_function
+
+import logging
+import sys
+import time
+
+from collections import deque
+
+from .anagramstats import StatTracker
+from .common import ANAGRAM_STREAM_BUFFER_SIZE, ANAGRAM_INTEREST_FLOOR_MAX
+
+LEVEL_NORMAL = 0
+LEVEL_SHALLOW = 1
+LEVEL_SHED = 2
+LEVEL_ROTATE = 3
+LEVEL_PAUSE = 4
+LEVEL_NAMES = ('normal', 'shallow', 'shed', 'rotate', 'pause')
+
+# the backlog at which each level starts, as a fraction of the backlog limit
+ESCALATE_AT = (0, 0.25, 0.5, 1.0, 1.5)
+RELAX_RATIO = 0.5  # a level ends when backlog is below this fraction of its start
+ESCALATE_HOLD = 5  # seconds between steps up
+RELAX_HOLD = 60  # seconds load must stay low before each step down
+ROTATE_INTERVAL = 60  # seconds between archive jobs
+LOOKUP_LATENCY_LIMIT = 0.001  # seconds per key looked up
+RATE_SMOOTHING = 0.2
+DECISION_LOG_SIZE = 100
+
+
+class LoadController(object):
+
+    """
+    finder should have apply_load_level(level) and perform_maintenance().
+    enrichment, if set, is an EnrichmentPool, paused at LEVEL_PAUSE.
+    call observe() after each batch.
+    """
+
+    def __init__(self, finder, enrichment=None, backlog_limit=ANAGRAM_STREAM_BUFFER_SIZE):
+        self.finder = finder
+        self.enrichment = enrichment
+        self.backlog_limit = backlog_limit
+        self.level = LEVEL_NORMAL
+        self.ingest_rate = None
+        self.processing_rate = None
+        self.decisions = deque(maxlen=DECISION_LOG_SIZE)
+        self.stats = StatTracker()
+        self._last_observed = None
+        self._last_seen = 0
+        self._last_change = 0
+        self._calm_since = None
+        self._last_rotate = 0
+
+    def observe(self, count, elapsed, now=None):
+        """records that the finder handled count inputs in elapsed seconds."""
+        now = now or time.time()
+        if elapsed > 0:
+            self.processing_rate = _smoothed(self.processing_rate, count / elapsed)
+        seen = self.stats['passed_filter']
+        if self._last_observed is not None and now > self._last_observed:
+            rate = max(0, seen - self._last_seen) / (now - self._last_observed)
+            self.ingest_rate = _smoothed(self.ingest_rate, rate)
+        self._last_observed = now
+        self._last_seen = seen
+        self.stats['ingest_rate'] = int(self.ingest_rate or 0)
+        self.stats['processing_rate'] = int(self.processing_rate or 0)
+        self.stats['load_pressure'] = round(self.pressure(), 2)
+        self.decide(now)
+
+    def pressure(self):
+        return self.stats['buffer'] / float(self.backlog_limit)
+
+    def falling_behind(self):
+        return (self.ingest_rate is not None and self.processing_rate is not None and
+                self.ingest_rate > self.processing_rate)
+
+    def target_level(self):
+        pressure = self.pressure()
+        target = max(n for n, start in enumerate(ESCALATE_AT) if pressure >= start)
+        if self.falling_behind() and self.stats['lookup_latency'] > LOOKUP_LATENCY_LIMIT:
+            # slow lookups only matter if they're holding us back
+            target = max(target, LEVEL_SHALLOW)
+        return target
+
+    def decide(self, now=None):
+        now = now or time.time()
+        target = self.target_level()
+        if target < self.level and self._can_relax():
+            if self._calm_since is None:
+                self._calm_since = now
+        else:
+            self._calm_since = None
+
+        if target > self.level and now - self._last_change >= ESCALATE_HOLD:
+            self._set_level(self.level + 1, now)
+        elif self._calm_since is not None and now - self._calm_since >= RELAX_HOLD:
+            self._set_level(self.level - 1, now)
+
+        if self.level >= LEVEL_ROTATE and now - self._last_rotate >= ROTATE_INTERVAL:
+            self._last_rotate = now
+            self.stats['load_rotations'] += 1
+            self.finder.perform_maintenance()
+
+    def _can_relax(self):
+        return (self.pressure() < ESCALATE_AT[self.level] * RELAX_RATIO and
+                not self.falling_behind())
+
+    def _set_level(self, level, now):
+        decision = {'time': now, 'from': LEVEL_NAMES[self.level], 'to': LEVEL_NAMES[level],
+                    'backlog': self.stats['buffer'], 'ingest_rate': self.ingest_rate,
+                    'processing_rate': self.processing_rate,
+                    'lookup_latency': self.stats['lookup_latency']}
+        self.decisions.append(decision)
+        message = 'load level %(from)s -> %(to)s (backlog %(backlog)i)' % decision
+        logging.info('%s: %s' % (message, decision))
+        print(message, file=sys.stderr)
+
+        if self.enrichment is not None:
+            if level >= LEVEL_PAUSE > self.level:
+                self.enrichment.pause()
+            elif self.level >= LEVEL_PAUSE > level:
+                self.enrichment.resume()
+        self.level = level
+        self._last_change = now
+        self._calm_since = None
+        self.stats['load_level'] = level
+        self.stats['load_changes'] += 1
+        self.finder.apply_load_level(level)
+
+    def status(self):
+        return {'level': LEVEL_NAMES[self.level],
+                'pressure': self.pressure(),
+                'ingest_rate': self.ingest_rate,
+                'processing_rate': self.processing_rate,
+                'lookup_latency': self.stats['lookup_latency'],
+                'decisions': list(self.decisions)}
+
+
+def interest_floor(backlog, backlog_limit=ANAGRAM_STREAM_BUFFER_SIZE,
+                   max_floor=ANAGRAM_INTEREST_FLOOR_MAX):
+    """
+    the interest score below which tweets are dropped at the filter.
+    0 until the backlog reaches the shed level, rising to max_floor
+    where the rotate level starts.
+    """
+    start = ESCALATE_AT[LEVEL_SHED] * backlog_limit
+    full = ESCALATE_AT[LEVEL_ROTATE] * backlog_limit
+    if backlog <= start:
+        return 0
+    return max_floor * min(1, (backlog - start) / float(full - start))
+
+
+def _smoothed(average, value):
+    if average is None:
+        return value
+    return average + RATE_SMOOTHING * (value - average)
@@ -0,0 +1,115 @@
+from __future__ import print_function
+
+import logging
+import queue as Queue
+import threading
+import time
+
+JOB_ROTATE = 'rotate'
+JOB_ARCHIVE = 'archive'
+JOB_REORGANIZE = 'reorganize'
+
+
+class MaintenanceWorker(object):
+
+    """
+    runs MultiDBM maintenance (chunk rotation, archiving, reorganizing)
+    in a background thread, so that it doesn't stop ingestion.
+    jobs run one at a time, in the order they were scheduled.
+    """
+
+    def __init__(self, datastore):
+        self.datastore = datastore
+        self._jobs = Queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._unpaused = threading.Event()
+        self._unpaused.set()
+        self._progress = {'job': None, 'done': 0, 'total': 0, 'started': None}
+        self._thread = threading.Thread(target=self._run, name='mdbm-maintenance')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def schedule(self, job, *args):
+        """
+        queues a job, unless an identical job is already waiting.
+        returns True if the job was queued.
+        """
+        with self._lock:
+            if (job, args) in self._pending:
+                return False
+            self._pending.add((job, args))
+        self._jobs.put((job, args))
+        logging.debug('scheduled maintenance job %s %s' % (job, args))
+        return True
+
+    def schedule_reorganize_all(self):
+        """queues a reorganize job for every sealed hot chunk."""
+        for gen in self.datastore.generations('hot')[:-1]:
+            self.schedule(JOB_REORGANIZE, gen['name'])
+
+    def is_idle(self):
+        with self._lock:
+            return not self._pending
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def progress(self):
+        """returns a copy of the state of the running job."""
+        with self._lock:
+            return dict(self._progress, paused=not self._unpaused.is_set())
+
+    def pause(self):
+        """the running job stops at its next checkpoint until resume()."""
+        self._unpaused.clear()
+
+    def resume(self):
+        self._unpaused.set()
+
+    def close(self, timeout=None):
+        """lets queued jobs finish, then stops the worker thread."""
+        self.resume()
+        self._jobs.put(None)
+        self._thread.join(timeout)
+
+    def _checkpoint(self, done, total):
+        with self._lock:
+            self._progress['done'] = done
+            self._progress['total'] = total
+        self._unpaused.wait()
+
+    def _run(self):
+        while True:
+            item = self._jobs.get()
+            if item is None:
+                break
+            job, args = item
+            self._unpaused.wait()
+            with self._lock:
+                self._progress = {'job': job, 'args': args, 'done': 0,
+                                  'total': 0, 'started': time.time()}
+            try:
+                self._perform(job, *args)
+            except Exception as err:
+                print('maintenance job %s failed: %s' % (job, err))
+                logging.error('maintenance job %s %s failed: %s' % (job, args, err))
+            finally:
+                with self._lock:
+                    self._pending.discard((job, args))
+                    self._progress = {'job': None, 'done': 0, 'total': 0, 'started': None}
+
+    def _perform(self, job, *args):
+        start = time.time()
+        if job == JOB_ROTATE:
+            self.datastore.rotate()
+        elif job == JOB_ARCHIVE:
+            moved = self.datastore.archive(checkpoint=self._checkpoint)
+            print('moved mdbm chunk: %s' % moved)
+        elif job == JOB_REORGANIZE:
+            self.datastore.reorganize(args[0], checkpoint=self._checkpoint)
+        else:
+            raise ValueError('unknown maintenance job %s' % job)
+        logging.debug('maintenance job %s %s finished in %0.1fs' %
+                      (job, args, time.time() - start))
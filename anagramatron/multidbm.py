@@ -1,16 +1,24 @@
 from __future__ import print_function
+import dbm
 import dbm.gnu as gdbm
-import pickle
+import hashlib
+import json
 import os
 import time
 import re
 import logging
-import sys
-from stat import ST_CTIME
+import threading
+import zlib
+from stat import ST_CTIME, ST_MTIME
 
-from . import anagramfunctions
+from . import anagramfunctions, coldstore
+from .anagramstats import StatTracker
+from .common import (ANAGRAM_COLD_LOOKUP_BUDGET, ANAGRAM_GENERATION_MAX_AGE,
+                     ANAGRAM_STORE_MAX_BYTES)
 
-_METADATA_FILE = 'meta.p'
+_MANIFEST_FILE = 'manifest.json'
+_BATCH_SIZE = 1000  # keys copied per lock acquisition during maintenance
+_CHECKSUM_MODULUS = 2 ** 64
 _PATHKEY = 'X43q2smxlkFJ28h$@3xGN'  # gurrenteed unlikely!!
 
 
@@ -18,146 +26,525 @@ class MultiDBM(object):
     """
     MultiDBM acts as a wrapper around multiple DBM files
     as data retrieval becomes too slow older files are archived.
+    archived files form a read-only cold tier, which is only consulted
+    when no hot file contains a key.
+
+    each file is a 'generation', described by a record in a manifest:
+    its tier, creation & seal times, tweet_id range, key count and size.
+    expiry drops whole generations, so it never touches individual keys.
+
+    all access is guarded by a lock, so that archive() and reorganize()
+    can run in a background thread while the store is in use.
     """
 
-    def __init__(self, path, chunk_size=2000000):
+    def __init__(self, path, chunk_size=2000000,
+                 cold_budget=ANAGRAM_COLD_LOOKUP_BUDGET,
+                 max_age=ANAGRAM_GENERATION_MAX_AGE,
+                 max_bytes=ANAGRAM_STORE_MAX_BYTES):
         self._data = []
-        self._metadata = dict()
+        self._gens = []
+        self._manifest = dict()
         self._path = path
         self._section_size = chunk_size
+        self._cold_budget = cold_budget
+        self._cold = None
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.stats = StatTracker()
+        self._lock = threading.RLock()
+        # chunks being reorganized are not written; writes wait here instead
+        self._frozen = dict()
+        # chunks being converted to the cold tier, still readable
+        self._retiring = []
+        # names of hot chunks written since the last sync
+        self._unsynced = set()
         self._setup()
 
     def __contains__(self, item):
-        for db in self._data:
-            if item in db:
-                return True
-        return False
+        with self._lock:
+            return self._raw_value(item) is not None
 
     def __getitem__(self, key):
-        for db in self._data:
-            if key in db:
-                val = db[key].decode('utf-8')
-                # this is kinda gross
-                try:
-                    val = anagramfunctions.decode_tweet(val)
-                except:
-                    pass
-                return val
-        raise KeyError
+        with self._lock:
+            val = self._raw_value(key)
+        if val is None:
+            raise KeyError
+        return _decoded(val)
 
     def __setitem__(self, key, value):
-        i = 0
-        if self._metadata['cursize'] == self._section_size:
-            self._add_db()
-        last_db = len(self._data) - 1
-        for db in self._data:
-            if key in db or i == last_db:
-                if i == last_db and key not in db:
-                    self._metadata['totsize'] += 1
-                    self._metadata['cursize'] += 1
-                # logging.debug('adding key to file # %i' % i)
-                if isinstance(value, dict):
-                    value = anagramfunctions.encode_tweet(value)
-                db[key] = value
-                return
-            i += 1
+        """value is a tweet dict, a string, or a list of either."""
+        candidates = value if isinstance(value, list) else [value]
+        tweet_ids = [c.get('tweet_id') for c in candidates if isinstance(c, dict)]
+        if isinstance(value, list):
+            value = anagramfunctions.encode_candidates(value)
+        elif isinstance(value, dict):
+            value = anagramfunctions.encode_tweet(value)
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        with self._lock:
+            if self._gens[-1]['keys'] >= self._section_size:
+                self._add_db()
+            last_db = len(self._data) - 1
+            for i in range(len(self._data)):
+                old = self._chunk_get(i, key)
+                if i == last_db or old is not None:
+                    gen = self._gens[i]
+                    if old is None:
+                        gen['keys'] += 1
+                    for tweet_id in tweet_ids:
+                        _update_id_range(gen, tweet_id)
+                    _update_checksum(gen, key, old, value)
+                    self._chunk_set(i, key, value)
+                    return
 
     def __delitem__(self, key):
-        for db in self._data:
-            if key in db:
-                del db[key]
-                self._metadata['totsize'] -= 1
-                return
+        with self._lock:
+            for i in range(len(self._data)):
+                old = self._chunk_get(i, key)
+                if old is not None:
+                    self._chunk_set(i, key, None)
+                    self._gens[i]['keys'] -= 1
+                    _update_checksum(self._gens[i], key, old, None)
+                    return
         raise KeyError
 
     def __len__(self):
+        """the number of keys in hot generations."""
+        return sum(gen['keys'] for gen in self._gens)
+
+    def __bool__(self):
+        # an empty store is still a store
+        return True
+
+    def get(self, key, default=None, since=None, until=None):
         """
-        length calculations are estimates since we assume
-        all non-current chunks are at capacity.
-        In reality some keys will likely get deleted.
+        like __getitem__, but only searches generations that were
+        being written to at some point between since and until (unix times).
         """
-        return (self._section_size * len(self._data)-1 +
-                self._metadata['cursize'])
+        with self._lock:
+            for i, gen in enumerate(self._gens):
+                if _in_window(gen, since, until):
+                    val = self._chunk_get(i, key)
+                    if val is not None:
+                        return _decoded(val.decode('utf-8'))
+            cold_names = set(gen['name'] for gen in self.generations('cold')
+                             if _in_window(gen, since, until))
+            if cold_names:
+                val = self._cold.lookup(key, lambda chunk: chunk.name in cold_names)
+                if val is not None:
+                    return _decoded(val)
+        return default
+
+    def _raw_value(self, key):
+        """searches hot, retiring and then cold chunks. returns a str or None."""
+        for i in range(len(self._data)):
+            val = self._chunk_get(i, key)
+            if val is not None:
+                self.stats['hot_hits'] += 1
+                return val.decode('utf-8')
+        for gen, db in self._retiring:
+            if key in db:
+                self.stats['hot_hits'] += 1
+                return db[key].decode('utf-8')
+        return self._cold.lookup(key)
+
+    def _chunk_get(self, idx, key):
+        if self._frozen:
+            pending = self._frozen.get(self._gens[idx]['name'])
+            if pending is not None and key in pending:
+                return pending[key]
+        db = self._data[idx]
+        if key in db:
+            return db[key]
+        return None
+
+    def _chunk_set(self, idx, key, value):
+        """sets key in the chunk at idx. a value of None deletes the key."""
+        name = self._gens[idx]['name']
+        pending = self._frozen.get(name)
+        if pending is not None:
+            pending[key] = value
+            return
+        if value is None:
+            del self._data[idx][key]
+        else:
+            self._data[idx][key] = value
+        self._unsynced.add(name)
+
+    def get_many(self, keys):
+        """
+        looks up many keys at once, returning a dict of those that were found.
+        each chunk is probed for all remaining keys, in key order, before
+        moving on to the next, and the lock is taken only once.
+        """
+        remaining = sorted(set(keys))
+        found = dict()
+        with self._lock:
+            for i in range(len(self._data)):
+                if not remaining:
+                    break
+                missed = []
+                for key in remaining:
+                    val = self._chunk_get(i, key)
+                    if val is None:
+                        missed.append(key)
+                    else:
+                        found[key] = val
+                remaining = missed
+            for gen, db in self._retiring:
+                for key in remaining:
+                    if key in db:
+                        found[key] = db[key]
+                remaining = [key for key in remaining if key not in found]
+            self.stats['hot_hits'] += len(found)
+            for key in remaining:
+                val = self._cold.lookup(key)
+                if val is not None:
+                    found[key] = val
+        results = dict()
+        for key, val in found.items():
+            try:
+                if isinstance(val, bytes):
+                    val = val.decode('utf-8')
+            except UnicodeDecodeError:
+                print('error decoding value for key %s' % key)
+                continue
+            results[key] = _decoded(val)
+        return results
+
+    def generations(self, tier=None):
+        """returns manifest records, oldest first, optionally for one tier."""
+        return [gen for gen in self._manifest['generations']
+                if tier is None or gen['tier'] == tier]
 
     def _setup(self):
         if os.path.exists(self._path):
-            try:
-                self._metadata = pickle.load(open('%s/%s' % (self._path, _METADATA_FILE), 'rb'))
-                print('loaded metadata: %s' % repr(self._metadata))
-                logging.debug('loaded metadata %s' % repr(self._metadata))
-            except IOError:
-                print("IO error loading metadata?")
-                self._setup_metadata()
-
-            dbses = _load_paths(self._path)
-            for db in dbses:
+            self._load_manifest()
+            for gen in self.generations('hot'):
+                path = os.path.join(self._path, gen['name'])
+                if not os.path.exists(path):
+                    # we were interrupted while archiving this chunk
+                    print('dbfile missing, marking as archived: %s' % path)
+                    gen['tier'] = 'archive'
+                    continue
                 try:
-                    self._data.append(gdbm.open(db, 'c'))
+                    self._data.append(gdbm.open(path, 'c'))
+                    self._gens.append(gen)
                 except Exception as err:
-                    print('error appending dbfile: %s' % db, err)
+                    print('error appending dbfile: %s' % path, err)
 
             print('loaded %i dbm files' % len(self._data))
         else:
             print('path not found, creating')
             os.makedirs(self._path)
             os.makedirs('%s/archive' % self._path)
-            self._setup_metadata()
+            self._manifest['generations'] = []
 
         if not len(self._data):
             self._add_db()
+        self._cold = coldstore.ColdStore(
+            '%s/archive' % self._path, self._cold_budget,
+            names=[gen['name'] for gen in self.generations('cold')])
+        print('loaded %i cold chunks' % len(self._cold))
+        self.expire()
+
+    def _load_manifest(self):
+        try:
+            self._manifest = load_manifest(self._path)
+            logging.debug('loaded manifest with %i generations' %
+                          len(self._manifest['generations']))
+        except IOError:
+            print('no manifest found, building one from existing files')
+            self._manifest = {'generations': _legacy_generations(self._path)}
+            self._save_manifest()
 
-    def _setup_metadata(self):
-        # this is basically vestigal at this point?
-        self._metadata['totsize'] = 0
-        self._metadata['cursize'] = 0
+    def _save_manifest(self):
+        save_manifest(self._path, self._manifest)
 
     def _add_db(self):
-        filename = 'mdbm%s.db' % time.strftime("%b%d%H%M%Y")
-        # filename = 'mdbm%s.db' % str(time.time())
+        if self._gens:
+            self._seal(self._gens[-1])
+        filename = _unused_name(self._path, 'mdbm%s.db' % time.strftime('%Y%m%d%H%M%S'))
         path = self._path + '/%s' % filename
         db = gdbm.open(path, 'c')
         db[_PATHKEY] = filename
+        gen = _new_generation(filename)
         self._data.append(db)
-        self._metadata['cursize'] = 0
+        self._gens.append(gen)
+        self._manifest['generations'].append(gen)
+        self._save_manifest()
         logging.debug('mdbm added new dbm file: %s' % filename)
 
-    def _remove_old(self):
-        db = self._data.pop(0)
-        filename = db[_PATHKEY]
-        db.close()
-        target = '%s/%s' % (self._path, filename)
-        destination = '%s/archive/%s' % (self._path, filename)
+    def _seal(self, gen):
+        gen['sealed'] = time.time()
+        self._update_size(gen)
+
+    def _update_size(self, gen):
+        path = generation_path(self._path, gen)
         try:
-            os.rename(target, destination)
-        except OSError as err:
-            print("error moving file %s to %s: %s" % (target, destination, err))
-            sys.exit(1)
-        logging.debug('mdbm moved old dbm file to %s' % destination)
-        return destination
+            gen['bytes'] = os.path.getsize(path)
+            if gen['tier'] == 'cold':
+                gen['bytes'] += os.path.getsize(path + coldstore.FILTER_EXTENSION)
+        except OSError:
+            pass
+
+    def rotate(self):
+        """seals the current chunk and starts a new one."""
+        with self._lock:
+            self._add_db()
+
+    def archive(self, checkpoint=None):
+        """
+        moves the oldest hot chunk to the archive and converts it to a
+        cold chunk. The conversion runs without holding the lock; the
+        chunk stays searchable until the cold chunk replaces it.
+        checkpoint, if given, is called periodically with (done, total).
+        """
+        with self._lock:
+            if len(self._data) < 2:
+                self._add_db()
+            db = self._data.pop(0)
+            gen = self._gens.pop(0)
+            filename = db[_PATHKEY].decode('utf-8')
+            db.close()
+            target = '%s/%s' % (self._path, filename)
+            destination = '%s/archive/%s' % (self._path, filename)
+            try:
+                os.rename(target, destination)
+            except OSError as err:
+                # this runs on the maintenance thread: put the chunk back, so
+                # its keys can still be found, and let the failure be reported
+                self._data.insert(0, gdbm.open(target, 'c'))
+                self._gens.insert(0, gen)
+                logging.error('error moving file %s to %s: %s' % (target, destination, err))
+                raise
+            logging.debug('mdbm moved old dbm file to %s' % destination)
+            if gen.get('sealed') is None:
+                gen['sealed'] = time.time()
+            gen['tier'] = 'archive'
+            gen['name'] = filename
+            self._save_manifest()
+            retiring = (gen, gdbm.open(destination, 'r'))
+            self._retiring.append(retiring)
+
+        try:
+            cold_path = coldstore.convert_chunk(destination, [_PATHKEY], checkpoint)
+        except Exception as err:
+            print('failed to convert %s to cold chunk: %s' % (destination, err))
+            cold_path = None
+
+        with self._lock:
+            self._retiring.remove(retiring)
+            retiring[1].close()
+            if cold_path:
+                self._cold.add_converted(destination, cold_path)
+                gen['tier'] = 'cold'
+                gen['name'] = os.path.basename(cold_path)
+            self._update_size(gen)
+            self._save_manifest()
+            self.expire()
+        return cold_path or destination
+
+    def add_cold_chunk(self, name, entries, capacity, like=None):
+        """
+        writes (key, compressed value) pairs to a new cold chunk called
+        name, or a name like it, as the store's oldest generation. like, a
+        generation record from another store, gives its times and tweet_id
+        range. this moves archived keys between stores without inflating them.
+        """
+        archive_path = os.path.join(self._path, 'archive')
+        cold_path = os.path.join(archive_path, _unused_name(archive_path, name))
+        checksum = [0]
+
+        def summed(entries):
+            for k, compressed in entries:
+                checksum[0] += entry_digest(k, zlib.decompress(compressed))
+                yield k, compressed
+
+        keys = coldstore.write_chunk(cold_path, summed(entries), capacity)
+        like = like or dict()
+        gen = _new_generation(os.path.basename(cold_path), 'cold', like.get('created'),
+                              checksum[0] % _CHECKSUM_MODULUS)
+        gen['sealed'] = like.get('sealed') or gen['created']
+        gen['min_id'], gen['max_id'] = like.get('min_id'), like.get('max_id')
+        gen['keys'] = keys
+        self._update_size(gen)
+        with self._lock:
+            self._manifest['generations'].insert(0, gen)
+            self._cold.add_oldest(cold_path)
+            self._save_manifest()
+        return gen
+
+    def reorganize(self, name, checkpoint=None):
+        """
+        compacts the sealed hot chunk called name.
+        keys are copied to a shadow file, which then replaces the chunk.
+        while copying, writes to the chunk are held in memory, and applied
+        to the shadow before it is swapped in.
+        """
+        with self._lock:
+            idx = [gen['name'] for gen in self._gens].index(name)
+            if idx == len(self._gens) - 1:
+                raise ValueError('cannot reorganize the current chunk')
+            gen = self._gens[idx]
+            db = self._data[idx]
+            self._frozen[name] = pending = dict()
+            total = gen['keys']
+
+        path = os.path.join(self._path, name)
+        shadow_path = path + '.shadow'
+        shadow = gdbm.open(shadow_path, 'n')
+        swapping = False
+        try:
+            done = 0
+            with self._lock:
+                k = db.firstkey()
+            while k is not None:
+                with self._lock:
+                    for _ in range(_BATCH_SIZE):
+                        if k is None:
+                            break
+                        shadow[k] = db[k]
+                        done += 1
+                        k = db.nextkey(k)
+                if checkpoint:
+                    checkpoint(done, total)
+
+            with self._lock:
+                for key, value in pending.items():
+                    if value is None:
+                        if key in shadow:
+                            del shadow[key]
+                    else:
+                        shadow[key] = value
+                shadow.reorganize()
+                shadow.close()
+                idx = self._gens.index(gen)
+                swapping = True
+                self._data[idx].close()
+                os.replace(shadow_path, path)
+                self._data[idx] = gdbm.open(path, 'c')
+                del self._frozen[name]
+                self._update_size(gen)
+                self._save_manifest()
+        except Exception:
+            with self._lock:
+                # put back whatever was written while we were copying
+                if name in self._frozen:
+                    if swapping:
+                        # the chunk was closed to be replaced. whichever file is
+                        # in place, the original or the finished shadow, has
+                        # every key; replaying pending into it is harmless.
+                        db = gdbm.open(path, 'c')
+                        self._data[self._gens.index(gen)] = db
+                    del self._frozen[name]
+                    for key, value in pending.items():
+                        if value is None:
+                            if key in db:
+                                del db[key]
+                        else:
+                            db[key] = value
+            shadow.close()
+            if os.path.exists(shadow_path):
+                os.remove(shadow_path)
+            raise
+        logging.debug('mdbm reorganized %s' % name)
+
+    def _drop(self, gen):
+        """deletes the files of a whole generation."""
+        if gen['tier'] == 'hot':
+            idx = self._gens.index(gen)
+            self._data.pop(idx).close()
+            self._gens.pop(idx)
+            os.remove(os.path.join(self._path, gen['name']))
+        elif gen['tier'] == 'cold':
+            self._cold.drop(gen['name'])
+        else:
+            os.remove(os.path.join(self._path, 'archive', gen['name']))
+        self._manifest['generations'].remove(gen)
+        logging.debug('mdbm dropped generation %s' % gen['name'])
+
+    def expire(self, now=None):
+        """
+        drops whole generations older than max_age seconds,
+        then drops the oldest generations until we fit in max_bytes.
+        the generation currently being written is never dropped.
+        returns the names of dropped generations.
+        """
+        if self.max_age is None and self.max_bytes is None:
+            return []
+        now = now or time.time()
+        current = self._gens[-1]
+        busy = set(self._frozen).union(gen['name'] for gen, db in self._retiring)
+        candidates = [gen for gen in self.generations()
+                      if gen is not current and gen['name'] not in busy]
+        dropped = []
+        for gen in candidates:
+            self._update_size(gen)
+        total = sum(gen['bytes'] for gen in self.generations())
+        for gen in candidates:
+            too_old = (self.max_age is not None and
+                       (gen['sealed'] or now) < now - self.max_age)
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not (too_old or too_big):
+                continue
+            try:
+                self._drop(gen)
+            except OSError as err:
+                print('error dropping generation %s: %s' % (gen['name'], err))
+                continue
+            total -= gen['bytes']
+            dropped.append(gen['name'])
+        if dropped:
+            self._save_manifest()
+            print('expired %i generations' % len(dropped))
+        return dropped
 
     def section_count(self):
         return len(self._data)
 
-    def archive(self):
-        return self._remove_old()
+    def cold_might_contain(self, key):
+        """False if no archived chunk holds key; True if one might."""
+        with self._lock:
+            return any(chunk.might_contain(key) for chunk in self._cold.chunks)
+
+    def set_cold_lookups(self, enabled):
+        """turns searching of archived chunks off, or back on."""
+        with self._lock:
+            self._cold.budget = self._cold_budget if enabled else 0
+
+    def sync(self):
+        """
+        flushes the current chunk, any sealed chunks written since the last
+        sync, and the manifest to disk, so that readers in other processes
+        see recent writes and checksums that match them.
+        """
+        with self._lock:
+            for idx, gen in enumerate(self._gens):
+                if gen['name'] in self._unsynced or idx == len(self._gens) - 1:
+                    self._data[idx].sync()
+                    self._update_size(gen)
+            self._unsynced.clear()
+            self._save_manifest()
 
     def close(self):
-        path = '%s/%s' % (self._path, _METADATA_FILE)
-        print('dumping path:', path)
-        pickle.dump(self._metadata, open(path, 'wb'))
-        for db in self._data:
-            db.close()
+        with self._lock:
+            self._update_size(self._gens[-1])
+            self._save_manifest()
+            for db in self._data:
+                db.close()
+            if self._cold:
+                self._cold.close()
 
     def perform_maintenance(self):
-        import whichdb
+        """reorganizes every sealed chunk, then closes the store."""
         try:
             print("performing maintenance on %d database chunks" % len(self._data))
-            for db in self._data:
-                path = db[_PATHKEY]
-                db_type = whichdb.whichdb(path)
-                print("checking %s, type: %s" % (path, db_type))
+            for gen in self._gens[:-1]:
+                path = os.path.join(self._path, gen['name'])
+                print("checking %s, type: %s" % (path, dbm.whichdb(path)))
                 try:
-                    db.reorganize()
+                    self.reorganize(gen['name'])
                 except gdbm.error:
                     print("error: failed to reorganize db chunk")
                     continue
@@ -165,25 +552,272 @@ class MultiDBM(object):
             self.close()
 
 
-def check_integrity_for_chunk(db_chunk):
-    # path = db_chunk[_PATHKEY]
-    # print("checking keys in db: %s\n" % path)
-    k = db_chunk.firstkey()
-    nextkey = k
-    seen = set()
+def load_manifest(mdbm_path):
+    with open(os.path.join(mdbm_path, _MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def save_manifest(mdbm_path, manifest):
+    """writes the manifest to a temporary file and renames it into place."""
+    path = os.path.join(mdbm_path, _MANIFEST_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def generation_path(mdbm_path, gen):
+    if gen['tier'] == 'hot':
+        return os.path.join(mdbm_path, gen['name'])
+    return os.path.join(mdbm_path, 'archive', gen['name'])
+
+
+def entry_digest(key, value):
+    """
+    a 64 bit digest of a single key/value pair. a chunk's checksum is the
+    sum of the digests of its entries, so it doesn't depend on key order
+    and can be updated as keys are written.
+    """
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    digest = hashlib.blake2b(key + b'\x00' + value, digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def _update_checksum(gen, key, old, new):
+    checksum = gen.get('checksum')
+    if checksum is None:
+        # chunks from before checksums were kept get one from verification
+        return
+    if old is not None:
+        checksum -= entry_digest(key, old)
+    if new is not None:
+        checksum += entry_digest(key, new)
+    gen['checksum'] = checksum % _CHECKSUM_MODULUS
+
+
+def _new_generation(name, tier='hot', created=None, checksum=0):
+    return {'name': name,
+            'tier': tier,
+            'created': created or time.time(),
+            'sealed': None,
+            'min_id': None,
+            'max_id': None,
+            'keys': 0,
+            'bytes': 0,
+            'checksum': checksum}
+
+
+def _update_id_range(gen, tweet_id):
+    if tweet_id is None:
+        return
+    if gen['min_id'] is None or tweet_id < gen['min_id']:
+        gen['min_id'] = tweet_id
+    if gen['max_id'] is None or tweet_id > gen['max_id']:
+        gen['max_id'] = tweet_id
+
+
+def _in_window(gen, since, until):
+    """True if gen was open for writing at some point in [since, until]."""
+    if since is not None and gen['sealed'] is not None and gen['sealed'] < since:
+        return False
+    if until is not None and gen['created'] > until:
+        return False
+    return True
+
+
+def _unused_name(path, filename):
+    base, ext = os.path.splitext(filename)
+    count = 1
+    while os.path.exists(os.path.join(path, filename)):
+        filename = '%s-%i%s' % (base, count, ext)
+        count += 1
+    return filename
+
+
+def _legacy_generations(mdbm_path):
+    """
+    builds manifest records for a store written before manifests existed.
+    key counts for hot chunks are read from the files; ids are unknown.
+    """
+    gens = []
+    archive_path = os.path.join(mdbm_path, 'archive')
+    if os.path.exists(archive_path):
+        for path in _load_paths(archive_path):
+            if path.endswith(coldstore.COLD_EXTENSION):
+                stat = os.stat(path)
+                gen = _new_generation(os.path.basename(path), 'cold',
+                                      stat[ST_CTIME], checksum=None)
+                gen['sealed'] = stat[ST_MTIME]
+                gens.append(gen)
+    hot_paths = _load_paths(mdbm_path)
+    for path in hot_paths:
+        stat = os.stat(path)
+        gen = _new_generation(os.path.basename(path), 'hot',
+                              stat[ST_CTIME], checksum=None)
+        if path != hot_paths[-1]:
+            gen['sealed'] = stat[ST_MTIME]
+        try:
+            db = gdbm.open(path, 'r')
+            gen['keys'] = max(0, len(db) - 1)
+            db.close()
+        except Exception as err:
+            print('error reading dbfile: %s' % path, err)
+        gen['bytes'] = stat.st_size
+        gens.append(gen)
+    return gens
+
+
+class MultiDBMReader(object):
+    """
+    a read-only, point-in-time view of a MultiDBM store.
+    chunks are opened without locks, so a reader can be used while the
+    store is open for writing in another process.
+    the set of chunks is the one listed in the manifest when the reader
+    was created (or last refreshed); later rotations and archiving are not
+    seen, but files that were moved or deleted stay readable until refresh.
+    only the chunk currently being written can change underneath us; the
+    writer syncs it periodically, and lookups that fail are treated as misses.
+    """
+
+    def __init__(self, path, include_cold=True):
+        self._path = path
+        self._include_cold = include_cold
+        self._hot = []
+        self._cold = None
+        self._generations = []
+        self.snapshot_time = None
+        self.errors = 0
+        self.refresh()
+
+    def __contains__(self, key):
+        return self._raw_value(key) is not None
+
+    def __getitem__(self, key):
+        val = self._raw_value(key)
+        if val is None:
+            raise KeyError(key)
+        return _decoded(val)
+
+    def get(self, key, default=None):
+        val = self._raw_value(key)
+        if val is None:
+            return default
+        return _decoded(val)
+
+    def generations(self, tier=None):
+        return [gen for gen in self._generations
+                if tier is None or gen['tier'] == tier]
+
+    def refresh(self):
+        """reloads the manifest and reopens every chunk it lists."""
+        self.close()
+        self._generations = load_manifest(self._path)['generations']
+        self.snapshot_time = time.time()
+        for gen in self.generations('hot'):
+            try:
+                self._hot.append(gdbm.open(generation_path(self._path, gen), 'ru'))
+            except Exception as err:
+                # rotated or archived since the manifest was written
+                print('error opening dbfile: %s' % gen['name'], err)
+        if self._include_cold:
+            self._cold = coldstore.ColdStore(
+                '%s/archive' % self._path, budget=float('inf'),
+                names=[gen['name'] for gen in self.generations('cold')], flag='ru')
+
+    def get_many(self, keys):
+        """returns a dict of those keys that were found, and their values."""
+        found = dict()
+        for key in keys:
+            val = self._raw_value(key)
+            if val is not None:
+                found[key] = _decoded(val)
+        return found
+
+    def iterkeys(self):
+        """yields every key in the store once, newest chunks first."""
+        for k, chunk in self._newest_entries():
+            yield k.decode('utf-8')
+
+    def iteritems(self):
+        """
+        yields (key, value) for every key in the store once, newest chunks
+        first. the value is the one a lookup would return.
+        """
+        for k, chunk in self._newest_entries():
+            if isinstance(chunk, coldstore.ColdChunk):
+                yield k.decode('utf-8'), _decoded(chunk.get(k))
+            else:
+                yield k.decode('utf-8'), _decoded(chunk[k].decode('utf-8'))
+
+    def _newest_entries(self):
+        """
+        yields (key, chunk) for each key, from the newest chunk holding it;
+        chunk is a hot dbm file or a ColdChunk. a key archived and then
+        written again is held by a cold chunk and a hot one.
+        """
+        hot = list(reversed(self._hot))
+        for i, db in enumerate(hot):
+            for k in _iter_chunk_keys(db):
+                if not _held_by(k, hot[:i]):
+                    yield k, db
+        if self._cold is not None:
+            cold = self._cold.chunks  # newest first
+            for i, chunk in enumerate(cold):
+                for k in chunk.iterkeys():
+                    if not _held_by(k, hot) and not _held_by(k, cold[:i]):
+                        yield k, chunk
+
+    def _raw_value(self, key):
+        for db in self._hot:
+            try:
+                if key in db:
+                    return db[key].decode('utf-8')
+            except (gdbm.error, KeyError):
+                self.errors += 1
+        if self._cold is not None:
+            return self._cold.lookup(key)
+        return None
+
+    def close(self):
+        for db in self._hot:
+            db.close()
+        self._hot = []
+        if self._cold:
+            self._cold.close()
+            self._cold = None
+
+
+def _held_by(key, chunks):
+    for chunk in chunks:
+        try:
+            if key in chunk:
+                return True
+        except gdbm.error:
+            pass
+    return False
+
+
+def _iter_chunk_keys(db):
+    pathkey = _PATHKEY.encode('utf-8')
+    k = db.firstkey()
     while k is not None:
-        if k in seen:
-            print('found duplicate key, aborting')
-            return
-        seen.add(k)
-        nextkey = db_chunk.nextkey(k)
-        if nextkey == k:
-            print("next key == current key!")
-            break
-        k = nextkey
-        sys.stdout.write('checked: %i\t\t\r' % len(seen))
-        sys.stdout.flush()
-    print("\nno next key found. total keys: %i" % len(seen))
+        if k != pathkey:
+            yield k
+        k = db.nextkey(k)
+
+
+def _decoded(val):
+    # this is kinda gross
+    try:
+        val = anagramfunctions.decode_tweet(val)
+    except:
+        pass
+    return val
 
 
 def _load_paths(mdbm_path):
@@ -195,31 +829,29 @@ def _load_paths(mdbm_path):
     return [path for stat, path in sorted(ls)]
 
 
+def convert_archive(dbpath):
+    """converts any raw chunks in the archive directory to cold chunks."""
+    archive_path = os.path.join(dbpath, 'archive')
+    cold = coldstore.ColdStore(archive_path)
+    for path in _load_paths(archive_path):
+        if not path.endswith('.db'):
+            continue
+        print("converting %s" % path)
+        cold.add_archived(path, skip_keys=[_PATHKEY])
+    print("archive contains %i cold chunks" % len(cold))
+    cold.close()
+
+
 def verify_database(dbpath):
-    db_files = _load_paths(dbpath)
-    print("verifying %i mdbm chunks" % len(db_files))
-    for db in db_files:
-        dbchunk = gdbm.open(db, 'w')
-        # print("reorganizing %s" % db)
-        # try:
-        #     dbchunk.reorganize()
-        # except Exception as err:
-        #     print("couldn't reorganize: error %s" % err)
-        print("checking %s" % db)
-        try:
-            # check_integrity_for_chunk(dbchunk)
-            k = dbchunk.firstkey()
-            print("first key: %s" % k)
-            check_integrity_for_chunk(dbchunk)
-        except Exception as err:
-            print("integrity check failed: error %s" % err)
-        finally:
-            dbchunk.close()
+    from . import verify
+    return verify.verify_store(dbpath)
 
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('-r', '--repair', help='repair/verify datastore', action="store_true")
+    parser.add_argument('-c', '--convert-archive', action="store_true",
+                        help='convert archived chunks to the cold tier')
     parser.add_argument('db', type=str, help="source database file")
     args = parser.parse_args()
 
@@ -228,3 +860,5 @@ if __name__ == '__main__':
 
     if args.repair:
         verify_database(args.db)
+    if args.convert_archive:
+        convert_archive(args.db)
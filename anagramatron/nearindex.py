@@ -0,0 +1,191 @@
+# coding: utf-8
+"""
+finds near anagrams: earlier tweets whose letters are a new tweet's
+letters with one added or taken away.
+
+a tweet's neighbours are the hashes one letter away from its own, at
+most 52 of them. we probe the cache for all of them, which is cheap.
+the datastore is only probed for neighbours that a membership filter
+says it might hold, and then in a single get_many per batch.
+"""
+from __future__ import print_function
+
+import json
+import logging
+import os
+import threading
+import time
+
+from . import anagramfunctions, coldstore, multidbm
+from .anagramstats import StatTracker
+from .common import ANAGRAM_DATA_DIR, ANAGRAM_NEAR_FILTER_CAPACITY
+
+HASH_OFFSET = 64  # improved_hash stores a letter count c as chr(c + 64)
+MAX_COUNT = 48  # improved_hash caps counts here
+NEAR_HITS_FILE = 'near_hits.jsonl'
+
+
+def hash_counts(in_hash):
+    """returns the letter counts in an improved hash, most frequent letter first."""
+    counts = [ord(c) - HASH_OFFSET for c in in_hash]
+    return counts + [0] * (len(anagramfunctions.ENGLISH_LETTER_LIST) - len(counts))
+
+
+def hash_from_counts(counts):
+    """the improved hash of a text with these letter counts."""
+    present = [i for i, count in enumerate(counts) if count]
+    if not present:
+        return '@@'
+    in_hash = ''.join(chr(count + HASH_OFFSET) for count in counts[:present[-1] + 1])
+    if len(in_hash) % 2:
+        in_hash += chr(HASH_OFFSET)
+    return in_hash
+
+
+def neighbor_hashes(in_hash):
+    """
+    yields (hash, letter, difference) for every hash one letter away.
+    difference is -1 if letter was taken away, 1 if it was added.
+    """
+    counts = hash_counts(in_hash)
+    for i, letter in enumerate(anagramfunctions.ENGLISH_LETTER_LIST):
+        if counts[i]:
+            counts[i] -= 1
+            yield hash_from_counts(counts), letter, -1
+            counts[i] += 1
+        if counts[i] < MAX_COUNT:
+            counts[i] += 1
+            yield hash_from_counts(counts), letter, 1
+            counts[i] -= 1
+
+
+class NearAnagramIndex(object):
+
+    """
+    finds near anagrams among an AnagramFinder's cache and datastore.
+    the filter of stored keys is built in the background from the hot
+    chunks at store_path, and kept up to date with add_stored();
+    cold chunks have filters of their own. until the build is done,
+    some stored near anagrams are missed.
+    """
+
+    def __init__(self, cache, datastore=None, store_path=None,
+                 test_func=anagramfunctions.test_near_anagram,
+                 filter_capacity=ANAGRAM_NEAR_FILTER_CAPACITY):
+        self.cache = cache
+        self.datastore = datastore
+        self.test_func = test_func
+        self.stats = StatTracker()
+        self._stored = coldstore.BloomFilter(filter_capacity)
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._loader = None
+        if datastore is not None and store_path:
+            self._loader = threading.Thread(target=self._load_stored_keys,
+                                            args=(store_path,), name='near-filter')
+            self._loader.daemon = True
+            self._loader.start()
+
+    def add_stored(self, keys):
+        """records keys that were written to the datastore."""
+        with self._lock:
+            for key in keys:
+                self._stored.add(key)
+
+    def find(self, items, text_for):
+        """
+        items is a list of (input, text, hash), not yet added to the cache.
+        returns a list of (index, match) for the items with a near anagram
+        earlier in the cache, the datastore or items, in input order.
+        text_for(candidate) returns a candidate's text.
+        """
+        start = time.time()
+        matches = dict()
+        wanted = dict()  # neighbour hash: indexes of the items it neighbours
+        earlier = dict()  # hash: the items so far with that hash
+        cache_probes = skipped = 0
+        for idx, (inp, text, key) in enumerate(items):
+            for neighbor, letter, difference in neighbor_hashes(key):
+                cache_probes += 1
+                candidates = list(self.cache[neighbor]) if neighbor in self.cache else []
+                candidates.extend(earlier.get(neighbor, ()))
+                if candidates:
+                    match = self._match(text, candidates, text_for)
+                    if match is not None:
+                        matches[idx] = match
+                        break
+                if neighbor not in self.cache and self.datastore is not None:
+                    if self._might_be_stored(neighbor):
+                        wanted.setdefault(neighbor, []).append(idx)
+                    else:
+                        skipped += 1
+            earlier.setdefault(key, []).append(inp)
+
+        if wanted:
+            stored = self.datastore.get_many(wanted)
+            for neighbor, value in stored.items():
+                candidates = anagramfunctions.decode_candidates(value, neighbor)
+                for idx in wanted[neighbor]:
+                    if idx not in matches:
+                        match = self._match(items[idx][1], candidates, text_for)
+                        if match is not None:
+                            matches[idx] = match
+
+        self.stats['near_tweets'] += len(items)
+        self.stats['near_cache_probes'] += cache_probes
+        self.stats['near_store_probes'] += len(wanted)
+        self.stats['near_filter_skips'] += skipped
+        self.stats['near_hits'] += len(matches)
+        self.stats['near_seconds'] += time.time() - start
+        self.stats['near_us_per_tweet'] = int(
+            self.stats['near_seconds'] * 1e6 / self.stats['near_tweets'])
+        return [(idx, matches[idx]) for idx in sorted(matches)]
+
+    def _match(self, text, candidates, text_for):
+        for candidate in candidates:
+            try:
+                if self.test_func(text, text_for(candidate)):
+                    return candidate
+            except (UnicodeDecodeError, ValueError, TypeError):
+                continue
+        return None
+
+    def _might_be_stored(self, key):
+        return key in self._stored or self.datastore.cold_might_contain(key)
+
+    def _load_stored_keys(self, store_path):
+        start = time.time()
+        try:
+            reader = multidbm.MultiDBMReader(store_path, include_cold=False)
+            count = 0
+            for key in reader.iterkeys():
+                if self._stopped:
+                    break
+                with self._lock:
+                    self._stored.add(key)
+                count += 1
+            reader.close()
+        except Exception as err:
+            logging.error('failed to build near anagram filter: %s' % err)
+            return
+        logging.info('near anagram filter loaded %i keys in %0.1fs' %
+                     (count, time.time() - start))
+
+    def close(self):
+        self._stopped = True
+
+
+class NearHitLog(object):
+
+    """
+    a near_hit_callback that appends near hits to a file, one json
+    object per line, apart from the exact hits we post.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(ANAGRAM_DATA_DIR, NEAR_HITS_FILE)
+
+    def __call__(self, first, second):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'time': time.time(), 'tweet_one': first,
+                                'tweet_two': second}) + '\n')
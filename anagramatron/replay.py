@@ -0,0 +1,319 @@
+# coding: utf-8
+"""
+records the raw tweet stream to disk, and replays recordings over zmq, so
+the whole pipeline can be load tested offline with real traffic.
+
+a recording is a directory of gzipped segments. each line of a segment is
+a message as it arrived, '<arrival time><tab><raw message>'. index.json
+lists the closed segments in order, with their first and last arrival
+times and message counts, so a replay can start part way through without
+reading what comes before.
+
+the replayer publishes messages unchanged on a zmq PUB socket, like the
+stream publisher, so a StreamHandler pointed at it can't tell the difference.
+
+    python -m anagramatron.replay record recordings/monday --duration 3600
+    python -m anagramatron.replay replay recordings/monday --speed 10
+    python -m anagramatron --port 8070
+"""
+from __future__ import print_function
+
+import gzip
+import json
+import os
+import re
+import sys
+import time
+import zlib
+
+import zmq
+
+from . import anagramfunctions
+
+SEGMENT_MESSAGES = 100000
+INDEX_FILE = 'index.json'
+DEFAULT_REPLAY_PORT = 8070
+STARTUP_WAIT = 1.0  # seconds for subscribers to connect before we publish
+SEND_HIGH_WATER_MARK = 100000
+REPORT_INTERVAL = 10  # seconds
+_SEGMENT_RE = re.compile(r'^seg(\d+)\.gz$')
+
+
+def load_index(path):
+    index_path = os.path.join(path, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return {'segments': []}
+    with open(index_path) as f:
+        return json.load(f)
+
+
+def save_index(path, index):
+    """writes the index to a temporary file and renames it into place."""
+    index_path = os.path.join(path, INDEX_FILE)
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=1)
+    os.rename(index_path + '.tmp', index_path)
+
+
+def read_segment(path):
+    """
+    yields (arrival time, raw message) for each message in a segment.
+    a segment cut short by a crash is read up to where it ends.
+    """
+    try:
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                arrived, raw = line[:-1].split(b'\t', 1)
+                yield float(arrived), raw
+    except (EOFError, zlib.error, OSError) as err:
+        print('segment %s ends early: %s' % (path, err), file=sys.stderr)
+
+
+class Recorder(object):
+
+    """
+    writes messages to a recording at path. a recording can be added to
+    by later recorders; segments left out of the index by a crash are
+    indexed when the next recorder starts.
+    """
+
+    def __init__(self, path, segment_messages=SEGMENT_MESSAGES):
+        self.path = path
+        self.segment_messages = segment_messages
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.index = load_index(path)
+        self._file = None
+        self._segment = None
+        self._recover()
+
+    def _recover(self):
+        indexed = set(s['name'] for s in self.index['segments'])
+        for name in sorted(os.listdir(self.path)):
+            if _SEGMENT_RE.match(name) and name not in indexed:
+                segment = {'name': name, 'first': None, 'last': None, 'count': 0}
+                for arrived, raw in read_segment(os.path.join(self.path, name)):
+                    segment['first'] = segment['first'] or arrived
+                    segment['last'] = arrived
+                    segment['count'] += 1
+                self.index['segments'].append(segment)
+        save_index(self.path, self.index)
+
+    def write(self, raw, arrived=None):
+        """records a raw message, as bytes."""
+        arrived = arrived or time.time()
+        if self._file is None:
+            name = 'seg%06d.gz' % len(self.index['segments'])
+            self._file = gzip.open(os.path.join(self.path, name), 'wb')
+            self._segment = {'name': name, 'first': arrived, 'last': arrived, 'count': 0}
+        # json has no newlines outside strings that matter
+        self._file.write(b'%.3f\t%s\n' % (arrived, raw.replace(b'\n', b' ')))
+        self._segment['last'] = arrived
+        self._segment['count'] += 1
+        if self._segment['count'] >= self.segment_messages:
+            self._close_segment()
+
+    def _close_segment(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self.index['segments'].append(self._segment)
+        save_index(self.path, self.index)
+        self._file = self._segment = None
+
+    def count(self):
+        pending = self._segment['count'] if self._segment else 0
+        return sum(s['count'] for s in self.index['segments']) + pending
+
+    def close(self):
+        self._close_segment()
+
+
+def record(path, host='127.0.0.1', port=8069, limit=None, duration=None, context=None):
+    """
+    records the stream published at host:port until limit messages or
+    duration seconds, or until interrupted.
+    """
+    context = context or zmq.Context.instance()
+    socket = context.socket(zmq.SUB)
+    socket.connect('tcp://%s:%s' % (host, port))
+    socket.setsockopt(zmq.SUBSCRIBE, b'')
+    recorder = Recorder(path)
+    start = last_report = time.time()
+    count = 0
+    try:
+        while not (limit and count >= limit) and not (duration and time.time() - start > duration):
+            if not socket.poll(1000):
+                continue
+            recorder.write(socket.recv())
+            count += 1
+            if time.time() - last_report > REPORT_INTERVAL:
+                last_report = time.time()
+                print('recorded %i messages, %0.1f/s' % (count, count / (last_report - start)),
+                      file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.close()
+        socket.close()
+    print('recorded %i messages to %s' % (count, path), file=sys.stderr)
+    return count
+
+
+def publisher(address, context=None, wait=STARTUP_WAIT):
+    """
+    binds a PUB socket on address, and waits for subscribers to connect;
+    zmq drops anything published before they have.
+    """
+    context = context or zmq.Context.instance()
+    socket = context.socket(zmq.PUB)
+    socket.setsockopt(zmq.SNDHWM, SEND_HIGH_WATER_MARK)
+    socket.bind(address)
+    time.sleep(wait)
+    return socket
+
+
+def messages(path, start=None):
+    """
+    yields (arrival time, raw message) from a recording, in order, from
+    start seconds after the recording began. segments that end before
+    then aren't read.
+    """
+    segments = [s for s in load_index(path)['segments'] if s['count']]
+    if not segments:
+        return
+    begin = segments[0]['first'] + (start or 0)
+    for segment in segments:
+        if segment['last'] < begin:
+            continue
+        for arrived, raw in read_segment(os.path.join(path, segment['name'])):
+            if arrived >= begin:
+                yield arrived, raw
+
+
+class Replayer(object):
+
+    """
+    publishes a recording on address. speed 1 keeps the recorded gaps
+    between messages, speed N shrinks them N times, and speed 0 sends
+    as fast as we can. if we can't keep up with the speed asked for,
+    we send as fast as we can until we've caught up; stats['lag'] says
+    how far behind we are.
+    """
+
+    def __init__(self, path, address='tcp://127.0.0.1:%i' % DEFAULT_REPLAY_PORT, speed=1.0,
+                 start=None, limit=None, loop=False, wait=STARTUP_WAIT, context=None):
+        self.path = path
+        self.address = address
+        self.speed = speed
+        self.start = start
+        self.limit = limit
+        self.loop = loop
+        self.wait = wait
+        self.context = context or zmq.Context.instance()
+        self.stats = {'sent': 0, 'lag': 0.0, 'rate': 0.0}
+        self._stopped = False
+
+    def stop(self):
+        self._stopped = True
+
+    def run(self):
+        socket = publisher(self.address, self.context, self.wait)
+        began = time.time()
+        try:
+            while True:
+                self._replay_once(socket)
+                if not self.loop or self._stopped or self._done():
+                    break
+            self.stats['rate'] = self.stats['sent'] / max(time.time() - began, 0.001)
+        finally:
+            socket.close()
+        return self.stats
+
+    def _replay_once(self, socket):
+        started = first = None
+        last_report = time.time()
+        for arrived, raw in messages(self.path, self.start):
+            if self._stopped or self._done():
+                return
+            now = time.time()
+            if first is None:
+                started, first = now, arrived
+            if self.speed:
+                due = started + (arrived - first) / self.speed
+                if due > now:
+                    time.sleep(due - now)
+                self.stats['lag'] = max(0.0, now - due)
+            socket.send(raw)
+            self.stats['sent'] += 1
+            if now - last_report > REPORT_INTERVAL:
+                last_report = now
+                print('sent %i messages, %0.1f/s, %0.1fs behind' % (
+                    self.stats['sent'], self.stats['sent'] / (now - started),
+                    self.stats['lag']), file=sys.stderr)
+
+    def _done(self):
+        return self.limit is not None and self.stats['sent'] >= self.limit
+
+
+def describe(path):
+    """a line describing the recording at path."""
+    segments = load_index(path)['segments']
+    # segments recovered after a crash may hold nothing, and have no times
+    held = [s for s in segments if s['count']]
+    count = sum(s['count'] for s in held)
+    span = held[-1]['last'] - held[0]['first'] if held else 0
+    return '%i messages in %i segments, over %s' % (
+        count, len(segments), anagramfunctions.format_seconds(span))
+
+
+def _speed(value):
+    return 0.0 if value == 'max' else float(value)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="records the tweet stream, and replays recordings for load tests")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    rec = commands.add_parser('record', help="record the stream to a directory")
+    rec.add_argument('path', help="recording directory")
+    rec.add_argument('--host', default='127.0.0.1', help="stream host")
+    rec.add_argument('--port', type=int, default=8069, help="stream port")
+    rec.add_argument('--limit', type=int, help="stop after this many messages")
+    rec.add_argument('--duration', type=float, help="stop after this many seconds")
+
+    rep = commands.add_parser('replay', help="publish a recording")
+    rep.add_argument('path', help="recording directory")
+    rep.add_argument('--port', type=int, default=DEFAULT_REPLAY_PORT, help="port to publish on")
+    rep.add_argument('--speed', type=_speed, default=1.0,
+                     help="1 for real time, N for N times faster, or 'max'")
+    rep.add_argument('--start', type=float, help="seconds into the recording to start at")
+    rep.add_argument('--limit', type=int, help="stop after this many messages")
+    rep.add_argument('--loop', action="store_true", help="start again at the end")
+
+    info = commands.add_parser('info', help="describe a recording")
+    info.add_argument('path', help="recording directory")
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record(args.path, args.host, args.port, args.limit, args.duration)
+    elif args.command == 'replay':
+        replayer = Replayer(args.path, 'tcp://127.0.0.1:%i' % args.port, args.speed,
+                            args.start, args.limit, args.loop)
+        try:
+            stats = replayer.run()
+        except KeyboardInterrupt:
+            stats = replayer.stats
+        print('sent %(sent)i messages, %(rate)0.1f/s' % stats, file=sys.stderr)
+    else:
+        print(describe(args.path))
+    return 0
+
+
+if __name__ == "__main__":
+    main()
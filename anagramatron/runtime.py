@@ -0,0 +1,161 @@
+# coding: utf-8
+"""
+an asyncio version of the main run loop.
+
+stream consumption, anagram finding, hit persistence and housekeeping run
+as separate tasks, connected by bounded queues. blocking work runs in
+executors, and hits are enriched by the hit manager's EnrichmentPool,
+so a slow network request never stalls matching:
+
+    stream ─▶ batches ─▶ finder ─▶ hits ─▶ persistence ─ ─▶ enrichment
+
+when a queue fills up, the task feeding it waits, and tweets back up in
+the stream handler's buffer, where the finder's load controller sees them.
+"""
+from __future__ import print_function
+
+import asyncio
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from . import enrichment, hitmanager, twitterhandler
+from .anagramstats import StatTracker
+from .common import ANAGRAM_BATCH_SIZE
+
+BATCH_QUEUE_SIZE = 8
+HIT_QUEUE_SIZE = 1000
+STREAM_POLL_TIMEOUT = 1.0  # seconds; bounds how long shutdown waits on the stream
+STATS_INTERVAL = 1.0
+DIRECTS_INTERVAL = 5 * 60
+
+
+class AsyncRuntime(object):
+
+    """
+    runs a StreamHandler and an anagram finder under asyncio.
+    make_finder is called with a hit callback and should return an
+    AnagramFinder or ShardedAnagramFinder using it.
+    hits are saved to the hit database at dbpath.
+    """
+
+    def __init__(self, stream_handler, make_finder, dbpath,
+                 batch_size=ANAGRAM_BATCH_SIZE, poll_directs=True):
+        self.stream_handler = stream_handler
+        self.make_finder = make_finder
+        self.dbpath = dbpath
+        self.batch_size = batch_size
+        self.poll_directs = poll_directs
+        self.stats = StatTracker()
+        self.finder = None
+        self.hit_manager = None
+        self._found = []
+        # the stream, finder and hit database are each only ever used from
+        # their own thread.
+        self._stream_executor = ThreadPoolExecutor(1)
+        self._finder_executor = ThreadPoolExecutor(1)
+        self._db_executor = ThreadPoolExecutor(1)
+        self._io_executor = ThreadPoolExecutor(1)
+
+    def run(self):
+        """runs until interrupted or a task fails."""
+        return asyncio.run(self.main())
+
+    async def main(self):
+        self.batches = asyncio.Queue(BATCH_QUEUE_SIZE)
+        self.hits = asyncio.Queue(HIT_QUEUE_SIZE)
+
+        self.finder = await self._in(self._finder_executor, self.make_finder, self._found_hit)
+        self.hit_manager = await self._in(
+            self._db_executor, _make_hit_manager, self.dbpath)
+        self.finder.load.enrichment = self.hit_manager.enrichment
+        self.stream_handler.start()
+
+        tasks = [asyncio.ensure_future(self.consume_stream()),
+                 asyncio.ensure_future(self.find_anagrams()),
+                 asyncio.ensure_future(self.persist_hits()),
+                 asyncio.ensure_future(self.housekeeping())]
+        try:
+            # tasks only return by raising; the first failure stops everything
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._close()
+
+    async def _in(self, executor, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+    def _found_hit(self, first, second):
+        # called from the finder thread, while handle_batch runs.
+        # find_anagrams collects these once the batch is done.
+        self._found.append((first, second))
+
+    async def consume_stream(self):
+        while True:
+            batch = await self._in(self._stream_executor, self.stream_handler.get_batch,
+                                   self.batch_size, STREAM_POLL_TIMEOUT)
+            if batch:
+                await self.batches.put(batch)
+
+    async def find_anagrams(self):
+        while True:
+            batch = await self.batches.get()
+            await self._in(self._finder_executor, self.finder.handle_batch, batch)
+            if hasattr(self.stream_handler, 'ack'):
+                # an IngestClient can now forget this batch
+                self.stream_handler.ack()
+            await self._queue_found()
+
+    async def _queue_found(self):
+        found = list(self._found)
+        del self._found[:]
+        for pair in found:
+            await self.hits.put(pair)
+
+    async def persist_hits(self):
+        while True:
+            first, second = await self.hits.get()
+            await self._in(self._db_executor, self.hit_manager.new_hit, first, second)
+
+    async def housekeeping(self):
+        last_directs = time.time()
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            self.stats['hit_queue'] = self.hits.qsize()
+            self.stats.print_stats()
+            if self.poll_directs and time.time() - last_directs > DIRECTS_INTERVAL:
+                last_directs = time.time()
+                try:
+                    await self._in(self._io_executor, _handle_directs)
+                except Exception as err:
+                    logging.error('failed to handle directs: %s' % err)
+
+    async def _close(self):
+        # get_batch may still be running in the stream executor; closing
+        # there waits for it, instead of closing the stream underneath it
+        await self._in(self._stream_executor, self.stream_handler.close)
+        if self.finder is not None:
+            await self._in(self._finder_executor, self.finder.close)
+        # a sharded finder can deliver hits as it closes
+        for first, second in list(_drain(self.hits)) + self._found:
+            await self._in(self._db_executor, self.hit_manager.new_hit, first, second)
+        await self._in(self._db_executor, self.hit_manager.close)
+        for executor in (self._stream_executor, self._finder_executor,
+                         self._db_executor, self._io_executor):
+            executor.shutdown(wait=False)
+
+
+def _drain(queue):
+    while not queue.empty():
+        yield queue.get_nowait()
+
+
+def _make_hit_manager(dbpath):
+    return hitmanager.HitDBManager(dbpath, enrichment_workers=enrichment.ENRICHMENT_WORKERS)
+
+
+def _handle_directs():
+    twitterhandler.TwitterHandler().handle_directs()
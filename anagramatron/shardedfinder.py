@@ -0,0 +1,401 @@
+# coding: utf-8
+
+from __future__ import print_function
+import json
+import multiprocessing
+import os
+import pickle
+import queue as Queue
+import shutil
+import time
+import zlib
+
+from . import anagramfinder, anagramfunctions, coldstore, common, loadcontrol, multidbm
+from .anagramstats import StatTracker
+from .languages import get_language
+
+SHARD_INFO_FILE = 'shards.json'
+RESHARD_SUFFIX = '.resharding'
+MAX_BATCHES_IN_FLIGHT = 4  # per shard
+WORKER_POLL_INTERVAL = 1.0  # seconds between checks that shards are alive
+_WORKER_STATS = ('cache_size', 'cache_hits', 'possible_hits', 'cache_trims', 'shed',
+                 'cache_capacity')
+_SHARD_STATS = _WORKER_STATS + ('lookup_latency',)
+
+
+def shard_for_key(key, shard_count):
+    """
+    returns the index of the shard responsible for an anagram key.
+    anagrams share a key, so a pair of anagrams always meet in one shard.
+    """
+    return zlib.crc32(key.encode('utf-8')) % shard_count
+
+
+def shard_paths(base_path, index, shard_count, suffix=''):
+    """returns the (store, cache) paths used by a shard."""
+    shard_dir = os.path.join(base_path, 'shard%02d-of-%02d%s' % (index, shard_count, suffix))
+    return os.path.join(shard_dir, 'store'), os.path.join(shard_dir, 'cache.p')
+
+
+class ShardedAnagramFinder(object):
+
+    """
+    ShardedAnagramFinder splits the key space across a number of worker
+    processes, each running its own AnagramFinder with its own cache and
+    MultiDBM store. Inputs are routed to workers by key, and hits are sent
+    back and passed to hit_callback in this process.
+
+    It can be used in place of an AnagramFinder. If the number of shards
+    changes between runs, stored candidates are redistributed at startup.
+    Load is controlled here, where the stream's backlog is known, and
+    every shard is told of changes in load level.
+    """
+
+    def __init__(self, shard_count=None,
+                 storage='mdbm',
+                 path=None,
+                 hit_callback=print,
+                 test_func=anagramfunctions.test_anagram,
+                 cache_budget=common.ANAGRAM_CACHE_BUDGET):
+        self.shard_count = shard_count or multiprocessing.cpu_count()
+        self.store_path = path or os.path.join(
+            common.ANAGRAM_DATA_DIR,
+            '%s_en_sharded.db' % anagramfinder.DATA_PATH_COMPONENT)
+        self.hit_callback = hit_callback
+        self.stats = StatTracker()
+        if storage:
+            prepare_shards(self.store_path, self.shard_count)
+
+        self._start_workers(_run_shard, [
+            (i, self.shard_count, self.store_path, storage, test_func,
+             cache_budget and cache_budget // self.shard_count)
+            for i in range(self.shard_count)])
+        print('started %i finder shards' % self.shard_count)
+        self.load = loadcontrol.LoadController(self)
+
+    def _start_workers(self, target, worker_args):
+        """
+        starts a process running target for each tuple of args; each is
+        called with those args, then its inbox and our results queue.
+        """
+        self._seq = 0
+        self._in_flight = [0] * len(worker_args)
+        self._shard_stats = [dict() for _ in worker_args]
+        self._results = multiprocessing.Queue()
+        self._inboxes = []
+        self._workers = []
+        for args in worker_args:
+            inbox = multiprocessing.Queue()
+            worker = multiprocessing.Process(target=target,
+                                             args=args + (inbox, self._results))
+            worker.daemon = True
+            worker.start()
+            self._inboxes.append(inbox)
+            self._workers.append(worker)
+
+    def handle_input(self, inp, text_key="text"):
+        self.handle_batch([inp], text_key)
+
+    def handle_batch(self, inputs, text_key="text"):
+        """
+        routes each input to the shard that owns its key.
+        hits are delivered as shards report back, which may be during a
+        later call; close() waits for all outstanding work.
+        """
+        start = time.time()
+        routed = [[] for _ in range(self.shard_count)]
+        for inp in inputs:
+            self._seq += 1
+            shard = self._shard_for(inp, text_key)
+            if shard is None:
+                self.stats['unrouted'] += 1
+                continue
+            routed[shard].append((self._seq, inp))
+
+        for shard, items in enumerate(routed):
+            if not items:
+                continue
+            while self._in_flight[shard] >= MAX_BATCHES_IN_FLIGHT:
+                self._collect(block=True)
+            self._inboxes[shard].put(('batch', text_key, items))
+            self._in_flight[shard] += 1
+        self._collect(block=False)
+        # we only wait on shards that are behind, so this tracks the slowest
+        self.load.observe(len(inputs), time.time() - start)
+
+    def _shard_for(self, inp, text_key):
+        """the index of the worker that handles inp, or None to drop it."""
+        return shard_for_key(self._key_for(inp, text_key), self.shard_count)
+
+    def _key_for(self, inp, text_key):
+        if isinstance(inp, dict) and inp.get('anagram_hash'):
+            return inp['anagram_hash']
+        return anagramfunctions.improved_hash(inp if isinstance(inp, str) else inp[text_key])
+
+    def _collect(self, block):
+        """
+        handles messages from shards. if block, waits for at least one,
+        raising RuntimeError if a shard dies while we wait.
+        """
+        while True:
+            try:
+                message = self._results.get(block, WORKER_POLL_INTERVAL)
+            except Queue.Empty:
+                if not block:
+                    return
+                self._check_workers()
+                continue
+            block = False
+            kind, shard = message[0], message[1]
+            if kind == 'done':
+                hits, shard_stats = message[2], message[3]
+                self._in_flight[shard] -= 1
+                for seq, inp, match in hits:
+                    self.hit_callback(inp, match)
+                self._shard_stats[shard] = shard_stats
+                for key in _WORKER_STATS:
+                    self.stats[key] = sum(s.get(key, 0) for s in self._shard_stats)
+                self.stats['lookup_latency'] = max(
+                    s.get('lookup_latency', 0) for s in self._shard_stats)
+            elif kind == 'error':
+                self._in_flight[shard] -= 1
+                print('finder shard %i failed: %s' % (shard, message[2]))
+                for seq, inp, match in message[3]:
+                    self.hit_callback(inp, match)
+
+    def _check_workers(self):
+        for shard, worker in enumerate(self._workers):
+            if not worker.is_alive():
+                raise RuntimeError('finder shard %i exited with code %s' %
+                                   (shard, worker.exitcode))
+
+    def apply_load_level(self, level):
+        for inbox in self._inboxes:
+            inbox.put(('load', level))
+
+    def perform_maintenance(self):
+        """asks every shard to archive its oldest chunk in the background."""
+        for inbox in self._inboxes:
+            inbox.put(('maintenance',))
+
+    def close(self):
+        try:
+            while any(self._in_flight):
+                self._collect(block=True)
+        finally:
+            for inbox, worker in zip(self._inboxes, self._workers):
+                if worker.is_alive():
+                    inbox.put(('close',))
+            for worker in self._workers:
+                worker.join()
+        print('closed %i finder shards' % self.shard_count)
+
+
+class LanguageFinder(ShardedAnagramFinder):
+
+    """
+    LanguageFinder runs a finder process for each of a number of languages,
+    each with its own cache and store, at the paths an AnagramFinder for
+    that language uses by default. Inputs are routed by their 'lang' key;
+    inputs without one are in the default language, and inputs in any
+    other language are dropped.
+
+    Languages don't share keys, so adding one takes a core of its own
+    rather than time from the others.
+    """
+
+    def __init__(self, languages,
+                 storage='mdbm',
+                 hit_callback=print,
+                 test_func=anagramfunctions.test_anagram,
+                 cache_budget=common.ANAGRAM_CACHE_BUDGET):
+        self.languages = [get_language(code).code for code in languages]
+        self.shard_count = len(self.languages)
+        self.hit_callback = hit_callback
+        self.stats = StatTracker()
+        self._start_workers(_run_language, [
+            (i, code, storage, test_func, cache_budget and cache_budget // self.shard_count)
+            for i, code in enumerate(self.languages)])
+        print('started finders for %s' % ', '.join(self.languages))
+        self.load = loadcontrol.LoadController(self)
+
+    def _shard_for(self, inp, text_key):
+        code = common.ANAGRAM_DEFAULT_LANGUAGE
+        if isinstance(inp, dict):
+            code = inp.get('lang') or code
+        try:
+            return self.languages.index(code)
+        except ValueError:
+            return None
+
+
+def _run_shard(index, shard_count, base_path, storage, test_func, cache_budget,
+               inbox, results):
+    """runs a single shard's AnagramFinder. runs in its own process."""
+    store_path, cache_path = shard_paths(base_path, index, shard_count)
+    if storage and not os.path.exists(os.path.dirname(store_path)):
+        os.makedirs(os.path.dirname(store_path))
+    hits = []
+    finder = anagramfinder.AnagramFinder(
+        storage=storage, path=store_path, cachepath=cache_path,
+        hit_callback=lambda inp, match: hits.append((inp, match)),
+        test_func=test_func, load_control=False, cache_budget=cache_budget)
+    _serve(index, finder, hits, inbox, results)
+
+
+def _run_language(index, language, storage, test_func, cache_budget, inbox, results):
+    """runs the AnagramFinder for one language. runs in its own process."""
+    hits = []
+    finder = anagramfinder.AnagramFinder(
+        languages=[language], storage=storage,
+        hit_callback=lambda inp, match: hits.append((inp, match)),
+        test_func=test_func, load_control=False, cache_budget=cache_budget)
+    _serve(index, finder, hits, inbox, results)
+
+
+def _serve(index, finder, hits, inbox, results):
+    """
+    handles messages from a ShardedAnagramFinder until told to close.
+    finder's hit_callback should append (inp, match) to hits.
+    """
+    while True:
+        message = inbox.get()
+        if message[0] == 'batch':
+            text_key, items = message[1], message[2]
+            seqs = dict()
+            for seq, inp in items:
+                seqs.setdefault(id(inp), []).append(seq)
+            try:
+                finder.handle_batch([inp for seq, inp in items], text_key)
+            except Exception as err:
+                # hits made before the failure have left the store: send them too
+                results.put(('error', index, repr(err), _found(hits, seqs)))
+                continue
+            results.put(('done', index, _found(hits, seqs),
+                         dict((key, finder.stats[key]) for key in _SHARD_STATS)))
+        elif message[0] == 'load':
+            finder.apply_load_level(message[1])
+        elif message[0] == 'maintenance':
+            finder.perform_maintenance()
+        elif message[0] == 'close':
+            finder.close()
+            break
+
+
+def _found(hits, seqs):
+    """empties hits, returning them as (seq, inp, match) in input order."""
+    found = [(seqs[id(inp)].pop(0), inp, match) for inp, match in hits]
+    del hits[:]
+    return sorted(found, key=lambda h: h[0])
+
+
+def _reshard_cold(store_path, hot, stores):
+    """
+    splits the cold chunks of the store at store_path between stores,
+    one new chunk per old chunk and store. keys that hot, a reader of the
+    store's hot chunks, or a newer cold chunk holds are left behind, as
+    lookups never reached them. returns the number of keys moved.
+    """
+    gens = multidbm.load_manifest(store_path)['generations']
+    by_name = dict((gen['name'], gen) for gen in gens)
+    cold = coldstore.ColdStore(os.path.join(store_path, 'archive'),
+                               names=[gen['name'] for gen in gens if gen['tier'] == 'cold'])
+    moved = 0
+    try:
+        # newest first
+        for i, chunk in enumerate(cold.chunks):
+            buckets = [[] for _ in stores]
+            for k in chunk.iterkeys():
+                key = k.decode('utf-8')
+                if key in hot or any(k in newer for newer in cold.chunks[:i]):
+                    continue
+                buckets[shard_for_key(key, len(stores))].append(k)
+            for store, keys in zip(stores, buckets):
+                if keys:
+                    store.add_cold_chunk(chunk.name, ((k, chunk.get_raw(k)) for k in keys),
+                                         len(keys), like=by_name.get(chunk.name))
+                    moved += len(keys)
+    finally:
+        cold.close()
+    return moved
+
+
+def prepare_shards(base_path, shard_count):
+    """
+    makes sure the stores at base_path are split into shard_count shards,
+    resharding them if they were last used with a different count.
+    """
+    info_path = os.path.join(base_path, SHARD_INFO_FILE)
+    if os.path.exists(info_path):
+        with open(info_path) as f:
+            old_count = json.load(f)['shard_count']
+        if old_count != shard_count:
+            reshard(base_path, old_count, shard_count)
+    elif not os.path.exists(base_path):
+        os.makedirs(base_path)
+    _save_shard_count(base_path, shard_count)
+
+
+def _save_shard_count(base_path, shard_count):
+    info_path = os.path.join(base_path, SHARD_INFO_FILE)
+    with open(info_path + '.tmp', 'w') as f:
+        json.dump({'shard_count': shard_count}, f)
+    os.replace(info_path + '.tmp', info_path)
+
+
+def reshard(base_path, old_count, new_count):
+    """
+    moves every stored candidate from old_count shards to new_count shards,
+    including archived ones and saved caches. hot keys are copied to hot
+    chunks, and cold chunks are split into cold chunks, still compressed.
+    only the newest copy of a key is moved. must not run while the shards
+    are in use.
+
+    new shards are built beside the old ones and moved into place once
+    complete, and the new count is saved before the old shards are
+    removed; if this is interrupted, running it again starts over.
+    """
+    print('resharding %s from %i to %i shards' % (base_path, old_count, new_count))
+    stores = []
+    for i in range(new_count):
+        # left by an earlier, interrupted run
+        for suffix in (RESHARD_SUFFIX, ''):
+            shard_dir = os.path.dirname(shard_paths(base_path, i, new_count, suffix)[0])
+            if os.path.exists(shard_dir):
+                shutil.rmtree(shard_dir)
+        store_path, cache_path = shard_paths(base_path, i, new_count, RESHARD_SUFFIX)
+        os.makedirs(os.path.dirname(store_path))
+        stores.append(multidbm.MultiDBM(store_path))
+    caches = [[] for _ in range(new_count)]
+
+    moved = 0
+    for i in range(old_count):
+        store_path, cache_path = shard_paths(base_path, i, old_count)
+        if os.path.exists(store_path):
+            reader = multidbm.MultiDBMReader(store_path, include_cold=False)
+            for key, value in reader.iteritems():
+                stores[shard_for_key(key, new_count)][key] = value
+                moved += 1
+            moved += _reshard_cold(store_path, reader, stores)
+            reader.close()
+        if os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                for tweet in pickle.load(f):
+                    key = (tweet.get('anagram_hash') or anagramfunctions.improved_hash(
+                        tweet.get('text') or tweet.get('tweet_text')))
+                    caches[shard_for_key(key, new_count)].append(tweet)
+
+    for i, store in enumerate(stores):
+        store.close()
+        store_path, cache_path = shard_paths(base_path, i, new_count, RESHARD_SUFFIX)
+        with open(cache_path, 'wb') as f:
+            pickle.dump(caches[i], f)
+    for i in range(new_count):
+        os.rename(os.path.dirname(shard_paths(base_path, i, new_count, RESHARD_SUFFIX)[0]),
+                  os.path.dirname(shard_paths(base_path, i, new_count)[0]))
+    _save_shard_count(base_path, new_count)
+    for i in range(old_count):
+        old_dir = os.path.dirname(shard_paths(base_path, i, old_count)[0])
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+    print('moved %i stored candidates' % moved)
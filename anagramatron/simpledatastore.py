@@ -5,6 +5,7 @@ from __future__ import unicode_literals
 from operator import itemgetter
 import pickle
 import logging
+import sys
 
 ITEM_KEY = 'tweet'
 COUNT_KEY = 'hit_count'
@@ -46,7 +47,9 @@ class AnagramSimpleStore(object):
         try:
             loaded = pickle.load(open(self.path, 'rb'))
             for t in loaded:
-                cache[t['anagram_hash']] = {'tweet': t, 'hit_count': 0}
+                # tweets sharing a hash are kept together, oldest first
+                entry = cache.setdefault(t['anagram_hash'], {'tweet': [], 'hit_count': 0})
+                entry['tweet'].append(t)
             print('loaded %i items to cache' % len(cache))
             return cache
         except IOError:
@@ -60,13 +63,33 @@ class AnagramSimpleStore(object):
         items in cache indefinitely
         """
         if self.path:
-            to_save = [self.datastore[t]['tweet'] for t in self.datastore]
+            to_save = []
+            for t in self.datastore:
+                item = self.datastore[t]['tweet']
+                to_save.extend(item if isinstance(item, list) else [item])
             try:
                 pickle.dump(to_save, open(self.path, 'wb'))
                 print('saved cache to disk with %i items' % len(to_save))
             except:
                 logging.error('unable to save cache')
 
+    def entry_size(self, key):
+        """
+        estimates the bytes of memory used by the entry for key,
+        including its share of our dict. keys of stored dicts are
+        usually shared between tweets, and aren't counted.
+        """
+        entry = self.datastore[key]
+        value = entry[ITEM_KEY]
+        size = sys.getsizeof(key) + sys.getsizeof(entry) + sys.getsizeof(entry[COUNT_KEY])
+        for item in (value if isinstance(value, list) else [value]):
+            size += sys.getsizeof(item)
+            if isinstance(item, dict):
+                size += sum(sys.getsizeof(v) for v in item.values())
+        if isinstance(value, list):
+            size += sys.getsizeof(value)
+        return size + sys.getsizeof(self.datastore) / float(len(self.datastore))
+
     def least_used(self, count):
         items = [(key, value[ITEM_KEY], value[COUNT_KEY])
                  for key, value in self.datastore.items()]
@@ -0,0 +1,154 @@
+# coding: utf-8
+from __future__ import print_function
+
+import json
+import logging
+import os
+import re
+
+from collections import deque
+
+SEGMENT_SIZE = 10000  # items per file on disk
+_SEGMENT_RE = re.compile(r'^seg(-?\d+)\.jsonl$')
+
+
+class SpillQueue(object):
+
+    """
+    a FIFO queue that keeps at most memory_limit items in memory.
+    once memory is full, new items are appended to files in path;
+    as the queue drains, they are read back, oldest first.
+    items must be json-serializable.
+
+    close() writes everything still in memory to disk, and a new
+    SpillQueue on the same path picks up where the old one left off.
+    if we crash instead, items that were only in memory are lost, and
+    items read back from disk but not yet taken may be returned again.
+    """
+
+    def __init__(self, path, memory_limit, segment_size=SEGMENT_SIZE):
+        self.path = path
+        self.memory_limit = memory_limit
+        # a segment is read back into memory whole
+        self.segment_size = max(1, min(segment_size, memory_limit))
+        self._memory = deque()
+        self._segments = []  # segment numbers on disk, oldest first
+        self._counts = dict()  # segment number: item count
+        self._loaded = None  # segment whose items are now in memory
+        self._writer = None
+        self._spilled = 0
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._scan()
+
+    def __len__(self):
+        return len(self._memory) + self._spilled
+
+    def __bool__(self):
+        return len(self) > 0
+
+    __nonzero__ = __bool__
+
+    def memory_size(self):
+        return len(self._memory)
+
+    def disk_size(self):
+        return self._spilled
+
+    def append(self, item):
+        if not self._segments and len(self._memory) < self.memory_limit:
+            self._memory.append(item)
+        else:
+            self._spill(item)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def popleft(self):
+        """removes and returns the oldest item. raises IndexError if empty."""
+        while not self._memory and (self._segments or self._loaded is not None):
+            self._refill()
+        item = self._memory.popleft()
+        if not self._memory:
+            self._finish_loaded()
+        return item
+
+    def flush(self):
+        if self._writer is not None:
+            self._writer.flush()
+
+    def close(self):
+        """writes items in memory to disk, so they survive a restart."""
+        self._close_writer()
+        if self._memory:
+            # these are older than anything on disk
+            seg = self._segments[0] - 1 if self._segments else 0
+            with open(self._segment_path(seg), 'w') as f:
+                for item in self._memory:
+                    f.write(json.dumps(item) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            logging.debug('spill queue saved %i items from memory' % len(self._memory))
+            self._memory.clear()
+        self._finish_loaded()
+
+    def _segment_path(self, seg):
+        return os.path.join(self.path, 'seg%d.jsonl' % seg)
+
+    def _scan(self):
+        for name in os.listdir(self.path):
+            match = _SEGMENT_RE.match(name)
+            if match:
+                self._segments.append(int(match.group(1)))
+        self._segments.sort()
+        for seg in self._segments:
+            with open(self._segment_path(seg)) as f:
+                self._counts[seg] = sum(1 for line in f if line.endswith('\n'))
+        self._spilled = sum(self._counts.values())
+        if self._spilled:
+            print('spill queue found %i items on disk' % self._spilled)
+
+    def _spill(self, item):
+        if self._writer is None or self._counts[self._segments[-1]] >= self.segment_size:
+            self._close_writer()
+            seg = self._segments[-1] + 1 if self._segments else 0
+            self._segments.append(seg)
+            self._counts[seg] = 0
+            self._writer = open(self._segment_path(seg), 'a')
+        self._writer.write(json.dumps(item) + '\n')
+        self._counts[self._segments[-1]] += 1
+        self._spilled += 1
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _finish_loaded(self):
+        """deletes the segment we read into memory, now that it's been taken."""
+        if self._loaded is not None:
+            os.remove(self._segment_path(self._loaded))
+            self._segments.remove(self._loaded)
+            del self._counts[self._loaded]
+            self._loaded = None
+
+    def _refill(self):
+        self._finish_loaded()
+        if not self._segments:
+            return
+        seg = self._segments[0]
+        if len(self._segments) == 1:
+            # can't read the segment we're writing to; start a new one
+            self._close_writer()
+        with open(self._segment_path(seg)) as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    # partly written when we last crashed
+                    break
+                try:
+                    self._memory.append(json.loads(line))
+                except ValueError:
+                    logging.error('skipping unreadable line in %s' % self._segment_path(seg))
+        self._spilled -= self._counts[seg]
+        self._loaded = seg
@@ -4,7 +4,7 @@
 '''A simple tool for profiling over stdin'''
 import sys
 import tempfile
-from . import anagramfinder
+from . import anagramfinder, anagramfunctions, multidbm
 
 
 class Stats(object):
@@ -17,7 +17,34 @@ class Stats(object):
         self.hits.append(tuple(args))
 
 
+def lookup(store_path):
+    """
+    looks up each line of stdin in an existing store, without modifying it.
+    safe to run while the store is in use.
+    """
+    reader = multidbm.MultiDBMReader(store_path)
+    seen = found = 0
+    for line in sys.stdin:
+        seen += 1
+        key = anagramfunctions.improved_hash(line)
+        match = reader.get(key)
+        if match is not None:
+            found += 1
+            for candidate in anagramfunctions.decode_candidates(match, key):
+                print("---------\n{}--↕︎--\n{}".format(line, candidate))
+    reader.close()
+    print("seen {}, found {}".format(seen, found))
+
+
 def main():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-l', '--lookup', type=str, metavar='STORE',
+                        help='look up lines in an existing store instead')
+    args = parser.parse_args()
+    if args.lookup:
+        return lookup(args.lookup)
+
     stats = Stats()
     tempdir = tempfile.TemporaryDirectory()
     print("storing in temp dir %s" % tempdir, file=sys.stderr)
@@ -1,20 +1,21 @@
 from __future__ import print_function
 
 import logging
+import os
 import queue as Queue
 import multiprocessing
 import time
 
-from collections import deque
 
-
-from . import anagramfunctions, twitterhandler
+from . import anagramfunctions, twitterhandler, spillqueue, loadcontrol
 from .anagramstats import StatTracker
+from .languages import get_language
 from zmqstream.consumer import zmq_iter
 
-from .common import (ANAGRAM_STREAM_BUFFER_SIZE)
+from .common import (ANAGRAM_STREAM_BUFFER_SIZE, ANAGRAM_BATCH_SIZE, ANAGRAM_DATA_DIR,
+                     ANAGRAM_INTEREST_FLOOR_MAX)
 
-SECONDS_SINCE_LAUNCH_TO_IGNORE_BUFFER = 60 * 60 * 2
+SPILL_DIRECTORY = 'stream_buffer'
 
 
 class StreamHandler(object):
@@ -22,6 +23,11 @@ class StreamHandler(object):
     """
     handles twitter stream connections. Buffers incoming tweets and
     acts as an iter.
+    at most buffersize tweets are buffered in memory; past that they
+    are spilled to disk at spill_path. the buffer is saved when the
+    handler is closed, and picked up by the next one.
+    as the buffer grows, tweets with a low interest score are dropped
+    by the filter; max_interest_floor caps the score needed.
     """
 
     def __init__(self,
@@ -29,21 +35,29 @@ class StreamHandler(object):
                  timeout=90,
                  languages=['en'],
                  host="127.0.0.1",
-                 port="8069"
+                 port="8069",
+                 poll_directs=True,
+                 spill_path=None,
+                 max_interest_floor=ANAGRAM_INTEREST_FLOOR_MAX
                  ):
         self.buffersize = buffersize
         self.timeout = timeout
         self.languages = languages
         self.host = host
         self.port = port
+        self.poll_directs = poll_directs
+        self.max_interest_floor = max_interest_floor
         print(host, port)
         self.stream_process = None
         self.queue = multiprocessing.Queue()
-        self._buffer = deque()
+        self._buffer = spillqueue.SpillQueue(
+            spill_path or os.path.join(ANAGRAM_DATA_DIR, SPILL_DIRECTORY), buffersize)
         self._should_return = False
         self._iter = self.__iter__()
         self._tweets_seen = multiprocessing.Value('L', 0)
         self._passed_filter = multiprocessing.Value('L', 0)
+        self._shed = multiprocessing.Value('L', 0)
+        self._interest_floor = multiprocessing.Value('d', 0)
         self._lock = multiprocessing.Lock()
         self._start_time = time.time()
         self._last_message_check = self._start_time
@@ -57,7 +71,15 @@ class StreamHandler(object):
             if self._passed_filter.value:
                 self.stats['passed_filter'] += self._passed_filter.value
                 self._passed_filter.value = 0
+            if self._shed.value:
+                self.stats['filter_shed'] += self._shed.value
+                self._shed.value = 0
         self.stats['buffer'] = self.bufferlength()
+        self.stats['buffer_on_disk'] = self._buffer.disk_size()
+        floor = loadcontrol.interest_floor(
+            self.bufferlength(), self.buffersize, self.max_interest_floor)
+        self._interest_floor.value = floor
+        self.stats['interest_floor'] = round(floor, 2)
 
     def __iter__(self):
         """
@@ -69,27 +91,12 @@ class StreamHandler(object):
         while 1:
             if self._should_return:
                 print('breaking iteration')
-                raise StopIteration
-            while 1:
-                # add all new items from the queue to the buffer
-                try:
-                    self._buffer.append(self.queue.get_nowait())
-                except Queue.Empty:
-                    break
+                return
+            self._fill_buffer()
             try:
-                # after launch we don't have any keys in memory, so processing is slow.
-                # this checks if launch was recent, and resets the buffer if it
-                # was.
-                if len(self._buffer) > ANAGRAM_STREAM_BUFFER_SIZE * 0.9:
-                    if time.time() - self._start_time < SECONDS_SINCE_LAUNCH_TO_IGNORE_BUFFER:
-                        self._buffer = deque()
-                        logging.debug('recent launch, reset buffer')
-
                 self.update_stats()
-                # 5 minutes
-                if time.time() - self._last_message_check > (5 * 60):
-                    self._last_message_check = time.time()
-                    twitterhandler.TwitterHandler().handle_directs()
+                if self.poll_directs:
+                    self.check_directs()
 
                 if len(self._buffer):
                     # if there's a buffer element return it
@@ -101,9 +108,53 @@ class StreamHandler(object):
                 print('queue timeout')
         print('exiting iter loop')
 
+    def _fill_buffer(self):
+        """moves all new items from the queue to the buffer."""
+        while 1:
+            try:
+                self._buffer.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+
+    def check_directs(self):
+        """handles direct messages, at most every five minutes."""
+        if time.time() - self._last_message_check > (5 * 60):
+            self._last_message_check = time.time()
+            twitterhandler.TwitterHandler().handle_directs()
+
     def next(self):
         return self._iter.next()
 
+    def batches(self, size=ANAGRAM_BATCH_SIZE):
+        """
+        like iterating over the handler, but yields lists of up to
+        size tweets: whatever is waiting in the buffer, or a single tweet
+        if the buffer is empty.
+        """
+        for tweet in self:
+            batch = [tweet]
+            while self._buffer and len(batch) < size:
+                batch.append(self._buffer.popleft())
+            yield batch
+
+    def get_batch(self, size=ANAGRAM_BATCH_SIZE, timeout=None):
+        """
+        returns a list of up to size buffered tweets. if none are buffered,
+        waits up to timeout seconds for one, returning an empty list if
+        none arrives. unlike iterating, this never polls for directs.
+        """
+        self._fill_buffer()
+        self.update_stats()
+        if not self._buffer:
+            try:
+                self._buffer.append(self.queue.get(True, timeout or self.timeout))
+            except Queue.Empty:
+                return []
+        batch = []
+        while self._buffer and len(batch) < size:
+            batch.append(self._buffer.popleft())
+        return batch
+
     def start(self):
         """
         creates a new thread and starts a streaming connection.
@@ -127,6 +178,8 @@ class StreamHandler(object):
             args=(self.queue,
                   self._tweets_seen,
                   self._passed_filter,
+                  self._shed,
+                  self._interest_floor,
                   self._lock,
                   self.languages))
         self.stream_process.daemon = True
@@ -141,6 +194,12 @@ class StreamHandler(object):
         self._should_return = True
         if self.stream_process:
             self.stream_process.terminate()
+        try:
+            self._fill_buffer()
+        except Exception as err:
+            # the queue can be left broken by terminating its writer
+            logging.error('error emptying stream queue: %s' % err)
+        self._buffer.close()
         print("\nstream handler closed with buffer size %i" %
               (self.bufferlength()))
         logging.debug("stream handler closed with buffer size %i" %
@@ -149,14 +208,18 @@ class StreamHandler(object):
     def bufferlength(self):
         return len(self._buffer)
 
-    def _run(self, queue, seen, passed, lock, languages):
+    def _run(self, queue, seen, passed, shed, floor, lock, languages):
         """
         handle connection to streaming endpoint.
         adds incoming tweets to queue.
         runs in own process.
         errors is a queue we use to transmit exceptions to parent process.
+        tweets are filtered by the rules for their language, and tweets in
+        languages we aren't handling are dropped; candidates in languages
+        other than the default are tagged, so finders can be picked by language.
         """
 
+        filters = dict((code, get_language(code)) for code in languages)
         stream_iter = zmq_iter(host=self.host, port=self.port)
         logging.debug('stream begun')
         for tweet in stream_iter:
@@ -165,8 +228,15 @@ class StreamHandler(object):
             if tweet.get('text'):
                 with lock:
                     seen.value += 1
-                processed_tweet = anagramfunctions.filter_tweet(tweet)
-                if processed_tweet:
+                language = filters.get(tweet.get('lang'))
+                processed_tweet = language and anagramfunctions.filter_tweet(tweet, language)
+                if processed_tweet and floor.value and anagramfunctions.interest_score(
+                        *anagramfunctions.hash_letter_stats(
+                            processed_tweet['anagram_hash'])) < floor.value:
+                    # we're behind; save our effort for likelier tweets
+                    with lock:
+                        shed.value += 1
+                elif processed_tweet:
                     with lock:
                         passed.value += 1
                     try:
@@ -0,0 +1,285 @@
+# coding: utf-8
+"""
+finds candidates whose letters are all among a text's letters (hidden
+in it), or that use every one of a text's letters (containing it).
+
+candidates are grouped by which letters they use, as a 26 bit mask. a
+candidate can only be hidden in a text if its mask is a submask of the
+text's, so only the groups under (or over) the text's mask are checked,
+comparing letter counts within them. if there are fewer groups than
+masks to enumerate, we scan the groups instead.
+
+letter counts are read straight from anagram hashes, which list them
+in the same order for every key.
+"""
+from __future__ import print_function
+
+import logging
+import random
+import threading
+import time
+
+from . import anagramfunctions, multidbm, simpledatastore
+from .nearindex import hash_counts, hash_from_counts
+
+ALPHABET_SIZE = len(anagramfunctions.ENGLISH_LETTER_LIST)
+FULL_MASK = (1 << ALPHABET_SIZE) - 1
+MIN_LETTERS = 12  # shorter candidates are hidden in almost anything
+
+
+def letter_mask(counts):
+    """the bitmask of the letters with a count, most frequent letter lowest."""
+    mask = 0
+    for i, count in enumerate(counts):
+        if count:
+            mask |= 1 << i
+    return mask
+
+
+def _submasks(mask):
+    """yields every submask of mask, from mask itself down to 0."""
+    sub = mask
+    while True:
+        yield sub
+        if not sub:
+            return
+        sub = (sub - 1) & mask
+
+
+def _within(small, big):
+    """
+    True if each letter count in hash small is at most the one in big.
+    only valid if small's letters are a subset of big's: hash characters
+    order like counts, and neither hash has letters past the other's end.
+    """
+    return all(a <= b for a, b in zip(small, big))
+
+
+class SubsetIndex(object):
+
+    """
+    an index of anagram hashes by the letters they use. keys with fewer
+    than min_letters letters aren't indexed.
+    keys are removed with discard(); candidates() also drops keys that
+    are no longer in the cache or store.
+    """
+
+    def __init__(self, min_letters=MIN_LETTERS):
+        self.min_letters = min_letters
+        self._groups = dict()  # mask: set of hashes
+        self._count = 0
+        self._lock = threading.Lock()
+        self.masks_checked = 0
+        self.keys_checked = 0
+
+    def __len__(self):
+        return self._count
+
+    def group_count(self):
+        return len(self._groups)
+
+    def add(self, key):
+        counts = hash_counts(key)
+        if sum(counts) < self.min_letters:
+            return
+        mask = letter_mask(counts)
+        with self._lock:
+            group = self._groups.setdefault(mask, set())
+            if key not in group:
+                group.add(key)
+                self._count += 1
+
+    def discard(self, key):
+        mask = letter_mask(hash_counts(key))
+        with self._lock:
+            group = self._groups.get(mask)
+            if group and key in group:
+                group.remove(key)
+                self._count -= 1
+                if not group:
+                    del self._groups[mask]
+
+    def hidden_in(self, key):
+        """the indexed hashes made from some, but not all, of key's letters."""
+        mask = letter_mask(hash_counts(key))
+        with self._lock:
+            masks = self._masks_under(mask)
+            return self._checked(masks, lambda k: k != key and _within(k, key))
+
+    def containing(self, key):
+        """the indexed hashes using all of key's letters, and more."""
+        mask = letter_mask(hash_counts(key))
+        with self._lock:
+            masks = self._masks_over(mask)
+            return self._checked(masks, lambda k: k != key and _within(key, k))
+
+    def pairs(self, key):
+        """
+        pairs of indexed hashes whose letters, together, are exactly key's;
+        so their tweets could be combined into an anagram of key's.
+        """
+        counts = hash_counts(key)
+        found = []
+        for part in self.hidden_in(key):
+            rest = [a - b for a, b in zip(counts, hash_counts(part))]
+            other = hash_from_counts(rest)
+            with self._lock:
+                if part <= other and other in self._groups.get(letter_mask(rest), ()):
+                    found.append((part, other))
+        return found
+
+    def _masks_under(self, mask):
+        if 1 << bin(mask).count('1') <= len(self._groups):
+            return [m for m in _submasks(mask) if m in self._groups]
+        return [m for m in self._groups if not m & ~mask]
+
+    def _masks_over(self, mask):
+        free = FULL_MASK & ~mask
+        if 1 << bin(free).count('1') <= len(self._groups):
+            return [mask | m for m in _submasks(free) if mask | m in self._groups]
+        return [m for m in self._groups if m & mask == mask]
+
+    def _checked(self, masks, test):
+        found = []
+        for mask in masks:
+            group = self._groups[mask]
+            self.keys_checked += len(group)
+            found.extend(k for k in group if test(k))
+        self.masks_checked += len(masks)
+        return found
+
+    def candidates(self, keys, cache=None, store=None):
+        """
+        returns a dict of key: list of candidates, looking in cache and then
+        store, which needs get_many(). keys found in neither are discarded.
+        """
+        found = dict()
+        for key in keys:
+            if cache is not None and key in cache:
+                found[key] = list(cache[key])
+        missing = [k for k in keys if k not in found]
+        if store is not None and missing:
+            for key, value in store.get_many(missing).items():
+                found[key] = anagramfunctions.decode_candidates(value, key)
+        for key in missing:
+            if key not in found:
+                self.discard(key)
+        return found
+
+    def load_store(self, path, include_cold=True):
+        """adds every key in the mdbm store at path, read without locks."""
+        start = time.time()
+        reader = multidbm.MultiDBMReader(path, include_cold=include_cold)
+        try:
+            for key in reader.iterkeys():
+                self.add(key)
+        finally:
+            reader.close()
+        logging.info('subset index loaded %i keys in %0.1fs' % (len(self), time.time() - start))
+
+    def load_cache(self, cache):
+        """adds every key in an AnagramSimpleStore."""
+        for key in list(cache.datastore):
+            self.add(key)
+
+
+def random_hash(rng, letters, weights, length):
+    """the hash of a random text of length letters, drawn with weights."""
+    counts = [0] * ALPHABET_SIZE
+    for idx in rng.choices(range(len(letters)), weights, k=length):
+        counts[idx] += 1
+    return hash_from_counts(counts)
+
+
+def benchmark(count=1000000, queries=200, seed=1):
+    """
+    builds an index of count random candidates and times queries against it.
+    letters are drawn with weights falling off by frequency rank, which is
+    crude, but gives masks spread roughly as tweets' are.
+    """
+    rng = random.Random(seed)
+    letters = anagramfunctions.ENGLISH_LETTER_LIST
+    weights = [1.0 / (rank + 1) for rank in range(len(letters))]
+    index = SubsetIndex()
+    start = time.time()
+    for _ in range(count):
+        index.add(random_hash(rng, letters, weights, rng.randint(16, 100)))
+    print('indexed %i candidates in %i groups in %0.1fs' %
+          (len(index), index.group_count(), time.time() - start))
+
+    for name, lengths, query in (('hidden_in', (80, 140), index.hidden_in),
+                                 ('containing', (16, 30), index.containing)):
+        timings = []
+        results = 0
+        index.masks_checked = index.keys_checked = 0
+        for _ in range(queries):
+            key = random_hash(rng, letters, weights, rng.randint(*lengths))
+            query_start = time.time()
+            results += len(query(key))
+            timings.append(time.time() - query_start)
+        timings.sort()
+        print('%s: median %0.1fms, p95 %0.1fms, max %0.1fms; %0.1f results, '
+              '%i groups and %i keys checked per query' % (
+                  name, timings[len(timings) // 2] * 1000,
+                  timings[int(len(timings) * 0.95)] * 1000, timings[-1] * 1000,
+                  results / float(queries), index.masks_checked // queries,
+                  index.keys_checked // queries))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="finds stored tweets hidden in, or containing, a text")
+    parser.add_argument('text', type=str, nargs='?', help="text to look up")
+    parser.add_argument('--db', type=str, help="mdbm store to search")
+    parser.add_argument('--cache', type=str, help="cache file to search")
+    parser.add_argument('--containing', action="store_true",
+                        help="find tweets using all of text's letters, rather than hidden in it")
+    parser.add_argument('--pairs', action="store_true",
+                        help="find pairs of tweets that together use exactly text's letters")
+    parser.add_argument('--limit', type=int, default=20, help="max results to print")
+    parser.add_argument('--bench', type=int, metavar='COUNT',
+                        help="time queries against COUNT random candidates")
+    args = parser.parse_args()
+
+    if args.bench:
+        benchmark(args.bench)
+        return
+    if not args.text:
+        parser.error('text is required unless benchmarking')
+
+    index = SubsetIndex()
+    cache = store = None
+    if args.cache:
+        cache = simpledatastore.AnagramSimpleStore(args.cache)
+        index.load_cache(cache)
+    if args.db:
+        store = multidbm.MultiDBMReader(args.db)
+        index.load_store(args.db)
+    print('indexed %i keys' % len(index))
+
+    key = anagramfunctions.improved_hash(args.text)
+    if args.pairs:
+        pairs = index.pairs(key)[:args.limit]
+        found = index.candidates(set(k for pair in pairs for k in pair), cache, store)
+        for one, two in pairs:
+            if one in found and two in found:
+                print('%s + %s' % (_text(found[one][0]), _text(found[two][0])))
+    else:
+        keys = index.containing(key) if args.containing else index.hidden_in(key)
+        found = index.candidates(keys[:args.limit], cache, store)
+        for key in found:
+            for candidate in found[key]:
+                print(_text(candidate))
+    if store is not None:
+        store.close()
+
+
+def _text(candidate):
+    if isinstance(candidate, dict):
+        return candidate.get('tweet_text') or candidate.get('text')
+    return candidate
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+# coding: utf-8
+"""
+makes a synthetic tweet stream, for load testing at rates our recordings
+can't reach. tweets look like the stream's: they have lang, entities,
+id_str and text, and a known share of them are retweets, mentions, links,
+other languages, duplicates, near identical spam and exact anagrams of
+earlier tweets. the generator counts what it made, so the hits a run
+should find are known.
+
+    python -m anagramatron.synthetic publish --rate 5000 --anagram 0.01
+    python -m anagramatron --port 8070
+    python -m anagramatron.synthetic bench --count 200000
+"""
+from __future__ import print_function
+
+import json
+import random
+import string
+import sys
+import time
+
+from collections import deque
+
+from . import anagramfunctions, replay
+from .common import ANAGRAM_BATCH_SIZE
+
+# the share of tweets of each kind; the rest are ordinary tweets
+DEFAULT_RATES = {
+    'retweet': 0.3,
+    'mention': 0.2,
+    'url': 0.1,
+    'other_lang': 0.1,
+    'duplicate': 0.02,
+    'spam': 0.02,
+    'anagram': 0.001,
+}
+FIRST_TWEET_ID = 500000000000000000
+RECENT_TEXTS = 1000  # earlier tweets duplicates, spam and anagrams are made from
+MAX_COPIES = 2  # duplicates and spam of one tweet, so it's never evicted by its copies
+ANAGRAM_TRIES = 20
+OTHER_LANGUAGES = ('es', 'fr', 'pt', 'ja', 'und')
+REPORT_INTERVAL = 10  # seconds
+
+WORDS = """
+the be to of and a in that have it for not on with he as you do at this
+but his by from they we say her she or an will my one all would there
+their what so up out if about who get which go me when make can like time
+no just him know take people into year your good some could them see other
+than then now look only come its over think also back after use how our
+work first well way even new want because any these give day most us
+great little world still very school never last long today night morning
+weekend coffee phone music movie friend friends love hate happy tired
+really always nothing something everything somebody tonight tomorrow
+game team season summer winter rain snow sleep dinner lunch breakfast
+pizza class homework teacher mom dad sister brother house car road city
+birthday party dance song album video watch played playing watching
+waiting thinking feeling looking trying going getting making better best
+worst funny crazy pretty beautiful weird perfect honestly literally
+""".split()
+
+
+class TweetGenerator(object):
+
+    """
+    makes tweet dicts. rates maps kinds of tweet, from DEFAULT_RATES, to
+    the share of tweets of that kind. counts has how many of each kind
+    have been made; each anagram should make exactly one hit.
+    """
+
+    def __init__(self, rates=None, seed=None, first_id=FIRST_TWEET_ID):
+        self.rates = dict(DEFAULT_RATES)
+        for kind, rate in (rates or {}).items():
+            if kind not in DEFAULT_RATES:
+                raise ValueError('no kind of tweet named %r' % kind)
+            self.rates[kind] = rate
+        if sum(self.rates.values()) > 1:
+            raise ValueError('rates add up to more than 1: %r' % self.rates)
+        self.random = random.Random(seed)
+        self.counts = dict((kind, 0) for kind in list(DEFAULT_RATES) + ['original'])
+        self._next_id = first_id
+        self._kinds = sorted(self.rates.items())
+        self._recent = deque(maxlen=RECENT_TEXTS)  # [text, copies]
+
+    def __iter__(self):
+        while True:
+            yield self.tweet()
+
+    def tweet(self):
+        """returns the next tweet."""
+        kind = self._pick_kind()
+        tweet = getattr(self, '_make_%s' % kind)() if kind != 'original' else None
+        if tweet is None:
+            kind, tweet = 'original', self._make_original()
+        self.counts[kind] += 1
+        return tweet
+
+    def expected_hits(self):
+        return self.counts['anagram']
+
+    def expected_passing(self):
+        """the number of tweets made that filter_tweet lets through."""
+        return sum(self.counts[k] for k in ('original', 'duplicate', 'spam', 'anagram'))
+
+    def _pick_kind(self):
+        roll = self.random.random()
+        for kind, rate in self._kinds:
+            if roll < rate:
+                return kind
+            roll -= rate
+        return 'original'
+
+    def _tweet(self, text, lang='en'):
+        self._next_id += self.random.randint(1, 1000)
+        return {'id_str': str(self._next_id),
+                'text': text,
+                'lang': lang,
+                'created_at': time.strftime('%a %b %d %H:%M:%S +0000 %Y', time.gmtime()),
+                'user': {'screen_name': self._screen_name()},
+                'entities': {'hashtags': [], 'user_mentions': [], 'urls': []}}
+
+    def _text(self):
+        """a text that passes filter_tweet."""
+        while True:
+            target = self.random.randint(20, 70)
+            words = []
+            while sum(len(w) for w in words) < target:
+                words.append(self.random.choice(WORDS))
+            text = ' '.join(words).capitalize() + self.random.choice(('', '', '.', '!', '?'))
+            if anagramfunctions.filter_tweet(self._tweet(text)):
+                return text
+
+    def _screen_name(self):
+        return ''.join(self.random.choice(string.ascii_lowercase + string.digits + '_')
+                       for i in range(self.random.randint(4, 12)))
+
+    def _make_original(self):
+        text = self._text()
+        self._recent.append([text, 0])
+        return self._tweet(text)
+
+    def _make_retweet(self):
+        original = self._tweet(self._text())
+        tweet = self._tweet('RT @%s: %s' % (original['user']['screen_name'], original['text']))
+        tweet['retweeted_status'] = original
+        return tweet
+
+    def _make_mention(self):
+        name = self._screen_name()
+        tweet = self._tweet('@%s %s' % (name, self._text()))
+        tweet['entities']['user_mentions'].append(
+            {'screen_name': name, 'indices': [0, len(name) + 1]})
+        return tweet
+
+    def _make_url(self):
+        text = self._text()
+        url = 'https://t.co/' + ''.join(self.random.choice(string.ascii_letters + string.digits)
+                                        for i in range(10))
+        tweet = self._tweet('%s %s' % (text, url))
+        tweet['entities']['urls'].append(
+            {'url': url, 'expanded_url': url, 'indices': [len(text) + 1, len(text) + 1 + len(url)]})
+        return tweet
+
+    def _make_other_lang(self):
+        return self._tweet(self._text(), lang=self.random.choice(OTHER_LANGUAGES))
+
+    def _copyable(self):
+        if not self._recent:
+            return None
+        entry = self.random.choice(self._recent)
+        if entry[1] >= MAX_COPIES:
+            return None
+        entry[1] += 1
+        return entry[0]
+
+    def _make_duplicate(self):
+        text = self._copyable()
+        return self._tweet(text) if text else None
+
+    def _make_spam(self):
+        """the same text in a different case, with more punctuation, or with two words swapped."""
+        text = self._copyable()
+        if not text:
+            return None
+        words = text.split()
+        style = self.random.randint(0, 2)
+        if style == 0:
+            text = text.upper()
+        elif style == 1 or len(set(words)) < 2:
+            text = text.rstrip('.!?') + '!!!'
+        else:
+            i, j = self.random.sample(range(len(words)), 2)
+            while words[i] == words[j]:
+                i, j = self.random.sample(range(len(words)), 2)
+            words[i], words[j] = words[j], words[i]
+            text = ' '.join(words)
+        return self._tweet(text)
+
+    def _make_anagram(self):
+        """
+        the letters of an earlier tweet, shuffled into new words. that tweet
+        is then forgotten, so nothing else is made with the same letters.
+        """
+        if not self._recent:
+            return None
+        i = self.random.randrange(len(self._recent))
+        text = self._recent[i][0]
+        del self._recent[i]
+        letters = list(anagramfunctions.stripped_string(text))
+        for i in range(ANAGRAM_TRIES):
+            self.random.shuffle(letters)
+            words, start = [], 0
+            while start < len(letters):
+                end = start + self.random.randint(2, 8)
+                words.append(''.join(letters[start:end]))
+                start = end
+            anagram = ' '.join(words).capitalize()
+            if anagramfunctions.test_anagram(anagram, text):
+                return self._tweet(anagram)
+        return None
+
+
+def publish(generator, address, rate=0, limit=None, duration=None,
+            wait=replay.STARTUP_WAIT, context=None):
+    """
+    publishes tweets from generator as json on address, rate a second, or
+    as fast as we can for 0, until limit tweets or duration seconds.
+    returns the number sent.
+    """
+    socket = replay.publisher(address, context, wait)
+    began = last_report = time.time()
+    sent = 0
+    try:
+        while not (limit and sent >= limit):
+            now = time.time()
+            if duration and now - began > duration:
+                break
+            tweet = generator.tweet()
+            if rate:
+                due = began + sent / float(rate)
+                if due > now:
+                    time.sleep(due - now)
+            socket.send_json(tweet)
+            sent += 1
+            if now - last_report > REPORT_INTERVAL:
+                last_report = now
+                print('sent %i tweets, %0.1f/s' % (sent, sent / (now - began)), file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        socket.close()
+    return sent
+
+
+def bench(generator, count, batch_size=ANAGRAM_BATCH_SIZE):
+    """
+    runs count tweets through filter_tweet, and what passes through an
+    in-memory AnagramFinder, returning the rate of each and the hits found.
+    """
+    from .anagramfinder import AnagramFinder
+    hits = []
+    finder = AnagramFinder(hit_callback=lambda one, two: hits.append((one, two)),
+                           load_control=False)
+    tweets = [generator.tweet() for i in range(count)]
+
+    start = time.time()
+    passed = [c for c in (anagramfunctions.filter_tweet(t) for t in tweets) if c]
+    filter_seconds = max(time.time() - start, 0.001)
+
+    start = time.time()
+    for i in range(0, len(passed), batch_size):
+        finder.handle_batch(passed[i:i + batch_size])
+    finder_seconds = max(time.time() - start, 0.001)
+    finder.close()
+    return {'tweets': count,
+            'passed': len(passed),
+            'expected_passed': generator.expected_passing(),
+            'filter_rate': count / filter_seconds,
+            'finder_rate': len(passed) / finder_seconds,
+            'hits': len(hits),
+            'expected_hits': generator.expected_hits()}
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="makes synthetic tweets with known anagrams, for load testing")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    pub = commands.add_parser('publish', help="publish tweets over zmq, like the stream")
+    pub.add_argument('--port', type=int, default=replay.DEFAULT_REPLAY_PORT,
+                     help="port to publish on")
+    pub.add_argument('--rate', type=float, default=0,
+                     help="tweets a second (default: as fast as we can)")
+    pub.add_argument('--limit', type=int, help="stop after this many tweets")
+    pub.add_argument('--duration', type=float, help="stop after this many seconds")
+    bench_parser = commands.add_parser('bench', help="time filter_tweet and an AnagramFinder")
+    bench_parser.add_argument('--count', type=int, default=100000, help="tweets to make")
+    for sub in (pub, bench_parser):
+        sub.add_argument('--seed', type=int, help="seed, to make the same tweets again")
+        for kind in sorted(DEFAULT_RATES):
+            sub.add_argument('--%s' % kind.replace('_', '-'), dest=kind, type=float,
+                             default=DEFAULT_RATES[kind],
+                             help="share of %s tweets (default: %s)" % (kind, DEFAULT_RATES[kind]))
+    args = parser.parse_args()
+
+    generator = TweetGenerator(dict((k, getattr(args, k)) for k in DEFAULT_RATES), args.seed)
+    if args.command == 'publish':
+        sent = publish(generator, 'tcp://127.0.0.1:%i' % args.port, args.rate,
+                       args.limit, args.duration)
+        print('sent %i tweets; %i should pass the filter and make %i hits' % (
+            sent, generator.expected_passing(), generator.expected_hits()), file=sys.stderr)
+        print(json.dumps(generator.counts, sort_keys=True))
+    else:
+        results = bench(generator, args.count)
+        print('filter_tweet: %(filter_rate)0.0f tweets/s, %(passed)i of %(tweets)i passed '
+              '(expected %(expected_passed)i)' % results)
+        print('AnagramFinder: %(finder_rate)0.0f tweets/s, %(hits)i hits '
+              '(expected %(expected_hits)i)' % results)
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -12,20 +12,64 @@ except ImportError:
 
 
 import logging
+import threading
+import time
+from collections import OrderedDict
 
-from twitter.oauth import OAuth
-from twitter.stream import TwitterStream
-from twitter.api import Twitter, TwitterError, TwitterHTTPError
-import tumblpy
-import requests
+from twitter.api import TwitterError, TwitterHTTPError
 
-# my twitter OAuth key:
-from .twittercreds import (CONSUMER_KEY, CONSUMER_SECRET,
-                           ACCESS_KEY, ACCESS_SECRET,
-                           BOSS_USERNAME, PRIVATE_POST_URL)
-# my tumblr OAuth key:
-from .tumblrcreds import (TUMBLR_KEY, TUMBLR_SECRET,
-                          TOKEN_KEY, TOKEN_SECRET, TUMBLR_BLOG_URL)
+from . import clients
+from .twittercreds import BOSS_USERNAME, PRIVATE_POST_URL
+from .tumblrcreds import TUMBLR_BLOG_URL
+
+STATUS_LOOKUP_MAX = 100  # ids per statuses/lookup request
+TWEET_CACHE_SIZE = 5000
+TWEET_CACHE_TTL = 15 * 60  # seconds
+
+
+class TTLCache(object):
+    """
+    a bounded, thread-safe mapping whose entries expire after ttl seconds.
+    when full, the least recently stored entry is dropped.
+    """
+
+    def __init__(self, maxsize=TWEET_CACHE_SIZE, ttl=TWEET_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires < time.time():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + self.ttl, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# shared by every TwitterHandler in the process, so that retries don't
+# fetch a tweet again. the poster runs in another process; it uses the
+# tweets and oembed markup stored with a hit when it was enriched.
+_tweet_cache = TTLCache()
+_oembed_cache = TTLCache()
 
 
 class TwitterHandler(object):
@@ -33,26 +77,14 @@ class TwitterHandler(object):
     The TwitterHandler object handles non-stream interactions with twitter.
     This includes retrieving specific tweets, posting tweets, and sending dms.
     It also now includes a basic tumblr posting utility function.
+    the underlying clients are shared by every TwitterHandler in the
+    process (see clients.py), so these are cheap to create.
     """
 
     def __init__(self):
-        self.stream = TwitterStream(
-            auth=OAuth(ACCESS_KEY,
-                       ACCESS_SECRET,
-                       CONSUMER_KEY,
-                       CONSUMER_SECRET),
-            api_version='1.1')
-        self.twitter = Twitter(
-            auth=OAuth(ACCESS_KEY,
-                       ACCESS_SECRET,
-                       CONSUMER_KEY,
-                       CONSUMER_SECRET),
-            api_version='1.1')
-        self.tmblr = tumblpy.Tumblpy(app_key=TUMBLR_KEY,
-                                     app_secret=TUMBLR_SECRET,
-                                     oauth_token=TOKEN_KEY,
-                                     oauth_token_secret=TOKEN_SECRET
-                                     )
+        self.stream = clients.twitter_stream()
+        self.twitter = clients.twitter()
+        self.tmblr = clients.tumblr()
 
     def stream_iter(self):
         """returns a stream iterator."""
@@ -60,15 +92,51 @@ class TwitterHandler(object):
         # streaming is now handled by StreamHandler.
         return self.stream.statuses.sample(language='en', stall_warnings='true')
 
-    def fetch_tweet(self, tweet_id):
+    def get_tweet(self, tweet_id):
         """
-        attempts to retrieve the specified tweet. returns False on failure.
+        retrieves the specified tweet. unlike fetch_tweet, errors are
+        raised, so callers can tell a missing tweet from a rate limit.
         """
-        try:
+        tweet = _tweet_cache.get(int(tweet_id))
+        if tweet is None:
             tweet = self.twitter.statuses.show(
                 id=str(tweet_id),
                 include_entities='false')
-            return tweet
+            _tweet_cache.set(int(tweet_id), tweet)
+        return tweet
+
+    def fetch_tweets(self, tweet_ids):
+        """
+        retrieves a number of tweets, STATUS_LOOKUP_MAX per request.
+        returns a dict of tweet id to tweet. tweets that don't exist or
+        are unavailable are left out. errors are raised.
+        """
+        tweets = dict()
+        to_fetch = []
+        for tweet_id in set(int(t) for t in tweet_ids):
+            tweet = _tweet_cache.get(tweet_id)
+            if tweet is not None:
+                tweets[tweet_id] = tweet
+            else:
+                to_fetch.append(tweet_id)
+
+        for i in range(0, len(to_fetch), STATUS_LOOKUP_MAX):
+            chunk = to_fetch[i:i + STATUS_LOOKUP_MAX]
+            results = self.twitter.statuses.lookup(
+                _id=','.join(str(t) for t in chunk),
+                include_entities='false')
+            for tweet in results:
+                tweet_id = int(tweet['id_str'])
+                _tweet_cache.set(tweet_id, tweet)
+                tweets[tweet_id] = tweet
+        return tweets
+
+    def fetch_tweet(self, tweet_id):
+        """
+        attempts to retrieve the specified tweet. returns False on failure.
+        """
+        try:
+            return self.get_tweet(tweet_id)
         except httplib.IncompleteRead as err:
             # print statements for debugging
             logging.debug(err)
@@ -124,7 +192,11 @@ class TwitterHandler(object):
         return False
 
     def oembed_for_tweet(self, tweet_id):
-        return (self.twitter.statuses.oembed(_id=tweet_id))
+        oembed = _oembed_cache.get(int(tweet_id))
+        if oembed is None:
+            oembed = self.twitter.statuses.oembed(_id=tweet_id)
+            _oembed_cache.set(int(tweet_id), oembed)
+        return oembed
 
     def retweet_hit(self, hit):
         """
@@ -139,15 +211,15 @@ class TwitterHandler(object):
 
     def tumbl_tweets(self, tweetone, tweettwo):
         """
-        posts a pair of tweets to tumblr. for url needs real tweet from twitter
+        posts a pair of tweets to tumblr. tweets are fetched tweets, or the
+        fetched part of a hit's tweets; oembed markup stored with them is used.
         """
         sn1 = tweetone.get('user').get('screen_name')
         sn2 = tweettwo.get('user').get('screen_name')
-        oembed1 = self.oembed_for_tweet(tweetone.get('id_str'))
-        oembed2 = self.oembed_for_tweet(tweettwo.get('id_str'))
+        html1 = tweetone.get('oembed_html') or self.oembed_for_tweet(tweetone.get('id_str'))['html']
+        html2 = tweettwo.get('oembed_html') or self.oembed_for_tweet(tweettwo.get('id_str'))['html']
         post_title = "@%s vs @%s" % (sn1, sn2)
-        post_content = '<div class="tweet-pair">%s<br /><br />%s</div>' % (
-            oembed1['html'], oembed2['html'])
+        post_content = '<div class="tweet-pair">%s<br /><br />%s</div>' % (html1, html2)
         post = self.tmblr.post('post',
                                blog_url=TUMBLR_BLOG_URL,
                                params={'type': 'text',
@@ -159,17 +231,27 @@ class TwitterHandler(object):
         return True
 
     def post_hit(self, hit):
-        try:
-            t1 = self.fetch_tweet(hit['tweet_one']['tweet_id'])
-            t2 = self.fetch_tweet(hit['tweet_two']['tweet_id'])
-        except TwitterHTTPError as err:
-            print('error posting tweet', err)
-            return False
+        """
+        retweets a hit and posts it to tumblr. tweets are only fetched if
+        the hit wasn't enriched; a tweet deleted since then fails its retweet.
+        """
+        id1 = int(hit['tweet_one']['tweet_id'])
+        id2 = int(hit['tweet_two']['tweet_id'])
+        t1, t2 = hit['tweet_one'].get('fetched'), hit['tweet_two'].get('fetched')
         if not t1 or not t2:
-            print('failed to fetch tweets')
-            # tweet doesn't exist or is unavailable
-            # TODO: better error handling here
-            return False
+            try:
+                tweets = self.fetch_tweets([id1, id2])
+            except TwitterHTTPError as err:
+                print('error posting tweet', err)
+                return False
+            t1, t2 = tweets.get(id1), tweets.get(id2)
+            if not t1 or not t2:
+                print('failed to fetch tweets')
+                # tweet doesn't exist or is unavailable
+                # TODO: better error handling here
+                return False
+        # hits enriched before ids were kept with their tweets
+        t1, t2 = dict(t1, id_str=str(id1)), dict(t2, id_str=str(id2))
         # retewet hits
         if not self.retweet_hit(hit):
             print('failed to retweet hits')
@@ -206,7 +288,7 @@ class TwitterHandler(object):
 
     # this is a silly way for me to update my ddns server
     def _private_update_function(self):
-        response = requests.get(PRIVATE_POST_URL)
+        response = clients.http_session().get(PRIVATE_POST_URL)
         if response.status_code == 200:
             return "update successful"
         return "update returned response %d" % response.status_code
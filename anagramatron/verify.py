@@ -0,0 +1,288 @@
+# coding: utf-8
+"""
+checks the chunks of an mdbm store against its manifest, in parallel,
+and optionally repairs damaged chunks without touching healthy ones.
+"""
+from __future__ import print_function
+
+import dbm.gnu as gdbm
+import multiprocessing
+import os
+import re
+import time
+import zlib
+
+from . import multidbm, coldstore
+
+_PATHKEY = multidbm._PATHKEY.encode('utf-8')
+
+
+def _iter_entries(db, limit):
+    """
+    yields the keys of db, streaming them with firstkey/nextkey.
+    raises RuntimeError if iteration goes on for more than limit keys,
+    which means the chunk's hash table is looping.
+    """
+    count = 0
+    k = db.firstkey()
+    while k is not None:
+        if k != _PATHKEY:
+            count += 1
+            if count > limit:
+                raise RuntimeError('key iteration does not terminate')
+            yield k
+        k = db.nextkey(k)
+
+
+def _iteration_limit(gen):
+    return (gen['keys'] + 1) * 2 + 1000
+
+
+def verify_chunk(task):
+    """
+    checks a single chunk. runs in a worker process.
+    without sample, reads every entry and recomputes the checksum;
+    with sample=n, only reads every nth value. if live, the store is open
+    for writing, and a hot chunk's keys and checksum aren't compared with
+    the manifest.
+    returns a dict describing what was found.
+    """
+    mdbm_path, gen, sample, flag, live = task
+    path = multidbm.generation_path(mdbm_path, gen)
+    cold = gen['tier'] == 'cold'
+    result = {'name': gen['name'], 'keys': 0, 'checksum': None,
+              'errors': [], 'filter_damaged': False}
+    start = time.time()
+
+    bloom = None
+    if cold:
+        try:
+            bloom = coldstore.BloomFilter.load(path + coldstore.FILTER_EXTENSION)
+        except Exception as err:
+            result['errors'].append('filter unreadable: %s' % err)
+            result['filter_damaged'] = True
+
+    # a live store can write to any of its hot chunks, sealed or not, after
+    # the manifest was last saved, so their counts can't be compared.
+    live = live and gen['tier'] == 'hot'
+    try:
+        db = gdbm.open(path, flag)
+    except Exception as err:
+        result['errors'].append('could not open chunk: %s' % err)
+        return result
+
+    checksum = 0
+    bad_values = 0
+    try:
+        for k in _iter_entries(db, _iteration_limit(gen)):
+            result['keys'] += 1
+            if sample and result['keys'] % sample:
+                continue
+            if bloom is not None and k not in bloom:
+                result['filter_damaged'] = True
+            try:
+                value = db[k]
+                if cold:
+                    value = zlib.decompress(value)
+                value.decode('utf-8')
+            except Exception:
+                bad_values += 1
+                continue
+            checksum += multidbm.entry_digest(k, value)
+    except Exception as err:
+        result['errors'].append(str(err))
+    finally:
+        db.close()
+
+    if bad_values:
+        result['errors'].append('%i unreadable values' % bad_values)
+    if result['filter_damaged'] and bloom is not None:
+        result['errors'].append('keys missing from filter')
+    if not sample and not live:
+        result['checksum'] = checksum % multidbm._CHECKSUM_MODULUS
+        if result['keys'] != gen['keys']:
+            result['errors'].append('expected %i keys, found %i' %
+                                    (gen['keys'], result['keys']))
+        if gen.get('checksum') is not None and gen['checksum'] != result['checksum']:
+            result['errors'].append('checksum mismatch')
+    result['elapsed'] = time.time() - start
+    return result
+
+
+def repair_chunk(task):
+    """
+    rebuilds a damaged chunk. runs in a worker process.
+    if only a cold chunk's filter is damaged, just the filter is rebuilt;
+    otherwise every readable entry is copied to a new file, which replaces
+    the chunk. returns the chunk's new key count and checksum.
+    """
+    mdbm_path, gen, result = task
+    path = multidbm.generation_path(mdbm_path, gen)
+    cold = gen['tier'] == 'cold'
+    filter_only = cold and result['filter_damaged'] and all(
+        'filter' in err for err in result['errors'])
+
+    src = gdbm.open(path, 'r')
+    bloom = coldstore.BloomFilter(max(gen['keys'], result['keys']))
+    dest = None
+    if not filter_only:
+        tmp_path = path + '.repair'
+        dest = gdbm.open(tmp_path, 'n')
+        if not cold:
+            dest[_PATHKEY] = gen['name']
+    keys = 0
+    checksum = 0
+    try:
+        entries = _iter_entries(src, _iteration_limit(gen))
+        while True:
+            try:
+                k = next(entries)
+            except StopIteration:
+                break
+            except RuntimeError:
+                # salvage what we have read so far
+                break
+            try:
+                raw = src[k]
+                value = zlib.decompress(raw) if cold else raw
+                value.decode('utf-8')
+            except Exception:
+                continue
+            if dest is not None:
+                dest[k] = raw
+            bloom.add(k)
+            keys += 1
+            checksum += multidbm.entry_digest(k, value)
+    finally:
+        src.close()
+        if dest is not None:
+            dest.reorganize()
+            dest.close()
+
+    if dest is not None:
+        os.replace(tmp_path, path)
+    if cold:
+        bloom.save(path + coldstore.FILTER_EXTENSION)
+    return {'name': gen['name'], 'keys': keys,
+            'checksum': checksum % multidbm._CHECKSUM_MODULUS,
+            'bytes': os.path.getsize(path)}
+
+
+def check_manifest(mdbm_path, manifest):
+    """returns a list of problems with the manifest itself."""
+    problems = []
+    listed = set()
+    for gen in manifest['generations']:
+        path = multidbm.generation_path(mdbm_path, gen)
+        listed.add(path)
+        if not os.path.exists(path):
+            problems.append('missing file for generation %s' % gen['name'])
+    for directory in (mdbm_path, os.path.join(mdbm_path, 'archive')):
+        if not os.path.exists(directory):
+            continue
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if (re.match(r'mdbm.*(\.db|\.cold)$', name) and path not in listed):
+                problems.append('file not in manifest: %s' % path)
+    return problems
+
+
+def store_is_live(mdbm_path, manifest):
+    """True if a writer has the store open: it holds its current chunk's lock."""
+    current = [g for g in manifest['generations'] if g['tier'] == 'hot' and g['sealed'] is None]
+    if not current:
+        return False
+    path = multidbm.generation_path(mdbm_path, current[-1])
+    try:
+        gdbm.open(path, 'r').close()
+    except gdbm.error:
+        return os.path.exists(path)
+    return False
+
+
+def verify_store(mdbm_path, jobs=None, sample=None, repair=False):
+    """
+    verifies every chunk in the store at mdbm_path using a process pool.
+    returns True if no problems were found (or all of them were repaired).
+    verifying works while the store is in use, but then only archived and
+    cold chunks are checked against their checksums; hot chunks are only
+    read. repairing takes locks, and fails if the store is open for writing.
+    """
+    flag = 'r' if repair else 'ru'
+    try:
+        manifest = multidbm.load_manifest(mdbm_path)
+    except IOError:
+        print('no manifest found in %s' % mdbm_path)
+        return False
+    live = not repair and store_is_live(mdbm_path, manifest)
+    if live:
+        print('store is in use: hot chunks are read, but not checked against the manifest')
+
+    problems = check_manifest(mdbm_path, manifest)
+    for problem in problems:
+        print(problem)
+    gens = [g for g in manifest['generations']
+            if os.path.exists(multidbm.generation_path(mdbm_path, g))]
+    by_name = dict((g['name'], g) for g in gens)
+
+    print("verifying %i mdbm chunks" % len(gens))
+    start = time.time()
+    damaged = []
+    unrecorded = []
+    pool = multiprocessing.Pool(jobs)
+    try:
+        tasks = [(mdbm_path, g, sample, flag, live) for g in gens]
+        for result in pool.imap_unordered(verify_chunk, tasks):
+            status = 'ok' if not result['errors'] else '; '.join(result['errors'])
+            print('%s: %i keys (%0.1fs) %s' % (
+                result['name'], result['keys'], result.get('elapsed', 0), status))
+            if result['errors']:
+                damaged.append(result)
+            elif result['checksum'] is not None and by_name[result['name']].get('checksum') is None:
+                unrecorded.append(result)
+
+        if repair and damaged:
+            tasks = [(mdbm_path, by_name[r['name']], r) for r in damaged]
+            for repaired in pool.imap_unordered(repair_chunk, tasks):
+                by_name[repaired['name']].update(repaired)
+                print('repaired %s: %i keys' % (repaired['name'], repaired['keys']))
+    finally:
+        pool.close()
+        pool.join()
+
+    if repair:
+        for result in unrecorded:
+            by_name[result['name']]['checksum'] = result['checksum']
+        missing = [g for g in manifest['generations'] if g['name'] not in by_name]
+        for gen in missing:
+            manifest['generations'].remove(gen)
+            print('removed missing generation %s from manifest' % gen['name'])
+        multidbm.save_manifest(mdbm_path, manifest)
+
+    print('checked %i chunks in %0.1fs: %i damaged' %
+          (len(gens), time.time() - start, len(damaged)))
+    if repair:
+        return not [p for p in problems if p.startswith('file not in manifest')]
+    return not (problems or damaged)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="verifies the chunks of an mdbm store against its manifest. "
+                    "while the store is in use, only archived and cold chunks are "
+                    "checked against their checksums")
+    parser.add_argument('db', type=str, help="mdbm directory")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: cpu count)')
+    parser.add_argument('-s', '--sample', type=int, default=None,
+                        help='only read every nth value; skips checksums')
+    parser.add_argument('-r', '--repair', action="store_true",
+                        help='rebuild damaged chunks and filters. the store must not be in use')
+    args = parser.parse_args()
+    ok = verify_store(args.db, jobs=args.jobs, sample=args.sample, repair=args.repair)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
 
 import os
+import random
 import shutil
+import string
 
-from anagramatron import anagramfinder, common
+from anagramatron import anagramfinder, anagramfunctions, common
 
 TEST_STORE_PATH =  os.path.join(common.ANAGRAM_DATA_DIR, 'test_store.mdbm')
 
@@ -57,6 +59,93 @@ def test_simple_anagrams():
     assert a_count == 10
 
 
+def test_batch_matches_single_inputs():
+    _cleanup()
+    test_input = ['So bored all the time',
+        'Berit od hates me lol',
+        "Lord Jesus it's a fart",
+        "It's just sad forreal",
+        'time destroys all things',
+        'So bored all the time']
+
+    single_hits = []
+    finder = anagramfinder.AnagramFinder(hit_callback=lambda *args: single_hits.append(args))
+    for inp in test_input:
+        finder.handle_input(inp)
+
+    batch_hits = []
+    finder = anagramfinder.AnagramFinder(hit_callback=lambda *args: batch_hits.append(args))
+    finder.handle_batch(test_input)
+
+    assert len(batch_hits) == 2
+    assert batch_hits == single_hits
+
+
+def test_batch_after_cache_hit():
+    # a key both cached and stored; the first input takes the cached
+    # candidate, so the second has to find the stored one.
+    results = []
+    for batch in (False, True):
+        _cleanup()
+        hits = []
+        finder = anagramfinder.AnagramFinder(path=TEST_STORE_PATH, storage='mdbm',
+                                             cachepath=TEST_STORE_PATH + '.cache',
+                                             hit_callback=lambda *args: hits.append(args),
+                                             load_control=False)
+        key = anagramfunctions.improved_hash('So bored all the time')
+        cached = {'text': 'So bored all the time', 'tweet_id': 1}
+        stored = {'text': 'so bored all the time!', 'tweet_id': 2}
+        finder.cache[key] = [cached]
+        finder.datastore[key] = [stored]
+        inputs = ['Berit od hates me lol', 'Berit od hates me, lol!']
+        if batch:
+            finder.handle_batch(inputs)
+        else:
+            for inp in inputs:
+                finder.handle_input(inp)
+        results.append(hits)
+        assert hits == [(inputs[0], cached), (inputs[1], stored)]
+        finder.close()
+        os.remove(TEST_STORE_PATH + '.cache')
+    assert results[0] == results[1]
+
+
+def test_multiple_candidates():
+    hits = []
+    finder = anagramfinder.AnagramFinder(hit_callback=lambda *args: hits.append(args),
+                                         load_control=False, max_candidates=2)
+    dupes = ['So bored all the time', 'so bored all the time', 'So bored, all the time!']
+    finder.handle_batch(dupes)
+    key = anagramfunctions.improved_hash(dupes[0])
+    # all equally similar, so the oldest goes
+    assert finder.cache[key] == dupes[1:]
+    finder.handle_input('Berit od hates me lol')
+    assert hits == [('Berit od hates me lol', dupes[1])]
+    assert finder.cache[key] == dupes[2:]
+
+
+def test_cache_budget():
+    _cleanup()
+    cachepath = TEST_STORE_PATH + '.cache'
+    budget = 1024 * 1024
+    finder = anagramfinder.AnagramFinder(path=TEST_STORE_PATH, storage='mdbm',
+                                         cachepath=cachepath, load_control=False,
+                                         cache_budget=budget)
+    rand = random.Random(1)
+    texts = [''.join(rand.choice(string.ascii_lowercase + ' ') for _ in range(60))
+             for _ in range(5000)]
+    for i in range(0, len(texts), 500):
+        finder.handle_batch(texts[i:i + 500])
+
+    assert finder.entry_bytes > 0
+    assert finder.cache_size == max(anagramfinder.MIN_CACHE_SIZE,
+                                    int(budget / finder.entry_bytes))
+    assert finder.stats['cache_capacity'] == finder.cache_size
+    assert len(finder.cache) <= finder.cache_size
+    finder.close()
+    os.remove(cachepath)
+
+
 def _cleanup():
     if os.path.exists(TEST_STORE_PATH):
         shutil.rmtree(TEST_STORE_PATH)
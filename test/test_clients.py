@@ -0,0 +1,45 @@
+import threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from anagramatron import clients
+
+
+class HeadHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+
+    def do_HEAD(self):
+        HeadHandler.connections.add(self.client_address)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_clients_are_shared():
+    assert clients.http_session() is clients.http_session()
+    session = clients.http_session()
+    clients.reset('http')
+    assert clients.http_session() is not session
+
+
+def test_health_check_reuses_connection():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), HeadHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:%i/' % server.server_address[1]
+    try:
+        assert clients.check_health(url) is not None
+        assert clients.check_health(url) is not None
+        assert len(HeadHandler.connections) == 1
+    finally:
+        # lets the server's handler thread see the connection close
+        clients.reset('http')
+        server.shutdown()
+        server.server_close()
+
+    assert clients.check_health(url, timeout=1) is None
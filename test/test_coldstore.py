@@ -0,0 +1,25 @@
+import os
+
+from anagramatron import coldstore, common
+
+TEST_FILTER_PATH = os.path.join(common.ANAGRAM_DATA_DIR, 'test_filter.bloom')
+
+
+def test_bloom_filter():
+    bloom = coldstore.BloomFilter(1000)
+    keys = ['key%i' % i for i in range(1000)]
+    for k in keys:
+        bloom.add(k)
+    assert all(k in bloom for k in keys)
+    false_positives = sum(1 for i in range(1000) if ('other%i' % i) in bloom)
+    assert false_positives < 50
+
+
+def test_bloom_filter_save():
+    bloom = coldstore.BloomFilter(10)
+    bloom.add('AABBCC')
+    bloom.save(TEST_FILTER_PATH)
+    loaded = coldstore.BloomFilter.load(TEST_FILTER_PATH)
+    assert 'AABBCC' in loaded
+    assert len(loaded) == 1
+    os.remove(TEST_FILTER_PATH)
@@ -73,3 +73,13 @@ def test_filter_tweet():
     rt = result['text']
     assert rt == test_tweet['text']
 
+
+def test_interest_score():
+    short = anagramfunctions.letter_stats('so bored all the time')
+    longer = anagramfunctions.letter_stats(
+        'the quick brown fox is jumping over a very lazy dog')
+    assert anagramfunctions.interest_score(*short) < anagramfunctions.interest_score(*longer)
+    assert anagramfunctions.interest_score(*longer) <= 1
+    text = test_tweet['text']
+    assert (anagramfunctions.hash_letter_stats(anagramfunctions.improved_hash(text)) ==
+            anagramfunctions.letter_stats(text))
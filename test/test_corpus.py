@@ -0,0 +1,53 @@
+import gzip
+import io
+import json
+import os
+
+from anagramatron import corpus
+
+test_input = ['So bored all the time',
+              'Berit od hates me lol',
+              "Lord Jesus it's a fart",
+              "It's just sad forreal",
+              'time destroys all things',
+              'Freight is so pathetic.',
+              'straight piece of shit',
+              'too short']
+
+
+def test_corpus_finds_pairs(tmpdir):
+    text_path = os.path.join(str(tmpdir), 'corpus.txt')
+    with open(text_path, 'w') as f:
+        f.write('\n'.join(test_input[:4] + test_input[:4]) + '\n')
+    json_path = os.path.join(str(tmpdir), 'corpus.jsonl.gz')
+    with gzip.open(json_path, 'wt') as f:
+        for i, text in enumerate(test_input[4:]):
+            f.write(json.dumps({'text': text, 'id': i}) + '\n')
+
+    out = io.StringIO()
+    stats = corpus.run([text_path, json_path], out, jobs=2, run_size=3,
+                       tmp_dir=str(tmpdir))
+    hits = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert len(hits) == 3
+    assert stats.counts['lines'] == len(test_input) + 4
+    assert stats.counts['runs'] > 1
+    texts = set(frozenset(h[k]['text'] if isinstance(h[k], dict) else h[k] for k in h)
+                for h in hits)
+    assert frozenset([test_input[5], test_input[6]]) in texts
+    # duplicate lines are only compared once
+    assert stats.counts['pairs_tested'] == 3
+    # runs are cleaned up
+    assert sorted(os.listdir(str(tmpdir))) == ['corpus.jsonl.gz', 'corpus.txt']
+
+
+def test_merge_in_passes(tmpdir):
+    paths = []
+    for i in range(5):
+        path = os.path.join(str(tmpdir), 'run%i' % i)
+        with open(path, 'w') as f:
+            f.writelines('%s\t%i\n' % (key, i) for key in sorted(['AB', 'AC', 'B%i' % i]))
+        paths.append(path)
+    lines = list(corpus.merged(paths, str(tmpdir), fan_in=2))
+    assert lines == sorted(lines)
+    assert len(lines) == 15
+    assert [line[:2] for line in lines[:5]] == ['AB'] * 5
@@ -0,0 +1,84 @@
+import os
+import shutil
+
+from anagramatron import anagramfunctions, common, crossjoin, multidbm
+
+TEST_STORE_PATH = os.path.join(common.ANAGRAM_DATA_DIR, 'test_crossjoin.mdbm')
+
+
+def _tweet(text, tweet_id):
+    return {'text': text, 'tweet_id': tweet_id,
+            'anagram_hash': anagramfunctions.improved_hash(text)}
+
+
+def test_pairs_across_generations():
+    _cleanup()
+    store = multidbm.MultiDBM(TEST_STORE_PATH, chunk_size=2)
+    old = _tweet('So bored all the time', 1)
+    store[old['anagram_hash']] = old
+    store['filler'] = _tweet('Freight is so pathetic.', 2)
+    store.archive()
+    # the archived tweet is never compared with this one by the live store
+    new = _tweet('Berit od hates me lol', 3)
+    store[new['anagram_hash']] = new
+    other = _tweet("Lord Jesus it's a fart", 4)
+    store[other['anagram_hash']] = other
+    store.close()
+    assert [g['tier'] for g in crossjoin.store_generations(TEST_STORE_PATH)] == ['cold', 'hot']
+
+    pairs = []
+    totals = crossjoin.cross_join(TEST_STORE_PATH, lambda *args: pairs.append(args), jobs=1)
+    assert [(a['tweet_id'], b['tweet_id']) for a, b in pairs] == [(3, 1)]
+    assert pairs[0][0]['anagram_hash'] == old['anagram_hash']
+    assert totals['shared_keys'] == 1
+
+    pairs = []
+    crossjoin.cross_join(TEST_STORE_PATH, lambda *args: pairs.append(args), jobs=1,
+                         skip=frozenset([old['anagram_hash']]))
+    assert not pairs
+    _cleanup()
+
+
+def test_each_chunk_read_once(monkeypatch, tmpdir):
+    _cleanup()
+    store = multidbm.MultiDBM(TEST_STORE_PATH, chunk_size=4)
+    texts = ['So bored all the time', 'Freight is so pathetic.', 'zzz quiz jazz',
+             'the quick brown fox jumps over the lazy dog', 'Berit od hates me lol',
+             "Lord Jesus it's a fart", 'Moist hairy dog ate my homework']
+    for i, text in enumerate(texts):
+        tweet = _tweet(text, i + 1)
+        store[tweet['anagram_hash']] = tweet
+        if i == 3:
+            store.archive()
+    store.close()
+    gens = crossjoin.store_generations(TEST_STORE_PATH)
+    bounds = crossjoin.partition_bounds(TEST_STORE_PATH, gens, 4)
+    assert len(bounds) > 3
+
+    reads = []
+    keys = crossjoin._Chunk.keys
+    monkeypatch.setattr(crossjoin._Chunk, 'keys',
+                        lambda self: reads.append(self.gen['name']) or keys(self))
+    files = [[] for i in range(len(bounds) - 1)]
+    for i, gen in enumerate(gens):
+        # a spill size of 2 writes more than one file for some ranges
+        for range_idx, chunk_idx, path in crossjoin.spill_chunk(
+                (TEST_STORE_PATH, i, gen, bounds, str(tmpdir), 2)):
+            files[range_idx].append((chunk_idx, path))
+    assert sorted(reads) == sorted(gen['name'] for gen in gens)
+
+    pairs, shared = [], 0
+    for range_files in files:
+        found, counts = crossjoin.join_range(
+            (TEST_STORE_PATH, gens, sorted(range_files), frozenset()))
+        pairs.extend(found)
+        shared += counts['shared_keys']
+    assert len(reads) == len(gens)
+    assert [(a['tweet_id'], b['tweet_id']) for a, b in pairs] == [(5, 1)]
+    assert shared == 1
+    _cleanup()
+
+
+def _cleanup():
+    if os.path.exists(TEST_STORE_PATH):
+        shutil.rmtree(TEST_STORE_PATH)
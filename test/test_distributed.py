@@ -0,0 +1,67 @@
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+
+zmq = pytest.importorskip('zmq')
+
+from anagramatron import distributed
+
+test_input = ['So bored all the time',
+    'Berit od hates me lol',
+    "Lord Jesus it's a fart",
+    "It's just sad forreal",
+    'time destroys all things',
+    'Freight is so pathetic.',
+    'straight piece of shit',
+    'i hate this one republic song']
+
+
+def _tweet(i, text):
+    return {'id_str': str(i), 'text': text, 'lang': 'en',
+            'entities': {'urls': [], 'user_mentions': []}}
+
+
+def _start(node):
+    thread = threading.Thread(target=node.run)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def test_ingest_routes_to_finders():
+    ipc_dir = tempfile.mkdtemp()
+    address = lambda name: 'ipc://%s' % os.path.join(ipc_dir, name)
+    hits = []
+    sink = distributed.HitSink(address('sink'), hit_callback=lambda *args: hits.append(args))
+    sink_thread = _start(sink)
+
+    finders = [distributed.FinderNode(i, 2, address('finder%i' % i), address('sink'),
+                                      storage=None)
+               for i in range(2)]
+    finder_threads = [_start(f) for f in finders]
+
+    tweets = [_tweet(i, text) for i, text in enumerate(test_input)]
+    ingest = distributed.IngestNode([address('finder0'), address('finder1')],
+                                    address('sink'), source=tweets)
+    ingest.run()
+    assert ingest.counters['passed_filter'] == len(test_input)
+    assert ingest.counters['sent'] == len(test_input)
+
+    deadline = time.time() + 10
+    while len(hits) < 3 and time.time() < deadline:
+        time.sleep(0.05)
+    for finder, thread in zip(finders, finder_threads):
+        finder.stop()
+        thread.join()
+    time.sleep(0.5)
+    sink.stop()
+    sink_thread.join()
+
+    assert len(hits) == 3
+    status = sink.status()
+    assert ingest.name in status
+    assert all(not node['alive'] for node in status.values())
+    assert sum(node['stats'].get('received', 0) for node in status.values()) == len(test_input)
@@ -0,0 +1,109 @@
+import os
+import time
+
+from anagramatron import common, enrichment, hitmanager
+
+TEST_LOCATION = os.path.join(common.ANAGRAM_DATA_DIR, 'test_enrichment.sqlite')
+
+
+class StubError(Exception):
+    def __init__(self, code, headers=None):
+        super(StubError, self).__init__('HTTP %i' % code)
+        self.e = self
+        self.code = code
+        self.headers = headers or dict()
+
+
+class StubTwitterHandler(object):
+
+    """
+    stands in for TwitterHandler. errors maps tweet ids to lists of
+    errors to raise; tweets with ids in missing don't exist.
+    """
+
+    def __init__(self, errors=None, missing=(), delay=0):
+        self.errors = errors or dict()
+        self.missing = missing
+        self.delay = delay
+        self.requests = 0
+
+    def fetch_tweets(self, tweet_ids):
+        self.requests += 1
+        time.sleep(self.delay)
+        for tweet_id in tweet_ids:
+            if self.errors.get(tweet_id):
+                raise self.errors[tweet_id].pop(0)
+        return dict((tweet_id, self._tweet(tweet_id)) for tweet_id in tweet_ids
+                    if tweet_id not in self.missing)
+
+    def _tweet(self, tweet_id):
+        return {'id_str': str(tweet_id), 'text': 'tweet %i' % tweet_id, 'created_at': 'now',
+                'user': {'name': 'stub', 'screen_name': 'stub', 'profile_image_url': ''}}
+
+
+def _pair(n):
+    first = {'text': 'aabbccddeeffgghh', 'anagram_hash': 'hash%i' % n, 'tweet_id': n * 10}
+    second = {'text': 'bbaacceeddgghhff', 'anagram_hash': 'hash%i' % n, 'tweet_id': n * 10 + 1}
+    return first, second
+
+
+def test_hits_stored_before_enrichment():
+    _cleanup()
+    handler = StubTwitterHandler(delay=0.2)
+    hm = hitmanager.HitDBManager(TEST_LOCATION, twitter_handler=handler, enrichment_workers=2)
+    start = time.time()
+    for n in range(4):
+        hm.new_hit(*_pair(n))
+    assert time.time() - start < 0.2
+    assert len(hm.all_hits(hitmanager.HIT_STATUS_PENDING)) == 4
+
+    assert hm.enrichment.wait(5)
+    hits = hm.all_hits(hitmanager.HIT_STATUS_REVIEW)
+    assert len(hits) == 4
+    # both tweets in a hit are fetched together
+    assert handler.requests == 4
+    assert all(h['tweet_one']['fetched']['text'] for h in hits)
+    hm.close()
+
+
+def test_retries_and_missing_tweets():
+    _cleanup()
+    handler = StubTwitterHandler(errors={
+        10: [StubError(500), StubError(503)],
+        20: [StubError(429, {'x-rate-limit-reset': str(time.time() + 0.2)})],
+        40: [StubError(500)] * 10},
+        missing=(31,))
+    hm = hitmanager.HitDBManager(TEST_LOCATION, twitter_handler=handler)
+    hm.enrichment = enrichment.EnrichmentPool(hm.dbpath, handler, workers=2,
+                                              max_attempts=3, base_delay=0.01)
+    for n in range(1, 5):
+        hm.new_hit(*_pair(n))
+    assert hm.enrichment.wait(5)
+
+    hits = dict((h['hash'], h) for h in hm.all_hits())
+    assert 'fetched' in hits['hash1']['tweet_one']
+    assert 'fetched' in hits['hash2']['tweet_one']
+    assert 'hash3' not in hits
+    # gave up, but kept the hit
+    assert hits['hash4']['status'] == hitmanager.HIT_STATUS_REVIEW
+    assert 'fetched' not in hits['hash4']['tweet_one']
+    hm.close()
+
+
+def test_pending_hits_resume():
+    _cleanup()
+    handler = StubTwitterHandler()
+    hm = hitmanager.HitDBManager(TEST_LOCATION, twitter_handler=handler)
+    hit = hm.prepare_hit(*_pair(1))
+    hit['status'] = hitmanager.HIT_STATUS_PENDING
+    hm.store_hit(hit)
+
+    hm = hitmanager.HitDBManager(TEST_LOCATION, twitter_handler=handler, enrichment_workers=1)
+    assert hm.enrichment.wait(5)
+    assert len(hm.all_hits(hitmanager.HIT_STATUS_REVIEW)) == 1
+    hm.close()
+
+
+def _cleanup():
+    if os.path.exists(TEST_LOCATION):
+        os.remove(TEST_LOCATION)
@@ -67,6 +67,41 @@ def test_posting():
 
 
 
+def test_prepare_and_store_hit():
+    _cleanup()
+    hm = hitmanager.HitDBManager(TEST_LOCATION, _testing=True)
+    first = {'text': 'aabbccddeeffgghh', 'anagram_hash': 'asfdlkj', 'tweet_id': 1}
+    second = {'text': 'bbaacceeddgghhff', 'anagram_hash': 'asfdlkj', 'tweet_id': 2}
+    hit = hm.prepare_hit(first, second)
+    duplicate = hm.prepare_hit(first, second)
+    assert hit['id'] != duplicate['id']
+    assert hm.store_hit(hit)
+    assert not hm.store_hit(duplicate)
+    assert hm.prepare_hit(first, second) is None
+    assert len(hm.all_hits()) == 1
+
+
 def _cleanup():
     if os.path.exists(TEST_LOCATION):
         os.remove(TEST_LOCATION)
+
+
+def test_enrichment_keeps_what_posting_needs():
+    _cleanup()
+
+    class StubHandler(object):
+        def fetch_tweets(self, ids):
+            return dict((i, {'id_str': str(i), 'text': 'tweet &amp; %i' % i,
+                             'user': {'screen_name': 'user%i' % i}}) for i in ids)
+
+        def oembed_for_tweet(self, tweet_id):
+            return {'html': '<p>%s</p>' % tweet_id}
+
+    hm = hitmanager.HitDBManager(TEST_LOCATION, twitter_handler=StubHandler())
+    first = {'text': 'aabbccddeeffgghh', 'anagram_hash': 'asfdlkj', 'tweet_id': 1}
+    second = {'text': 'bbaacceeddgghhff', 'anagram_hash': 'asfdlkj', 'tweet_id': 2}
+    hm.new_hit(first, second)
+    hit = hm.all_hits()[0]
+    assert hit['tweet_one']['fetched']['oembed_html'] == '<p>1</p>'
+    assert hit['tweet_two']['fetched']['id_str'] == '2'
+    assert hit['tweet_two']['fetched']['text'] == 'tweet & 2'
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import threading
+
+import pytest
+
+zmq = pytest.importorskip('zmq')
+
+from anagramatron import ingest
+
+
+class FakeSource(object):
+
+    def __init__(self, tweets):
+        self.tweets = list(tweets)
+        self.closed = False
+
+    def start(self):
+        pass
+
+    def get_batch(self, size, timeout=None):
+        batch, self.tweets = self.tweets[:size], self.tweets[size:]
+        return batch
+
+    def bufferlength(self):
+        return len(self.tweets)
+
+    def close(self):
+        self.closed = True
+
+
+def _tweets(n):
+    return [{'tweet_text': 'tweet %i' % i, 'tweet_id': i} for i in range(n)]
+
+
+def _start(address, source, state_path):
+    service = ingest.IngestService(address, source=source, state_path=state_path)
+    thread = threading.Thread(target=service.run)
+    thread.daemon = True
+    thread.start()
+    return service, thread
+
+
+def test_unacknowledged_batches_redelivered():
+    tmp = tempfile.mkdtemp()
+    address = 'ipc://' + os.path.join(tmp, 'ingest')
+    service, thread = _start(address, FakeSource(_tweets(25)), tmp)
+    try:
+        first = ingest.IngestClient(address)
+        first.start()
+        batch_one = first.get_batch(10)
+        batch_two = first.get_batch(10)  # acks batch_one
+        assert batch_one == _tweets(10)
+        assert batch_two == _tweets(20)[10:]
+        # the finder dies before acking batch_two
+        first.close()
+
+        second = ingest.IngestClient(address)
+        second.start()
+        assert second.get_batch(10) == batch_two
+        assert second.get_batch(10) == _tweets(25)[20:]
+        assert second.get_batch(10, timeout=0.1) == []
+        second.close()
+    finally:
+        service.stop()
+        thread.join(5)
+        shutil.rmtree(tmp)
+
+
+def test_inflight_batches_survive_restart():
+    tmp = tempfile.mkdtemp()
+    address = 'ipc://' + os.path.join(tmp, 'ingest')
+    source = FakeSource(_tweets(10))
+    service, thread = _start(address, source, tmp)
+    client = ingest.IngestClient(address, auto_ack=False)
+    client.start()
+    assert client.get_batch(5) == _tweets(5)
+    service.stop()
+    thread.join(5)
+    assert source.closed
+
+    service, thread = _start(address, FakeSource([]), tmp)
+    try:
+        # the new service can't match acks to its own batches
+        client.ack()
+        assert client.get_batch(5) == _tweets(5)
+        client.ack()
+        assert client.get_batch(5, timeout=0.1) == []
+        client.close()
+    finally:
+        service.stop()
+        thread.join(5)
+        shutil.rmtree(tmp)
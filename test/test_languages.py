@@ -0,0 +1,62 @@
+# coding: utf-8
+from anagramatron import anagramfinder, anagramfunctions, shardedfinder
+from anagramatron.languages import get_language
+
+spanish = get_language('es')
+
+
+def _tweet(text, lang):
+    return {'text': text, 'lang': lang, 'id_str': '1',
+            'entities': {'user_mentions': [], 'urls': []}}
+
+
+def test_english_hash_unchanged():
+    text = 'So bored all the time'
+    assert (anagramfunctions.improved_hash(text, language=get_language('en')) ==
+            anagramfunctions.improved_hash(text))
+
+
+def test_spanish_keeps_its_letters():
+    assert spanish.normalize('Mañana café') == 'Mañana cafe'
+    assert spanish.stripped(spanish.normalize('Mañana café')) == 'mañanacafe'
+    # ñ and n are different letters
+    assert (anagramfunctions.improved_hash('niño', language=spanish) !=
+            anagramfunctions.improved_hash('nino', language=spanish))
+    assert (anagramfunctions.improved_hash('una señal', language=spanish) ==
+            anagramfunctions.improved_hash('la señuna', language=spanish))
+
+
+def test_filter_by_language():
+    tweet = _tweet('El niño come pan con queso todos los días', 'es')
+    assert not anagramfunctions.filter_tweet(tweet)
+    candidate = anagramfunctions.filter_tweet(tweet, spanish)
+    assert candidate['lang'] == 'es'
+    assert candidate['text'] == 'El niño come pan con queso todos los dias'
+    assert 'lang' not in anagramfunctions.filter_tweet(
+        _tweet('the quick brown fox jumps over the lazy dog', 'en'))
+
+
+def test_language_finder_routes_by_lang():
+    hits = []
+    finder = shardedfinder.LanguageFinder(
+        ['en', 'es'], storage=None, hit_callback=lambda *args: hits.append(args))
+    finder.handle_batch([
+        {'text': 'So bored all the time', 'lang': 'en'},
+        {'text': 'Berit od hates me lol', 'lang': 'es'},
+        {'text': 'Berit od hates me lol'},
+        {'text': 'Berit od hates me lol', 'lang': 'de'}])
+    finder.close()
+    assert len(hits) == 1
+    assert 'lang' not in hits[0][0]
+    assert finder.stats['unrouted'] >= 1
+
+
+def test_finder_takes_one_language():
+    finder = anagramfinder.AnagramFinder(languages=['es'], load_control=False)
+    assert finder.language.code == 'es'
+    try:
+        anagramfinder.AnagramFinder(languages=['en', 'es'], load_control=False)
+    except NotImplementedError:
+        pass
+    else:
+        assert False
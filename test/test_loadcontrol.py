@@ -0,0 +1,79 @@
+from anagramatron import anagramfinder, loadcontrol
+from anagramatron.anagramstats import StatTracker
+
+
+class FakeFinder(object):
+
+    def __init__(self):
+        self.levels = []
+        self.rotations = 0
+
+    def apply_load_level(self, level):
+        self.levels.append(level)
+
+    def perform_maintenance(self):
+        self.rotations += 1
+
+
+class FakeEnrichment(object):
+    paused = False
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+
+def test_escalates_gradually_and_relaxes_with_hysteresis():
+    stats = StatTracker()
+    finder, enrichment = FakeFinder(), FakeEnrichment()
+    load = loadcontrol.LoadController(finder, enrichment, backlog_limit=1000)
+    try:
+        now = 1000.0
+        stats['buffer'] = 2000
+        for _ in range(4):
+            load.observe(100, 0.1, now)
+            now += loadcontrol.ESCALATE_HOLD
+        # one step at a time, up to pausing enrichment
+        assert finder.levels == [1, 2, 3, 4]
+        assert enrichment.paused
+        assert finder.rotations == 1
+
+        # backlog drops below where the pause level starts, but not far enough
+        stats['buffer'] = 1000
+        now += loadcontrol.RELAX_HOLD
+        load.observe(100, 0.1, now)
+        assert load.level == loadcontrol.LEVEL_PAUSE
+
+        stats['buffer'] = 0
+        load.observe(100, 0.1, now + 1)
+        # load has to stay low for a while
+        assert load.level == loadcontrol.LEVEL_PAUSE
+        now += loadcontrol.RELAX_HOLD + 1
+        load.observe(100, 0.1, now)
+        assert load.level == loadcontrol.LEVEL_ROTATE
+        assert not enrichment.paused
+        assert [d['to'] for d in load.decisions][-1] == 'rotate'
+        assert stats['load_level'] == loadcontrol.LEVEL_ROTATE
+    finally:
+        stats['buffer'] = 0
+        stats['load_level'] = 0
+
+
+def test_shedding_skips_short_candidates():
+    finder = anagramfinder.AnagramFinder(load_control=False, hit_callback=lambda a, b: None)
+    finder.apply_load_level(loadcontrol.LEVEL_SHED)
+    finder.handle_batch(['a short tweet here', 'a much longer tweet, with plenty of letters'])
+    assert len(finder.cache) == 1
+    finder.apply_load_level(loadcontrol.LEVEL_NORMAL)
+    finder.handle_batch(['a short tweet here'])
+    assert len(finder.cache) == 2
+
+
+def test_interest_floor_rises_with_backlog():
+    assert loadcontrol.interest_floor(0, 1000, 0.5) == 0
+    assert loadcontrol.interest_floor(500, 1000, 0.5) == 0
+    assert 0 < loadcontrol.interest_floor(750, 1000, 0.5) < 0.5
+    assert loadcontrol.interest_floor(5000, 1000, 0.5) == 0.5
+    assert loadcontrol.interest_floor(5000, 1000, 0) == 0
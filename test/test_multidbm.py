@@ -0,0 +1,247 @@
+import os
+import shutil
+
+from anagramatron import anagramfunctions, multidbm, common, verify
+from anagramatron.anagramstats import StatTracker
+
+TEST_STORE_PATH = os.path.join(common.ANAGRAM_DATA_DIR, 'test_generations.mdbm')
+
+
+def test_generations():
+    _cleanup()
+    store = multidbm.MultiDBM(TEST_STORE_PATH, chunk_size=2)
+    for i in range(5):
+        store['key%i' % i] = {'text': 'text %i' % i, 'tweet_id': 10 + i}
+    gens = store.generations()
+    assert len(gens) == 3
+    assert gens[0]['min_id'] == 10 and gens[0]['max_id'] == 11
+    assert gens[0]['sealed'] and not gens[-1]['sealed']
+    store.close()
+
+    store = multidbm.MultiDBM(TEST_STORE_PATH, chunk_size=2)
+    assert [g['keys'] for g in store.generations()] == [2, 2, 1]
+    assert store['key0']['tweet_id'] == 10
+    store.close()
+
+
+def test_expire():
+    _cleanup()
+    store = multidbm.MultiDBM(TEST_STORE_PATH, chunk_size=2)
+    for i in range(5):
+        store['key%i' % i] = {'text': 'text %i' % i, 'tweet_id': 10 + i}
+    store.max_age = 0
+    dropped = store.expire(now=store.generations()[-1]['created'] + 1)
+    assert len(dropped) == 2
+    assert 'key0' not in store
+    assert 'key4' in store
+    store.close()
+    _cleanup()
+
+
+def test_reorganize():
+    _cleanup()
+    store = multidbm.MultiDBM(TEST_STORE_PATH, chunk_size=2)
+    for i in range(5):
+        store['key%i' % i] = {'text': 'text %i' % i, 'tweet_id': 10 + i}
+    name = store.generations()[0]['name']
+
+    def write_during_copy(done, total):
+        store['key0'] = {'text': 'changed', 'tweet_id': 10}
+        del store['key1']
+
+    store.reorganize(name, checkpoint=write_during_copy)
+    assert store['key0']['text'] == 'changed'
+    assert 'key1' not in store
+    assert store.generations()[0]['keys'] == 1
+    store.close()
+    _cleanup()
+
+
+def test_reorganize_failure(monkeypatch):
+    _cleanup()
+    store = multidbm.MultiDBM(TEST_STORE_PATH, chunk_size=2)
+    for i in range(5):
+        store['key%i' % i] = {'text': 'text %i' % i, 'tweet_id': 10 + i}
+    name = store.generations()[0]['name']
+    replace = os.replace
+
+    def failing_replace(src, dst):
+        if src.endswith('.shadow'):
+            raise OSError('disk full')
+        return replace(src, dst)
+
+    def write_during_copy(done, total):
+        store['key0'] = {'text': 'changed', 'tweet_id': 10}
+
+    monkeypatch.setattr(multidbm.os, 'replace', failing_replace)
+    try:
+        store.reorganize(name, checkpoint=write_during_copy)
+        assert False, 'reorganize should fail'
+    except OSError as err:
+        assert 'disk full' in str(err)
+    monkeypatch.setattr(multidbm.os, 'replace', replace)
+    # the chunk is open again, with the write made while copying
+    assert store['key0']['text'] == 'changed'
+    assert store['key1']['text'] == 'text 1'
+    store['key1'] = {'text': 'after', 'tweet_id': 11}
+    assert store['key1']['text'] == 'after'
+    assert not os.path.exists(os.path.join(TEST_STORE_PATH, name + '.shadow'))
+    store.close()
+    _cleanup()
+
+
+def test_archive_failure(monkeypatch):
+    _cleanup()
+    store = multidbm.MultiDBM(TEST_STORE_PATH, chunk_size=2)
+    for i in range(5):
+        store['key%i' % i] = {'text': 'text %i' % i, 'tweet_id': 10 + i}
+    hot = [g['name'] for g in store.generations('hot')]
+
+    def failing_rename(src, dst):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(multidbm.os, 'rename', failing_rename)
+    try:
+        store.archive()
+        assert False, 'archive should fail'
+    except OSError as err:
+        assert 'disk full' in str(err)
+    monkeypatch.undo()
+    # the chunk is still open and in place
+    assert [g['name'] for g in store.generations('hot')] == hot
+    assert store['key0']['text'] == 'text 0'
+    store['key0'] = {'text': 'changed', 'tweet_id': 10}
+    assert store['key0']['text'] == 'changed'
+    store.archive()
+    assert store.generations('cold')
+    assert store['key0']['text'] == 'changed'
+    store.close()
+    _cleanup()
+
+
+def test_verify():
+    _cleanup()
+    store = multidbm.MultiDBM(TEST_STORE_PATH, chunk_size=2)
+    for i in range(5):
+        store['key%i' % i] = {'text': 'text %i' % i, 'tweet_id': 10 + i}
+    store['key0'] = {'text': 'changed', 'tweet_id': 10}
+    store.archive()
+    store.close()
+    assert verify.verify_store(TEST_STORE_PATH, jobs=1)
+
+    manifest = multidbm.load_manifest(TEST_STORE_PATH)
+    manifest['generations'][-1]['checksum'] += 1
+    multidbm.save_manifest(TEST_STORE_PATH, manifest)
+    assert not verify.verify_store(TEST_STORE_PATH, jobs=1)
+    assert verify.verify_store(TEST_STORE_PATH, jobs=1, repair=True)
+    assert verify.verify_store(TEST_STORE_PATH, jobs=1)
+    _cleanup()
+
+
+def test_sync_sealed_chunks():
+    _cleanup()
+    store = multidbm.MultiDBM(TEST_STORE_PATH, chunk_size=2)
+    for i in range(5):
+        store['key%i' % i] = {'text': 'text %i' % i, 'tweet_id': 10 + i}
+    store.sync()
+    # key0 lives in the first, sealed, chunk
+    store['key0'] = {'text': 'changed', 'tweet_id': 10}
+    store.sync()
+
+    # read through other handles, the sealed chunk has the write,
+    # and its checksum matches the manifest
+    assert verify.verify_store(TEST_STORE_PATH, jobs=1)
+    reader = multidbm.MultiDBMReader(TEST_STORE_PATH)
+    assert reader['key0']['text'] == 'changed'
+    reader.close()
+    store.close()
+    _cleanup()
+
+
+def test_verify_live_store(monkeypatch):
+    _cleanup()
+    store = multidbm.MultiDBM(TEST_STORE_PATH, chunk_size=2)
+    for i in range(5):
+        store['key%i' % i] = {'text': 'text %i' % i, 'tweet_id': 10 + i}
+    store.archive()
+    store.sync()
+    # updated in place, in a sealed hot chunk, since the manifest was saved
+    store['key2'] = {'text': 'changed', 'tweet_id': 12}
+    assert not verify.verify_store(TEST_STORE_PATH, jobs=1)
+
+    # the writer holds its lock: hot chunks aren't compared, cold ones still are
+    monkeypatch.setattr(verify, 'store_is_live', lambda path, manifest: True)
+    assert verify.verify_store(TEST_STORE_PATH, jobs=1)
+    manifest = multidbm.load_manifest(TEST_STORE_PATH)
+    manifest['generations'][0]['checksum'] += 1
+    multidbm.save_manifest(TEST_STORE_PATH, manifest)
+    assert manifest['generations'][0]['tier'] == 'cold'
+    assert not verify.verify_store(TEST_STORE_PATH, jobs=1)
+    store.close()
+    _cleanup()
+
+
+def test_reader_with_live_writer():
+    _cleanup()
+    store = multidbm.MultiDBM(TEST_STORE_PATH, chunk_size=2)
+    for i in range(6):
+        store['key%i' % i] = {'text': 'text %i' % i, 'tweet_id': 10 + i}
+    store.archive()
+    # key0 is now cold; writing it again puts a newer copy in a hot chunk
+    store['key0'] = {'text': 'changed', 'tweet_id': 10}
+    store.sync()
+    assert store.generations('cold')
+
+    reader = multidbm.MultiDBMReader(TEST_STORE_PATH)
+    keys = ['key%i' % i for i in range(6)]
+    expected = dict((k, store[k]) for k in keys)
+    assert reader['key0']['text'] == 'changed'
+    assert reader['key1']['text'] == 'text 1'
+    assert 'missing' not in reader
+    assert reader.get_many(keys + ['missing']) == expected
+    items = list(reader.iteritems())
+    assert len(items) == len(keys)
+    assert dict(items) == expected
+    assert sorted(reader.iterkeys()) == keys
+    reader.close()
+    store.close()
+    _cleanup()
+
+
+def test_reader_keeps_stats():
+    _cleanup()
+    store = multidbm.MultiDBM(TEST_STORE_PATH, chunk_size=2)
+    for i in range(5):
+        store['key%i' % i] = {'text': 'text %i' % i, 'tweet_id': 10 + i}
+    store.archive()
+    stats = StatTracker()
+    stats['hits'] = 7
+    start_time = stats.start_time
+    # opening a reader, with its cold store, must not reset a running process's stats
+    reader = multidbm.MultiDBMReader(TEST_STORE_PATH, include_cold=True)
+    assert reader['key0']['text'] == 'text 0'
+    reader.close()
+    assert StatTracker()['hits'] == 7
+    assert StatTracker().start_time == start_time
+    store.close()
+    _cleanup()
+
+
+def test_candidate_lists():
+    _cleanup()
+    store = multidbm.MultiDBM(TEST_STORE_PATH)
+    one = {'text': 'text one', 'tweet_id': 10, 'anagram_hash': 'key'}
+    two = {'text': 'text two', 'tweet_id': 20, 'anagram_hash': 'key'}
+    store['key'] = [one]
+    # a single candidate is stored as it always was
+    assert store['key'] == one
+    store['key'] = [one, two]
+    assert anagramfunctions.decode_candidates(store['key'], 'key') == [one, two]
+    assert store.generations()[0]['min_id'] == 10
+    assert store.generations()[0]['max_id'] == 20
+    store.close()
+
+
+def _cleanup():
+    if os.path.exists(TEST_STORE_PATH):
+        shutil.rmtree(TEST_STORE_PATH)
@@ -0,0 +1,85 @@
+import os
+import shutil
+
+from anagramatron import anagramfinder, anagramfunctions, common, nearindex
+
+TEST_STORE_PATH = os.path.join(common.ANAGRAM_DATA_DIR, 'test_near.mdbm')
+
+texts = ['So bored all the time',
+         'Freight is so pathetic.',
+         'the quick brown fox jumps over the lazy dog',
+         'zzz quiz jazz']
+
+
+def test_hash_round_trip():
+    for text in texts:
+        in_hash = anagramfunctions.improved_hash(text)
+        assert nearindex.hash_from_counts(nearindex.hash_counts(in_hash)) == in_hash
+
+
+def test_neighbor_hashes():
+    in_hash = anagramfunctions.improved_hash('So bored all the time')
+    neighbors = set(h for h, letter, diff in nearindex.neighbor_hashes(in_hash))
+    assert anagramfunctions.improved_hash('So bored all the times') in neighbors
+    assert anagramfunctions.improved_hash('So bored all the tim') in neighbors
+    assert anagramfunctions.improved_hash('So bored all the timez') in neighbors
+    assert in_hash not in neighbors
+
+
+def test_near_hits_in_cache():
+    hits, near_hits = [], []
+    finder = anagramfinder.AnagramFinder(
+        hit_callback=lambda *args: hits.append(args),
+        near_hit_callback=lambda *args: near_hits.append(args), load_control=False)
+    finder.handle_batch(['So bored all the time', 'Berit od hates me lols'])
+    assert near_hits == [('Berit od hates me lols', 'So bored all the time')]
+    assert not hits
+    assert finder.stats['near_hits'] >= 1
+
+
+def test_exact_hits_are_preferred():
+    for batch in (False, True):
+        hits, near_hits = [], []
+        finder = anagramfinder.AnagramFinder(
+            hit_callback=lambda *args: hits.append(args),
+            near_hit_callback=lambda *args: near_hits.append(args), load_control=False)
+        finder.handle_batch(['So bored all the time', 'Berit od hates me lols'])
+        assert len(near_hits) == 1
+        superseded = finder.stats['near_superseded']
+        # an exact anagram of the first, and a near one of the second
+        inp = 'The doll bites a more'
+        assert anagramfunctions.test_near_anagram(inp, 'Berit od hates me lols')
+        if batch:
+            finder.handle_batch([inp])
+        else:
+            finder.handle_input(inp)
+        assert hits == [(inp, 'So bored all the time')]
+        assert len(near_hits) == 1
+        assert finder.stats['near_superseded'] == superseded + 1
+
+
+def test_near_hits_in_store():
+    _cleanup()
+    near_hits = []
+    finder = anagramfinder.AnagramFinder(
+        storage='mdbm', path=TEST_STORE_PATH, cachepath=TEST_STORE_PATH + '.cache',
+        near_hit_callback=lambda *args: near_hits.append(args), load_control=False)
+    tweet = {'text': 'So bored all the time', 'tweet_id': 1}
+    finder.handle_input(tweet)
+    finder._trim_cache(len(finder.cache))
+    assert not len(finder.cache)
+
+    probes = finder.stats['near_store_probes']
+    finder.handle_batch([{'text': 'Berit od hates me lols', 'tweet_id': 2}])
+    assert finder.stats['near_store_probes'] == probes + 1
+    assert len(near_hits) == 1
+    assert near_hits[0][1]['tweet_id'] == 1
+    finder.close()
+    _cleanup()
+
+
+def _cleanup():
+    if os.path.exists(TEST_STORE_PATH):
+        shutil.rmtree(TEST_STORE_PATH)
+    if os.path.exists(TEST_STORE_PATH + '.cache'):
+        os.remove(TEST_STORE_PATH + '.cache')
@@ -0,0 +1,72 @@
+import gzip
+import json
+import os
+import threading
+
+import zmq
+
+from anagramatron import replay
+
+
+def _record(path, count, segment_messages=3):
+    recorder = replay.Recorder(path, segment_messages)
+    for i in range(count):
+        recorder.write(json.dumps({'text': 'tweet %i' % i}).encode('utf-8'), 1000.0 + i)
+    recorder.close()
+
+
+def test_recording_is_indexed(tmpdir):
+    path = str(tmpdir.join('rec'))
+    _record(path, 7)
+    segments = replay.load_index(path)['segments']
+    assert [s['count'] for s in segments] == [3, 3, 1]
+    assert segments[1]['first'] == 1003.0
+    assert [json.loads(raw)['text'] for arrived, raw in replay.messages(path, start=4)] == [
+        'tweet 4', 'tweet 5', 'tweet 6']
+
+
+def test_unindexed_segment_is_recovered(tmpdir):
+    path = str(tmpdir.join('rec'))
+    _record(path, 3)
+    # a segment a crashed recorder never closed
+    with gzip.open(os.path.join(path, 'seg000001.gz'), 'wb') as f:
+        f.write(b'1010.000\t{"text": "late"}\n1011.000\t{"te')
+    recorder = replay.Recorder(path)
+    recorder.close()
+    assert [s['count'] for s in replay.load_index(path)['segments']] == [3, 1]
+    assert len(list(replay.messages(path))) == 4
+
+
+def test_describe_with_empty_segment(tmpdir):
+    path = str(tmpdir.join('rec'))
+    _record(path, 4)
+    # a crashed recorder's last segment, with nothing readable in it
+    with gzip.open(os.path.join(path, 'seg000002.gz'), 'wb') as f:
+        f.write(b'1010.0')
+    replay.Recorder(path).close()
+    assert [s['count'] for s in replay.load_index(path)['segments']] == [3, 1, 0]
+    assert replay.describe(path).startswith('4 messages in 3 segments')
+
+
+def test_replay_publishes(tmpdir):
+    path = str(tmpdir.join('rec'))
+    _record(path, 20)
+    context = zmq.Context()
+    socket = context.socket(zmq.SUB)
+    socket.setsockopt(zmq.SUBSCRIBE, b'')
+    port = socket.bind_to_random_port('tcp://127.0.0.1')
+    socket.unbind(socket.getsockopt(zmq.LAST_ENDPOINT))
+    socket.connect('tcp://127.0.0.1:%i' % port)
+
+    replayer = replay.Replayer(path, 'tcp://127.0.0.1:%i' % port, speed=0, wait=0.3,
+                               context=context)
+    thread = threading.Thread(target=replayer.run)
+    thread.start()
+    received = []
+    while len(received) < 20 and socket.poll(2000):
+        received.append(socket.recv_json())
+    thread.join()
+    socket.close()
+    context.term()
+    assert [t['text'] for t in received] == ['tweet %i' % i for i in range(20)]
+    assert replayer.stats['sent'] == 20
@@ -0,0 +1,131 @@
+import threading
+import time
+
+import pytest
+
+from anagramatron import anagramfinder, loadcontrol, runtime
+
+test_input = ['So bored all the time',
+    'Berit od hates me lol',
+    "Lord Jesus it's a fart",
+    "It's just sad forreal",
+    'time destroys all things',
+    'Freight is so pathetic.',
+    'straight piece of shit',
+    'i hate this one republic song']
+
+
+class StopStream(Exception):
+    pass
+
+
+class FakeStream(object):
+
+    """hands out batches, then raises StopStream once done() is true."""
+
+    def __init__(self, batches, done):
+        self.batches = list(batches)
+        self.done = done
+        self.acks = 0
+        self.started = False
+        self.closed = False
+        self.threads = set()
+
+    def start(self):
+        self.started = True
+
+    def get_batch(self, size, timeout):
+        self.threads.add(threading.current_thread())
+        if self.batches:
+            return self.batches.pop(0)
+        if self.done():
+            raise StopStream()
+        time.sleep(0.01)
+        return []
+
+    def ack(self):
+        self.acks += 1
+
+    def close(self):
+        self.threads.add(threading.current_thread())
+        self.closed = True
+
+
+class FakeHitManager(object):
+
+    def __init__(self, dbpath):
+        self.hits = []
+        self.enrichment = None
+        self.closed = False
+
+    def new_hit(self, first, second):
+        self.hits.append((first, second))
+
+    def close(self):
+        self.closed = True
+
+
+class FailingFinder(object):
+
+    def __init__(self, hit_callback):
+        self.load = loadcontrol.LoadController(self)
+        self.closed = False
+
+    def handle_batch(self, inputs, text_key='text'):
+        raise ValueError('bad batch')
+
+    def apply_load_level(self, level):
+        pass
+
+    def perform_maintenance(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def _runtime(monkeypatch, stream, make_finder):
+    managers = []
+    monkeypatch.setattr(runtime, '_make_hit_manager',
+                        lambda dbpath: managers.append(FakeHitManager(dbpath)) or managers[-1])
+    monkeypatch.setattr(runtime, 'STATS_INTERVAL', 0.05)
+    return runtime.AsyncRuntime(stream, make_finder, 'unused.db', poll_directs=False), managers
+
+
+def test_runtime_batches(monkeypatch):
+    finders = []
+
+    def make_finder(hit_callback):
+        finders.append(anagramfinder.AnagramFinder(hit_callback=hit_callback))
+        return finders[-1]
+
+    deadline = time.time() + 10
+    done = lambda: len(managers[0].hits) >= 3 or time.time() > deadline
+    stream = FakeStream([test_input[:3], test_input[3:6], test_input[6:]], done)
+    rt, managers = _runtime(monkeypatch, stream, make_finder)
+    with pytest.raises(StopStream):
+        rt.run()
+
+    assert sorted(first for first, second in managers[0].hits) == [
+        'Berit od hates me lol', "It's just sad forreal", 'straight piece of shit']
+    assert stream.started and stream.acks == 3
+    # the stream is only used from its own thread, and closed there
+    assert stream.closed and len(stream.threads) == 1
+    assert managers[0].closed
+    assert not rt.batches.qsize() and not rt.hits.qsize()
+
+
+def test_runtime_stops_on_error(monkeypatch):
+    finders = []
+
+    def make_finder(hit_callback):
+        finders.append(FailingFinder(hit_callback))
+        return finders[-1]
+
+    stream = FakeStream([test_input[:3]], lambda: False)
+    rt, managers = _runtime(monkeypatch, stream, make_finder)
+    with pytest.raises(ValueError):
+        rt.run()
+    # the failed batch isn't acknowledged, so an ingest service would send it again
+    assert stream.acks == 0
+    assert stream.closed and finders[0].closed and managers[0].closed
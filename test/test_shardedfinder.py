@@ -0,0 +1,168 @@
+import os
+import shutil
+
+from anagramatron import anagramfunctions, common, shardedfinder, verify
+
+TEST_STORE_PATH = os.path.join(common.ANAGRAM_DATA_DIR, 'test_sharded.mdbm')
+
+test_input = ['So bored all the time',
+    'Berit od hates me lol',
+    "Lord Jesus it's a fart",
+    "It's just sad forreal",
+    'time destroys all things',
+    'Freight is so pathetic.',
+    'straight piece of shit']
+
+
+def test_shard_for_key():
+    key = anagramfunctions.improved_hash(test_input[0])
+    other = anagramfunctions.improved_hash(test_input[1])
+    assert key == other
+    assert shardedfinder.shard_for_key(key, 4) == shardedfinder.shard_for_key(other, 4)
+    assert 0 <= shardedfinder.shard_for_key(key, 4) < 4
+
+
+def test_sharded_hits():
+    hits = []
+    finder = shardedfinder.ShardedAnagramFinder(
+        3, storage=None, hit_callback=lambda *args: hits.append(args))
+    finder.handle_batch(test_input[:4])
+    finder.handle_batch(test_input[4:])
+    finder.close()
+    assert len(hits) == 3
+
+
+def test_dead_shard():
+    finder = shardedfinder.ShardedAnagramFinder(2, storage=None, hit_callback=lambda *args: None)
+    finder._workers[0].terminate()
+    finder._workers[0].join()
+    finder.handle_batch(test_input)
+    try:
+        finder.close()
+        assert False, 'close should fail'
+    except RuntimeError as err:
+        assert 'shard 0' in str(err)
+    assert not any(worker.is_alive() for worker in finder._workers)
+
+
+def _failing_test(one, two):
+    if 'straight' in (one + two):
+        raise ValueError('bad tweet')
+    return anagramfunctions.test_anagram(one, two)
+
+
+def test_hits_before_failure():
+    hits = []
+    finder = shardedfinder.ShardedAnagramFinder(
+        1, storage=None, hit_callback=lambda *args: hits.append(args), test_func=_failing_test)
+    # the last pair fails; the two found before it in the batch are still delivered
+    finder.handle_batch(test_input)
+    finder.close()
+    assert sorted(one for one, two in hits) == ['Berit od hates me lol', "It's just sad forreal"]
+
+
+def test_reshard():
+    _cleanup()
+    tweets = [{'text': t, 'anagram_hash': anagramfunctions.improved_hash(t)}
+              for t in test_input[::2]]
+    shardedfinder.prepare_shards(TEST_STORE_PATH, 3)
+    for tweet in tweets:
+        shard = shardedfinder.shard_for_key(tweet['anagram_hash'], 3)
+        store_path, cache_path = shardedfinder.shard_paths(TEST_STORE_PATH, shard, 3)
+        store = shardedfinder.multidbm.MultiDBM(store_path)
+        store[tweet['anagram_hash']] = tweet
+        store.close()
+
+    shardedfinder.prepare_shards(TEST_STORE_PATH, 2)
+    assert sorted(os.listdir(TEST_STORE_PATH)) == [
+        'shard00-of-02', 'shard01-of-02', shardedfinder.SHARD_INFO_FILE]
+    for tweet in tweets:
+        shard = shardedfinder.shard_for_key(tweet['anagram_hash'], 2)
+        store = shardedfinder.multidbm.MultiDBM(
+            shardedfinder.shard_paths(TEST_STORE_PATH, shard, 2)[0])
+        assert store[tweet['anagram_hash']]['text'] == tweet['text']
+        store.close()
+    _cleanup()
+
+
+def _two_shards_with_cold(keys):
+    _cleanup()
+    shardedfinder.prepare_shards(TEST_STORE_PATH, 2)
+    for shard in range(2):
+        store = shardedfinder.multidbm.MultiDBM(
+            shardedfinder.shard_paths(TEST_STORE_PATH, shard, 2)[0], chunk_size=3)
+        for key in keys:
+            if shardedfinder.shard_for_key(key, 2) == shard:
+                store[key] = {'text': 'old %s' % key, 'tweet_id': 1}
+        store.archive()
+        # written again after being archived; the hot copy is newer
+        for key in keys[:4]:
+            if shardedfinder.shard_for_key(key, 2) == shard:
+                store[key] = {'text': 'new %s' % key, 'tweet_id': 2}
+        store.close()
+
+
+def test_reshard_cold():
+    keys = ['key%i' % i for i in range(12)]
+    _two_shards_with_cold(keys)
+    shardedfinder.prepare_shards(TEST_STORE_PATH, 3)
+    cold_keys = 0
+    for shard in range(3):
+        store = shardedfinder.multidbm.MultiDBM(
+            shardedfinder.shard_paths(TEST_STORE_PATH, shard, 3)[0])
+        for key in keys:
+            if shardedfinder.shard_for_key(key, 3) == shard:
+                expected = 'new %s' % key if key in keys[:4] else 'old %s' % key
+                assert store[key]['text'] == expected
+        # archived keys stay archived
+        cold_keys += sum(gen['keys'] for gen in store.generations('cold'))
+        store.close()
+    assert cold_keys >= 3
+    assert verify.verify_store(TEST_STORE_PATH + '/shard00-of-03/store', jobs=1)
+    _cleanup()
+
+
+def test_reshard_again_after_crash(monkeypatch):
+    keys = ['key%i' % i for i in range(12)]
+    _two_shards_with_cold(keys)
+    clean_path = TEST_STORE_PATH + '.clean'
+    if os.path.exists(clean_path):
+        shutil.rmtree(clean_path)
+    shutil.copytree(TEST_STORE_PATH, clean_path)
+    shardedfinder.prepare_shards(clean_path, 3)
+
+    def crash(self):
+        raise KeyboardInterrupt()
+
+    # interrupted after every candidate was copied, before the new shards are closed
+    monkeypatch.setattr(shardedfinder.multidbm.MultiDBM, 'close', crash)
+    try:
+        shardedfinder.prepare_shards(TEST_STORE_PATH, 3)
+        assert False, 'reshard should be interrupted'
+    except KeyboardInterrupt:
+        pass
+    monkeypatch.undo()
+    shardedfinder.prepare_shards(TEST_STORE_PATH, 3)
+
+    assert sorted(os.listdir(TEST_STORE_PATH)) == [
+        'shard00-of-03', 'shard01-of-03', 'shard02-of-03', shardedfinder.SHARD_INFO_FILE]
+    for shard in range(3):
+        store = shardedfinder.multidbm.MultiDBM(
+            shardedfinder.shard_paths(TEST_STORE_PATH, shard, 3)[0])
+        clean = shardedfinder.multidbm.MultiDBM(
+            shardedfinder.shard_paths(clean_path, shard, 3)[0])
+        # the same as resharding once: no cold chunk was added twice
+        assert ([(gen['name'], gen['keys']) for gen in store.generations('cold')] ==
+                [(gen['name'], gen['keys']) for gen in clean.generations('cold')])
+        for key in keys:
+            if shardedfinder.shard_for_key(key, 3) == shard:
+                assert store[key] == clean[key]
+        store.close()
+        clean.close()
+    shutil.rmtree(clean_path)
+    _cleanup()
+
+
+def _cleanup():
+    if os.path.exists(TEST_STORE_PATH):
+        shutil.rmtree(TEST_STORE_PATH)
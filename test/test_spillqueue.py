@@ -0,0 +1,58 @@
+import os
+import shutil
+
+from anagramatron import common, spillqueue
+
+TEST_PATH = os.path.join(common.ANAGRAM_DATA_DIR, 'test_spill')
+
+
+def test_spills_in_order():
+    _cleanup()
+    queue = spillqueue.SpillQueue(TEST_PATH, memory_limit=10, segment_size=4)
+    queue.extend(range(25))
+    assert len(queue) == 25
+    assert queue.memory_size() == 10
+    assert queue.disk_size() == 15
+
+    taken = [queue.popleft() for _ in range(12)]
+    queue.extend(range(25, 30))
+    while queue:
+        taken.append(queue.popleft())
+    assert taken == list(range(30))
+    assert not os.listdir(TEST_PATH)
+    _cleanup()
+
+
+def test_survives_restart():
+    _cleanup()
+    queue = spillqueue.SpillQueue(TEST_PATH, memory_limit=5, segment_size=3)
+    queue.extend({'tweet_id': i} for i in range(12))
+    taken = [queue.popleft()['tweet_id'] for _ in range(7)]
+    queue.close()
+
+    queue = spillqueue.SpillQueue(TEST_PATH, memory_limit=5, segment_size=3)
+    assert len(queue) == 5
+    queue.append({'tweet_id': 12})
+    while queue:
+        taken.append(queue.popleft()['tweet_id'])
+    assert taken == list(range(13))
+    _cleanup()
+
+
+def test_partial_write():
+    _cleanup()
+    queue = spillqueue.SpillQueue(TEST_PATH, memory_limit=2)
+    queue.extend(range(4))
+    queue.close()
+    # as if we crashed while appending
+    with open(os.path.join(TEST_PATH, 'seg1.jsonl'), 'a') as f:
+        f.write('{"trunc')
+
+    queue = spillqueue.SpillQueue(TEST_PATH, memory_limit=2)
+    assert [queue.popleft() for _ in range(len(queue))] == [0, 1, 2, 3]
+    _cleanup()
+
+
+def _cleanup():
+    if os.path.exists(TEST_PATH):
+        shutil.rmtree(TEST_PATH)
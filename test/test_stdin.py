@@ -0,0 +1,26 @@
+import io
+import os
+import shutil
+import sys
+
+from anagramatron import anagramfunctions, common, multidbm, stdin
+
+TEST_STORE_PATH = os.path.join(common.ANAGRAM_DATA_DIR, 'test_stdin.mdbm')
+
+
+def test_lookup_in_live_store(monkeypatch, capsys):
+    if os.path.exists(TEST_STORE_PATH):
+        shutil.rmtree(TEST_STORE_PATH)
+    text = 'Freight is so pathetic.'
+    store = multidbm.MultiDBM(TEST_STORE_PATH)
+    key = anagramfunctions.improved_hash(text)
+    store[key] = {'text': text, 'tweet_id': 1, 'anagram_hash': key}
+    store.sync()
+
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('straight piece of shit\nnot stored at all\n'))
+    stdin.lookup(TEST_STORE_PATH)
+    out = capsys.readouterr().out
+    assert text in out
+    assert 'seen 2, found 1' in out
+    store.close()
+    shutil.rmtree(TEST_STORE_PATH)
@@ -0,0 +1,49 @@
+from anagramatron import anagramfinder, anagramfunctions, subsetindex
+
+h = anagramfunctions.improved_hash
+
+
+def test_hidden_in_and_containing():
+    index = subsetindex.SubsetIndex()
+    for text in ['So bored all the time', 'the quick brown fox jumps over the lazy dog',
+                 'dog', 'a pathetic freight']:
+        index.add(h(text))
+    assert len(index) == 3  # 'dog' is too short to index
+
+    big = h('So bored all the time, said the quick brown fox')
+    assert set(index.hidden_in(big)) == set([h('So bored all the time')])
+    assert index.hidden_in(h('So bored all the time')) == []
+    assert set(index.containing(h('bored toast'))) == set(
+        [h('So bored all the time'), h('the quick brown fox jumps over the lazy dog')])
+
+
+def test_scan_matches_enumeration():
+    index = subsetindex.SubsetIndex()
+    for text in ['So bored all the time', 'Freight is so pathetic.']:
+        index.add(h(text))
+    key = h('So bored all the time, and freight is so pathetic')
+    # few groups: the groups are scanned rather than enumerating submasks
+    assert set(index.hidden_in(key)) == set([h('So bored all the time'),
+                                             h('Freight is so pathetic.')])
+    for mask in range(1, 1 << 20):
+        index._groups.setdefault(mask, set())
+    # many groups: submasks are enumerated
+    assert set(index.hidden_in(key)) == set([h('So bored all the time'),
+                                             h('Freight is so pathetic.')])
+
+
+def test_pairs():
+    index = subsetindex.SubsetIndex()
+    for text in ['So bored all the time', 'Freight is so pathetic.']:
+        index.add(h(text))
+    pairs = index.pairs(h('So bored all the time. Freight is so pathetic.'))
+    assert pairs == [tuple(sorted([h('So bored all the time'), h('Freight is so pathetic.')]))]
+
+
+def test_finder_queries_cache():
+    finder = anagramfinder.AnagramFinder(load_control=False, subset_index=True)
+    finder.handle_batch(['So bored all the time', 'Freight is so pathetic.'])
+    found = finder.find_hidden_in('So bored all the time, it is so pathetic, freight')
+    assert sorted(c for cs in found.values() for c in cs) == [
+        'Freight is so pathetic.', 'So bored all the time']
+    assert list(finder.find_containing('bored lime').values()) == [['So bored all the time']]
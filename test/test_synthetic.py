@@ -0,0 +1,59 @@
+import threading
+
+import zmq
+
+from anagramatron import anagramfinder, anagramfunctions, synthetic
+
+
+def test_generator_counts_what_it_makes():
+    generator = synthetic.TweetGenerator({'anagram': 0.05}, seed=3)
+    tweets = [generator.tweet() for i in range(3000)]
+    assert sum(generator.counts.values()) == 3000
+    assert len(set(t['id_str'] for t in tweets)) == 3000
+    passed = [anagramfunctions.filter_tweet(t) for t in tweets]
+    assert sum(1 for p in passed if p) == generator.expected_passing()
+
+    hits = []
+    finder = anagramfinder.AnagramFinder(hit_callback=lambda one, two: hits.append(one),
+                                         load_control=False)
+    finder.handle_batch([p for p in passed if p])
+    assert generator.expected_hits() > 50
+    assert len(hits) == generator.expected_hits()
+
+
+def test_generator_is_seeded():
+    one = synthetic.TweetGenerator(seed=1)
+    two = synthetic.TweetGenerator(seed=1)
+    assert [one.tweet()['text'] for i in range(100)] == [two.tweet()['text'] for i in range(100)]
+
+
+def test_bad_rates():
+    for rates in ({'retweet': 0.9, 'mention': 0.2}, {'emoji': 0.1}):
+        try:
+            synthetic.TweetGenerator(rates)
+            assert False, rates
+        except ValueError:
+            pass
+
+
+def test_publish():
+    context = zmq.Context()
+    socket = context.socket(zmq.SUB)
+    socket.setsockopt(zmq.SUBSCRIBE, b'')
+    port = socket.bind_to_random_port('tcp://127.0.0.1')
+    socket.unbind(socket.getsockopt(zmq.LAST_ENDPOINT))
+    socket.connect('tcp://127.0.0.1:%i' % port)
+
+    generator = synthetic.TweetGenerator(seed=2)
+    thread = threading.Thread(target=synthetic.publish, args=(
+        generator, 'tcp://127.0.0.1:%i' % port), kwargs=dict(limit=50, wait=0.3, context=context))
+    thread.start()
+    received = []
+    while len(received) < 50 and socket.poll(2000):
+        received.append(socket.recv_json())
+    thread.join()
+    socket.close()
+    context.term()
+    assert len(received) == 50
+    assert sum(generator.counts.values()) == 50
+    assert all('entities' in t and 'lang' in t for t in received)
@@ -0,0 +1,99 @@
+import time
+
+from anagramatron import twitterhandler
+
+
+class StubStatuses(object):
+    def __init__(self):
+        self.lookups = []
+        self.retweets = []
+        self.oembeds = []
+
+    def lookup(self, _id, **kwargs):
+        ids = [int(i) for i in _id.split(',')]
+        self.lookups.append(ids)
+        # odd ids have been deleted
+        return [{'id_str': str(i), 'text': 'tweet %i' % i,
+                 'user': {'screen_name': 'user%i' % i}} for i in ids if not i % 2]
+
+    def retweet(self, id):
+        self.retweets.append(id)
+        return True
+
+    def oembed(self, _id):
+        self.oembeds.append(_id)
+        return {'html': '<blockquote>%s</blockquote>' % _id}
+
+
+class StubTumblr(object):
+    def __init__(self):
+        self.posts = []
+
+    def post(self, method, blog_url, params):
+        self.posts.append(params)
+        return True
+
+
+class StubTwitter(object):
+    def __init__(self):
+        self.statuses = StubStatuses()
+
+
+def _handler():
+    handler = twitterhandler.TwitterHandler.__new__(twitterhandler.TwitterHandler)
+    handler.twitter = StubTwitter()
+    handler.tmblr = StubTumblr()
+    return handler
+
+
+def test_ttl_cache():
+    cache = twitterhandler.TTLCache(maxsize=2, ttl=0.1)
+    cache.set(1, 'one')
+    cache.set(2, 'two')
+    cache.set(3, 'three')
+    assert cache.get(1) is None
+    assert cache.get(3) == 'three'
+    time.sleep(0.15)
+    assert cache.get(3) is None
+
+
+def test_fetch_tweets():
+    twitterhandler._tweet_cache.clear()
+    handler = _handler()
+    tweets = handler.fetch_tweets(range(250))
+    assert len(handler.twitter.statuses.lookups) == 3
+    assert max(len(ids) for ids in handler.twitter.statuses.lookups) == 100
+    assert sorted(tweets) == list(range(0, 250, 2))
+
+    # fetched tweets are cached; missing ones are asked for again
+    handler.fetch_tweets([2, 4, 5])
+    assert handler.twitter.statuses.lookups[-1] == [5]
+    assert handler.get_tweet(4)['text'] == 'tweet 4'
+    assert len(handler.twitter.statuses.lookups) == 4
+
+
+def test_post_enriched_hit():
+    twitterhandler._tweet_cache.clear()
+    twitterhandler._oembed_cache.clear()
+    handler = _handler()
+    hit = {'tweet_one': {'tweet_id': 2, 'fetched': {
+               'user': {'screen_name': 'one'}, 'oembed_html': '<p>one</p>'}},
+           'tweet_two': {'tweet_id': 4, 'fetched': {
+               'user': {'screen_name': 'two'}, 'oembed_html': '<p>two</p>'}}}
+    assert handler.post_hit(hit)
+    # only the retweets go to twitter
+    assert handler.twitter.statuses.retweets == [2, 4]
+    assert not handler.twitter.statuses.lookups
+    assert not handler.twitter.statuses.oembeds
+    assert '<p>one</p>' in handler.tmblr.posts[0]['body']
+
+
+def test_post_unenriched_hit():
+    twitterhandler._tweet_cache.clear()
+    twitterhandler._oembed_cache.clear()
+    handler = _handler()
+    hit = {'tweet_one': {'tweet_id': 2}, 'tweet_two': {'tweet_id': 4}}
+    assert handler.post_hit(hit)
+    assert handler.twitter.statuses.lookups == [[2, 4]] or \
+        handler.twitter.statuses.lookups == [[4, 2]]
+    assert sorted(handler.twitter.statuses.oembeds) == ['2', '4']